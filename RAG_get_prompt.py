@@ -1,8 +1,14 @@
 # 知识库查询工具 - RAG增强Prompt生成器 v1.1（优化版）
+# 交互模式：python RAG_get_prompt.py
+# 批处理模式：python RAG_get_prompt.py --input queries.jsonl --output prompts.jsonl
+import argparse
+import json
+import sys
 import pandas as pd
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
+from vector_index import load_or_build_index, normalize_rows, normalize_vector
 import os
 # 提前运行一次模型保存代码!!（只需执行一次）
 # from sentence_transformers import SentenceTransformer
@@ -27,7 +33,27 @@ def generate_query_embedding(query, model):
     """生成查询的词向量"""
     return model.encode([query])[0]
 
-def find_similar_texts(query_vec, df, top_n=7, similarity_threshold=0.5):  # 修改阈值
+def build_index(df, index_type="exact", embeddings_file=None, **index_params):
+    """构建（或加载）向量索引，供 find_similar_texts 复用"""
+    matrix = normalize_rows(np.stack(df['embedding'].values))
+    return load_or_build_index(
+        matrix, index_type=index_type, embeddings_file=embeddings_file, **index_params
+    )
+
+def find_similar_texts(query_vec, df, top_n=7, similarity_threshold=0.5, index=None):  # 修改阈值
+    if index is not None:
+        # 使用预建索引（精确或近似），只返回前top_n个候选
+        top_indices, similarities = index.search(normalize_vector(query_vec), top_n)
+        qualified = similarities >= similarity_threshold
+
+        print(f"\n[DEBUG] 候选段落数：{int(qualified.sum())}（{index.index_type} 索引）")
+        if similarities.size:
+            print(f"[DEBUG] 相似度范围：{np.min(similarities):.2f}-{np.max(similarities):.2f}")
+
+        if qualified.any():
+            top_indices = top_indices[qualified]
+        return df.iloc[top_indices]
+
     embeddings = np.stack(df['embedding'].values)
     similarities = cosine_similarity([query_vec], embeddings)[0]
     
@@ -45,11 +71,43 @@ def find_similar_texts(query_vec, df, top_n=7, similarity_threshold=0.5):  # 修
     
     return df.iloc[top_indices]
 
+def batch_find_similar(query_vecs, matrix, top_n=7, similarity_threshold=0.5):
+    """
+    批量检索：整批查询与知识库矩阵只做一次矩阵乘法，再逐行取top-k
+    
+    参数：
+    query_vecs: 查询向量矩阵 (batch, dim)
+    matrix: 已归一化的知识库矩阵 (n, dim)
+    
+    返回：
+    每个查询的 (下标数组, 相似度数组) 列表，阈值语义与 find_similar_texts 一致
+    """
+    scores = normalize_rows(query_vecs) @ matrix.T
+    k = min(top_n, matrix.shape[0])
+    if k <= 0:
+        return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))] * len(scores)
+
+    # 按行argpartition取出前k个候选，再对这k个排序
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    candidates = np.take_along_axis(candidates, order, axis=1)
+    candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+    results = []
+    for indices, similarities in zip(candidates, candidate_scores):
+        qualified = similarities >= similarity_threshold
+        if qualified.any():
+            indices, similarities = indices[qualified], similarities[qualified]
+        results.append((indices, similarities))
+    return results
+
 def create_rag_prompt(query, similar_texts, max_context_length=2000):  # 增加长度限制
     context_parts = []
     current_length = 0
     
-    for text in similar_texts['text'].values:
+    texts = similar_texts['text'].values if isinstance(similar_texts, pd.DataFrame) else similar_texts
+    for text in texts:
         text_segment = f"相关段落：{text}"
         added_length = len(text_segment) + 2
         
@@ -68,20 +126,123 @@ def create_rag_prompt(query, similar_texts, max_context_length=2000):  # 增加
     return f"用户查询：{query}\n\n以下是可供参考的资料，请尽可能根据相关段落提供详细回答：\n{context}"
 
 
+# JSONL中查询文本所在字段，未指定时按顺序查找
+QUERY_FIELDS = ("query", "question", "text", "title", "body")
+# 原样带到输出中的标识字段
+ID_FIELDS = ("id", "request_id")
+
+def iter_jsonl_queries(file_path, field=None):
+    """逐行读取JSONL，返回 (行号, 原始记录, 查询文本)；跳过空行、无效JSON与无查询文本的行"""
+    with open(file_path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"跳过第 {line_no} 行：无效的JSON（{e.msg}）", file=sys.stderr)
+                continue
+            if not isinstance(record, (str, dict)):
+                print(f"跳过第 {line_no} 行：应为字符串或对象", file=sys.stderr)
+                continue
+            if isinstance(record, str):
+                query = record
+            elif field:
+                query = record.get(field)
+            else:
+                query = next((record[name] for name in QUERY_FIELDS if record.get(name)), None)
+            if not query:
+                print(f"跳过第 {line_no} 行：没有查询文本", file=sys.stderr)
+                continue
+            yield line_no, record, str(query)
+
+def _batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def run_batch(input_file, output_file, df, model, matrix, top_n=7, similarity_threshold=0.5,
+              max_context_length=2000, batch_size=256, field=None):
+    """
+    批处理：流式读取查询JSONL，按批编码与检索，逐行写出增强后的prompt（JSONL）
+    
+    返回：
+    处理的查询数
+    """
+    texts = df['text'].values
+    out = sys.stdout if output_file in (None, '-') else open(output_file, 'w', encoding='utf-8')
+    total = 0
+    try:
+        for batch in _batches(iter_jsonl_queries(input_file, field), batch_size):
+            queries = [query for _, _, query in batch]
+            query_vecs = model.encode(queries, batch_size=batch_size)
+            results = batch_find_similar(query_vecs, matrix, top_n, similarity_threshold)
+            for (line_no, record, query), (indices, similarities) in zip(batch, results):
+                row = {"line": line_no}
+                if isinstance(record, dict):
+                    row.update({name: record[name] for name in ID_FIELDS if name in record})
+                row["query"] = query
+                row["prompt"] = create_rag_prompt(query, texts[indices], max_context_length)
+                row["matches"] = [
+                    {"index": int(i), "score": round(float(score), 4)}
+                    for i, score in zip(indices, similarities)
+                ]
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+            out.flush()
+            total += len(batch)
+            print(f"已处理 {total} 条查询", file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return total
+
+
 def main():
+    parser = argparse.ArgumentParser(description="知识库查询工具（不带参数时进入交互模式）")
+    parser.add_argument("--input", help="查询JSONL文件，每行一个对象（或字符串），启用批处理模式")
+    parser.add_argument("--output", default="-", help="输出JSONL文件，默认输出到标准输出")
+    parser.add_argument("--field", default=None, help=f"查询文本字段，默认依次查找 {'/'.join(QUERY_FIELDS)}")
+    parser.add_argument("--batch-size", type=int, default=256, help="每批编码与检索的查询数")
+    args = parser.parse_args()
+
     # 配置参数
     EMBEDDINGS_FILE = "embeddings.parquet"
     MODEL_NAME = './local_model'  # 指向本地路径
     # MODEL_NAME = 'all-MiniLM-L6-v2'
     TOP_N = 7  # 新增返回的文本块数量
     SIMILARITY_THRESHOLD = 0.5  # 新增相似度阈值
+    INDEX_TYPE = "exact"  # 向量索引类型：exact（精确）/ ivf（近似）
+    INDEX_PARAMS = {"nprobe": 8}  # 近似索引参数，nprobe越大召回越高
     
     if not os.path.exists(EMBEDDINGS_FILE):
         print(f"错误：嵌入文件不存在 {EMBEDDINGS_FILE}")
         return
     
+    if args.input:
+        # 批处理模式：进度信息写到标准错误，标准输出只包含JSONL结果
+        print("加载知识库...", file=sys.stderr)
+        df = load_embeddings(EMBEDDINGS_FILE)
+        matrix = normalize_rows(np.stack(df['embedding'].values))
+        print("加载词嵌入模型...", file=sys.stderr)
+        model = SentenceTransformer(MODEL_NAME)
+        run_batch(
+            args.input, args.output, df, model, matrix,
+            top_n=TOP_N,
+            similarity_threshold=SIMILARITY_THRESHOLD,
+            batch_size=args.batch_size,
+            field=args.field
+        )
+        return
+    
     print("加载知识库...")
     df = load_embeddings(EMBEDDINGS_FILE)
+    index = build_index(df, INDEX_TYPE, EMBEDDINGS_FILE, **INDEX_PARAMS)
     
     print("加载词嵌入模型...")
     model = SentenceTransformer(MODEL_NAME)
@@ -96,7 +257,8 @@ def main():
             similar_texts = find_similar_texts(
                 query_vec, df, 
                 top_n=TOP_N,
-                similarity_threshold=SIMILARITY_THRESHOLD
+                similarity_threshold=SIMILARITY_THRESHOLD,
+                index=index
             )
             
             rag_prompt = create_rag_prompt(query, similar_texts)
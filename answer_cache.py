@@ -0,0 +1,190 @@
+# answer_cache.py
+import re
+import threading
+import time
+import unicodedata
+import numpy as np
+from vector_index import normalize_vector
+
+# 实体签名的组成：连续的中日韩文字、英文单词、数字（忽略标点、空白与大小写）
+_SIGNATURE_TOKEN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z]+|[0-9]+(?:\.[0-9]+)?")
+
+# 中文提问中的功能词与常见用语：在这些词处切分，剩余片段视为实体（港口、地名等）。
+# 不含常出现在港口名中的字（如"基本"、"世界"），长词优先匹配
+_FUNCTION_WORDS = sorted([
+    "从", "由", "到", "至", "去", "往", "经", "经过", "途经", "前往", "发往", "运往",
+    "和", "与", "及", "以及", "或", "或者", "的", "了", "吗", "呢", "吧", "啊",
+    "是", "有", "在", "都", "也", "还", "哪", "哪些", "哪个", "哪里", "什么", "怎么", "怎么样", "怎样",
+    "如何", "为什么", "多少", "多久", "几", "请", "请问", "帮我", "给我", "一下", "我", "我们", "你",
+    "想", "要", "需要", "可以", "能", "能否", "是否", "会", "应该",
+    "分析", "查询", "查看", "推荐", "介绍", "说明", "评估", "比较", "对比", "告诉",
+    "航线", "路线", "航程", "航运", "海运", "运输", "风险", "天气", "情况", "成本", "费用",
+    "时间", "建议", "方案", "最优", "最佳", "最快",
+], key=len, reverse=True)
+_FUNCTION_PATTERN = re.compile("|".join(map(re.escape, _FUNCTION_WORDS)))
+_ENGLISH_STOPWORDS = frozenset(
+    "a an and are at be between by can do does for from how i in is me of on or please "
+    "port ports route routes risk show the there to via weather what which with".split()
+)
+_PORT_SUFFIX = re.compile("(港口|港)$")
+
+
+def entity_signature(text):
+    """
+    查询的实体签名：NFKC规范化、忽略大小写后，按出现顺序取出的港口/地名片段与数字
+
+    中文片段在功能词处切分并去掉"港"/"港口"后缀（单字片段丢弃），英文去掉常见虚词，
+    其余用语的差异交给向量相似度判断。例如 "世界基本港有哪些" 与 "世界基本港是哪些" 签名相同；
+    港口顺序（"从上海到鹿特丹" 与 "从鹿特丹到上海"）、港口名或数字不同的查询签名不同。
+    """
+    if text is None:
+        return None
+    entities = []
+    for token in _SIGNATURE_TOKEN.findall(unicodedata.normalize("NFKC", str(text)).casefold()):
+        if token[0] >= "\u3400":
+            for piece in _FUNCTION_PATTERN.split(token):
+                piece = _PORT_SUFFIX.sub("", piece)
+                if len(piece) > 1:
+                    entities.append(piece)
+        elif token not in _ENGLISH_STOPWORDS:
+            entities.append(token)
+    return tuple(entities)
+
+
+class SemanticAnswerCache:
+    """
+    语义回答缓存
+
+    以查询向量为键缓存最终分析报告：新查询与某条未过期缓存的余弦距离
+    不超过 max_distance、且实体签名相同（见 entity_signature）时直接返回缓存的报告。
+    向量平均池化后港口顺序或单个港口名不同的查询距离很近，仅凭向量会返回其他航线的报告。
+    向量存放在预分配的矩阵中，查找只需一次矩阵-向量点积；容量满时先淘汰过期条目，再淘汰最久未命中的条目。
+    知识库热加载后版本号变化（见 set_version），旧知识库生成的报告全部失效。
+    """
+
+    def __init__(self, max_entries=512, max_distance=0.05, ttl=3600, tool_ttl=600):
+        """
+        参数：
+        max_entries: 最大缓存条目数
+        max_distance: 命中所需的最大余弦距离（1 - 余弦相似度）
+        ttl: 普通回答的有效期（秒）
+        tool_ttl: 使用了实时工具（如天气）的回答有效期（秒），应短于ttl
+        """
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.tool_ttl = tool_ttl
+        self.hits = 0
+        self.misses = 0
+        self.version = None
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._expires = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._answers = [None] * max_entries
+        self._signatures = [None] * max_entries
+
+    def set_version(self, version):
+        """设置知识库版本（如嵌入文件修改时间），与当前版本不同时清空缓存"""
+        if version is None or version == self.version:
+            return
+        with self._lock:
+            if version == self.version:
+                return
+            if self.version is not None:
+                print("知识库已更新，清空语义回答缓存")
+                self._clear_locked()
+            self.version = version
+
+    def _match(self, query_vec, signature, live):
+        """距离不超过max_distance且实体签名相同的最近条目，没有时返回None"""
+        scores = np.where(live, self._vectors @ query_vec, -np.inf)
+        candidates = np.flatnonzero(scores >= 1.0 - self.max_distance)
+        for slot in candidates[np.argsort(-scores[candidates])]:
+            if self._signatures[slot] == signature:
+                return int(slot)
+        return None
+
+    def get(self, query_vec, query_text=None):
+        """
+        查找语义相近、实体签名相同且未过期的回答，未命中返回None
+
+        参数：
+        query_vec: 查询向量
+        query_text: 查询原文（用于实体签名校验）
+        """
+        if query_vec is None or self._vectors is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        query_vec = normalize_vector(query_vec)
+        signature = entity_signature(query_text)
+        now = time.time()
+        with self._lock:
+            best = self._match(query_vec, signature, self._expires > now)
+            if best is None:
+                self.misses += 1
+                return None
+            self._last_used[best] = now
+            self.hits += 1
+            return self._answers[best]
+
+    def put(self, query_vec, answer, used_tools=False, query_text=None, version=None):
+        """
+        写入回答；used_tools为True时使用较短的tool_ttl
+
+        version: 生成该回答时的知识库版本，与当前版本不同（生成期间发生了热加载）时不写入
+        """
+        if query_vec is None or not answer or self.max_entries <= 0:
+            return
+
+        query_vec = normalize_vector(query_vec)
+        signature = entity_signature(query_text)
+        now = time.time()
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, query_vec.size), dtype=np.float32)
+            slot = self._choose_slot(query_vec, signature, now)
+            self._vectors[slot] = query_vec
+            self._expires[slot] = now + (self.tool_ttl if used_tools else self.ttl)
+            self._last_used[slot] = now
+            self._answers[slot] = answer
+            self._signatures[slot] = signature
+
+    def _choose_slot(self, query_vec, signature, now):
+        """同一查询的条目原位覆盖；否则优先复用空位或过期条目，再淘汰最久未使用的条目"""
+        live = self._expires > now
+        if live.any():
+            best = self._match(query_vec, signature, live)
+            if best is not None:
+                return best
+
+        expired = np.flatnonzero(self._expires <= now)
+        if expired.size:
+            return int(expired[0])
+        return int(np.argmin(self._last_used))
+
+    def stats(self):
+        """命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": int(np.count_nonzero(self._expires > time.time())),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def clear(self):
+        """清空缓存（例如知识库更新后）"""
+        with self._lock:
+            self._clear_locked()
+
+    def _clear_locked(self):
+        self._expires[:] = 0
+        self._answers = [None] * self.max_entries
+        self._signatures = [None] * self.max_entries
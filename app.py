@@ -1,33 +1,83 @@
 #!/usr/bin/env python3
 
 import os
-from flask import Flask, render_template_string, request
+import time
+from flask import Flask, jsonify, render_template_string, request
 import google.generativeai as genai
-import requests
-from main_logic import run_4_7_logic  # 引入4.7分析逻辑
+from circuit_breaker import breaker_stats
+from main_logic import readiness, run_4_7_logic, start_warmup  # 引入4.7分析逻辑
+from weather_cache import get_weather_cache
 
 # 设置 Google Gemini API Key（推荐从环境变量读取，更安全）
 genai.configure(api_key=os.environ.get("GOOGLE_API_KEY"))
 WEATHER_API_KEY = os.environ.get("WEATHER_API_KEY", "00fe8681e06234c50dae98fafeef312e")
+# 一次航线分析中全部港口天气查询的总时限（秒），超时的港口记为暂不可用
+WEATHER_DEADLINE = float(os.environ.get("WEATHER_DEADLINE", "6"))
+WEATHER_UNAVAILABLE = "暂不可用（unavailable）"
 
 app = Flask(__name__)
 
+# 后台预热RAG模型、索引与大模型客户端；航线优化请求不依赖它们，启动后即可响应
+start_warmup()
+
+
+# 航线分析使用的天气服务：与工具调用共用缓存、连接池、重试与熔断，描述语言保持接口默认（英文）
+_route_weather_service = None
+
+
+def _get_route_weather_service():
+		global _route_weather_service
+		if _route_weather_service is None:
+				from weather_service import WeatherService
+				_route_weather_service = WeatherService(geonames_user=None, owm_api_key=WEATHER_API_KEY, lang=None)
+		return _route_weather_service
+
+
+def _describe(weather):
+		return weather["weather_desc"] if weather else "天气获取失败"
+
 
 # 获取实时天气
 def get_real_time_weather(port):
+		# 热门港口在缓存有效期内不再请求接口，过期后先返回旧值再后台刷新
 		try:
-				url = f"https://api.openweathermap.org/data/2.5/weather?q={port}&appid={WEATHER_API_KEY}&units=metric"
-				r = requests.get(url)
-				return r.json()['weather'][0]['description']
+				return _describe(_get_route_weather_service().get_weather(location=port))
 		except Exception as e:
 				return f"天气获取失败：{e}"
-	
-	
+
+
+def fetch_ports_weather(ports, deadline=None):
+		"""
+		批量查询多个港口的天气，返回 {港口: 天气}
+
+		通过 WeatherService.get_weather_many 查询：已知城市id的港口合并为一次批量请求，其余在共享线程池中并发单独查询。
+		总耗时不超过deadline秒，届时仍未完成的港口取缓存中的旧值，没有旧值时记为暂不可用。
+		"""
+		deadline = WEATHER_DEADLINE if deadline is None else deadline
+		ports = list(dict.fromkeys(ports))
+		service = _get_route_weather_service()
+		started = time.monotonic()
+		weather = service.get_weather_many(ports, timeout=deadline)
+		results = {}
+		for port in ports:
+				if port in weather:
+						results[port] = _describe(weather[port])
+						continue
+				stale = service.peek_weather(port)
+				if stale is None:
+						print(f"⌛ {port} 天气查询超过 {deadline:.1f} 秒，记为暂不可用")
+				results[port] = _describe(stale) if stale else WEATHER_UNAVAILABLE
+		print(f"🌦️ {len(ports)} 个港口天气查询耗时 {time.monotonic() - started:.2f} 秒")
+		return results
+
+
 # 航线优化逻辑
 def generate_analysis(start, end, middle_ports):
-		start_weather = get_real_time_weather(start)
-		end_weather = get_real_time_weather(end)
-		middle_weather = [get_real_time_weather(p) for p in middle_ports]
+		# 起止港与中间港口的天气一次批量查询，总耗时约等于最慢的一次上游请求
+		weather = fetch_ports_weather([start, end, *middle_ports])
+		start_weather = weather[start]
+		end_weather = weather[end]
+		middle_weather = [weather[p] for p in middle_ports]
 	
 		# 构建模型的输入内容（prompt）
 		prompt = (
@@ -411,6 +461,22 @@ def home():
 		return render_template_string(html_template)
 
 
+# 就绪检查：全部组件预热完成返回200，否则返回503及各组件状态
+@app.route("/ready")
+def ready():
+		status = readiness()
+		return jsonify(status), (200 if status["ready"] else 503)
+
+
+# 运行指标：天气缓存命中情况与各外部接口熔断器状态
+@app.route("/metrics")
+def metrics():
+		return jsonify({
+				"weather_cache": get_weather_cache().stats(),
+				"circuit_breakers": breaker_stats(),
+		})
+
+
 # 启动服务，适配云服务器监听
 if __name__ == "__main__":
 		app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,293 @@
+# benchmark_rag.py
+# RAG检索与编码性能基准：加载耗时、查询编码、不同规模合成向量上的检索延迟与召回率、上下文组装耗时
+# 结果写为JSON，可用 --compare 与其他提交的结果对比
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from vector_index import ExactIndex, IVFIndex, QuantizedMatrix, normalize_rows, rescore
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+DEFAULT_BATCH_SIZES = (1, 8, 32, 128)
+DIM = 384
+
+# 编码基准使用的查询（长度与真实用户提问相近）
+SAMPLE_QUERIES = [
+    "世界基本港？",
+    "苏伊士运河通航条件",
+    "今天上海港的天气怎么样？",
+    "船舶在恶劣天气下进港需要注意哪些安全事项",
+    "SOLAS-74 公约对救生设备的要求",
+    "What is the average waiting time at the port of Singapore?",
+    "油轮运价指数主要参考哪些指标",
+    "欧洲航线的基本港有哪些",
+]
+
+# 对比结果时只看耗时类指标（越小越好）
+_TIMING_KEYS = ("seconds", "_ms")
+
+
+def _percentiles(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "mean_ms": float(samples.mean()),
+    }
+
+
+def _timed(fn, repeat):
+    """重复调用fn，返回每次耗时（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return samples
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def synthetic_corpus(n, dim=DIM, seed=0, block=100000):
+    """
+    生成带簇结构的合成向量（簇中心 + 噪声，已归一化），比均匀随机向量更接近真实嵌入分布
+    分块生成，1M x 384 只占用结果矩阵本身的内存
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, int(np.sqrt(n)))
+    centers = normalize_rows(rng.standard_normal((n_clusters, dim), dtype=np.float32))
+    matrix = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, block):
+        end = min(start + block, n)
+        labels = rng.integers(0, n_clusters, end - start)
+        matrix[start:end] = centers[labels]
+        matrix[start:end] += rng.standard_normal((end - start, dim), dtype=np.float32) * 0.06
+    return normalize_rows(matrix)
+
+
+def synthetic_queries(matrix, n_queries, seed=1):
+    """从语料中抽样并加噪声作为查询，保证每个查询都有真实的近邻"""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, matrix.shape[0], n_queries)
+    queries = matrix[rows] + rng.standard_normal((n_queries, matrix.shape[1]), dtype=np.float32) * 0.03
+    return normalize_rows(queries)
+
+
+def _recall(results, truth, k):
+    hits = sum(len(np.intersect1d(found[:k], expected[:k])) for found, expected in zip(results, truth))
+    return hits / float(k * len(truth))
+
+
+def measure_paths(matrix, queries, k=7, nprobe=8, rescore_factor=4):
+    """在同一矩阵上测量精确检索与各快速路径（IVF、int8量化+重排序）的延迟与召回率"""
+    exact = ExactIndex(matrix)
+    truth = [exact.search(q, k)[0] for q in queries]
+    paths = {"exact": (exact, None)}
+
+    start = time.perf_counter()
+    ivf = IVFIndex(matrix, nprobe=nprobe)
+    ivf.train()
+    paths["ivf"] = (ivf, time.perf_counter() - start)
+
+    for quantization in QuantizedMatrix.QUANTIZATION_TYPES:
+        start = time.perf_counter()
+        quantized = ExactIndex(QuantizedMatrix.from_matrix(matrix, quantization))
+        paths[quantization] = (quantized, time.perf_counter() - start)
+
+    results = []
+    for name, (index, build_seconds) in paths.items():
+        if name in QuantizedMatrix.QUANTIZATION_TYPES:
+            # 与 RAGPromptGenerator 相同：量化矩阵粗排后用全精度向量重排序
+            def search(q, index=index):
+                candidates, _ = index.search(q, k * rescore_factor)
+                return rescore(matrix, candidates, q, k)
+        else:
+            def search(q, index=index):
+                return index.search(q, k)
+
+        found, samples = [], []
+        for q in queries:
+            start = time.perf_counter()
+            indices, _ = search(q)
+            samples.append((time.perf_counter() - start) * 1000.0)
+            found.append(indices)
+
+        entry = {"path": name, "k": k, **_percentiles(samples),
+                 f"recall@{k}": _recall(found, truth, k)}
+        if build_seconds is not None:
+            entry["build_seconds"] = build_seconds
+        if name == "ivf":
+            entry["nlist"], entry["nprobe"] = ivf.nlist, ivf.nprobe
+        results.append(entry)
+        print(f"  {name:8s} p50 {entry['p50_ms']:.3f}ms  recall@{k} {entry[f'recall@{k}']:.3f}")
+    return results
+
+
+def bench_search(sizes, n_queries=200, k=7, nprobe=8, rescore_factor=4):
+    """各规模合成向量上的检索延迟与召回率"""
+    results = []
+    for n in sizes:
+        print(f"检索基准：{n} 条合成向量...")
+        matrix = synthetic_corpus(n)
+        queries = synthetic_queries(matrix, n_queries)
+        for entry in measure_paths(matrix, queries, k, nprobe, rescore_factor):
+            results.append({"n_vectors": n, **entry})
+        del matrix
+    return results
+
+
+def bench_generator(embeddings_file, model_path, generator_params, batch_sizes, repeat=20,
+                    k=7, nprobe=8):
+    """真实知识库与本地模型上的加载、编码、检索与上下文组装耗时"""
+    from rag_prompt_generator import RAGPromptGenerator
+
+    start = time.perf_counter()
+    generator = RAGPromptGenerator(embeddings_file, model_path, **generator_params)
+    load = {"seconds": time.perf_counter() - start, "n_chunks": generator.n_chunks}
+
+    encode = []
+    for batch_size in batch_sizes:
+        texts = [SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)] for i in range(batch_size)]
+        generator._encode_queries(texts)  # 预热
+        samples = _timed(lambda: generator._encode_queries(texts), repeat)
+        entry = {"batch_size": batch_size, **_percentiles(samples)}
+        entry["queries_per_second"] = batch_size * 1000.0 / entry["mean_ms"]
+        encode.append(entry)
+        print(f"编码 batch={batch_size}: p50 {entry['p50_ms']:.2f}ms，"
+              f"{entry['queries_per_second']:.1f} 条/秒")
+
+    query_vecs = normalize_rows(generator._encode_queries(SAMPLE_QUERIES))
+    retrieve_samples, context_samples = [], []
+    for _ in range(repeat):
+        for query, vec in zip(SAMPLE_QUERIES, query_vecs):
+            start = time.perf_counter()
+            kb, indices, similarities = generator._retrieve(vec, query)
+            middle = time.perf_counter()
+            generator._create_prompt_context(kb, indices, similarities)
+            end = time.perf_counter()
+            retrieve_samples.append((middle - start) * 1000.0)
+            context_samples.append((end - middle) * 1000.0)
+
+    # 真实知识库上快速路径的召回率（查询为示例问题与抽样段落开头）
+    print(f"检索基准：知识库 {generator.n_chunks} 个段落...")
+    rng = np.random.default_rng(0)
+    rows = rng.choice(generator.n_chunks, min(generator.n_chunks, 100), replace=False)
+    texts = [text[:64] for text in generator.texts.get_many(rows)]
+    queries = np.vstack([query_vecs, normalize_rows(generator._encode_queries(texts))])
+    matrix = generator.embeddings if generator.full_embeddings is None else generator.full_embeddings
+    paths = measure_paths(np.ascontiguousarray(matrix, dtype=np.float32), queries, k, nprobe)
+    generator.close()
+
+    return {
+        "load": load,
+        "encode": encode,
+        "retrieve": _percentiles(retrieve_samples),
+        "context": _percentiles(context_samples),
+        "paths": paths,
+    }
+
+
+def _flatten(value, prefix=""):
+    """将结果展开为 {路径: 数值}，列表元素按 n_vectors/path/batch_size 命名"""
+    flat = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flat.update(_flatten(item, f"{prefix}{key}."))
+    elif isinstance(value, list):
+        for item in value:
+            label = "/".join(
+                str(item[key]) for key in ("n_vectors", "path", "batch_size") if key in item
+            )
+            flat.update(_flatten(item, f"{prefix}{label}."))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        flat[prefix[:-1]] = value
+    return flat
+
+
+def compare(baseline, current, tolerance=0.1):
+    """逐项对比耗时指标，返回变慢超过tolerance比例的指标列表"""
+    old = _flatten(baseline.get("results", {}))
+    new = _flatten(current.get("results", {}))
+    regressions = []
+    for key in sorted(set(old) & set(new)):
+        if not key.endswith(_TIMING_KEYS) or old[key] <= 0:
+            continue
+        ratio = new[key] / old[key]
+        marker = "  <-- 变慢" if ratio > 1.0 + tolerance else ""
+        print(f"{key:60s} {old[key]:10.3f} -> {new[key]:10.3f}  x{ratio:.2f}{marker}")
+        if marker:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG检索与编码性能基准")
+    parser.add_argument("--embeddings", default="embeddings.parquet", help="知识库文件")
+    parser.add_argument("--model", default="./local_model", help="本地模型路径")
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(DEFAULT_SIZES),
+                        help="合成向量规模")
+    parser.add_argument("--batch-sizes", type=int, nargs="*", default=list(DEFAULT_BATCH_SIZES))
+    parser.add_argument("--queries", type=int, default=200, help="每个规模的检索查询数")
+    parser.add_argument("--k", type=int, default=7)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=20, help="编码与上下文组装的重复次数")
+    parser.add_argument("--encoder-backend", default="torch", choices=["torch", "onnx"])
+    parser.add_argument("--skip-model", action="store_true", help="只运行合成向量检索基准")
+    parser.add_argument("--output", default=None, help="结果JSON路径，默认 benchmark-<commit>.json")
+    parser.add_argument("--compare", default=None, help="与已有结果JSON对比")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="判定变慢的比例")
+    args = parser.parse_args()
+
+    # 只使用本地模型，不访问Hugging Face Hub
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+    commit = _git_commit()
+    results = {}
+    if not args.skip_model:
+        results["generator"] = bench_generator(
+            args.embeddings, args.model,
+            {"top_n": args.k, "encoder_backend": args.encoder_backend},
+            args.batch_sizes, repeat=args.repeat, k=args.k, nprobe=args.nprobe,
+        )
+    if args.sizes:
+        results["search"] = bench_search(args.sizes, args.queries, args.k, args.nprobe)
+
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    output = args.output or f"benchmark-{commit or 'local'}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\n对比 {args.compare}（提交 {baseline.get('meta', {}).get('commit')}）：")
+        if compare(baseline, report, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+# build_embeddings.py
+# 知识库全量构建工具：读取文档 -> 切分 -> 多进程批量编码 -> 增量写入parquet
+import argparse
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from ingest_knowledge import (
+    content_hash,
+    iter_source_files,
+    read_document,
+    refresh_derived_indexes,
+    split_text,
+)
+from vector_index import normalize_rows
+
+SCHEMA = pa.schema([
+    ("text", pa.string()),
+    ("embedding", pa.list_(pa.float32())),
+    ("filename", pa.string()),
+    ("type", pa.string()),
+    ("chunk_id", pa.int64()),
+    ("content_hash", pa.string()),
+])
+
+# 每个工作进程各自持有一份模型
+_worker_model = None
+
+
+def _init_worker(model_path, torch_threads):
+    """工作进程初始化：限制torch线程数，避免多进程之间争抢CPU"""
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(torch_threads)
+    _worker_model = SentenceTransformer(model_path)
+
+
+def _encode_task(texts, batch_size):
+    """在工作进程中编码一组长度相近的段落"""
+    vectors = _worker_model.encode(texts, batch_size=batch_size)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def _iter_units(files, unit_chunks, chunk_size, chunk_overlap):
+    """按完整文档聚合为处理单元（约unit_chunks个段落），保证断点续跑以文档为粒度"""
+    paths, rows = [], []
+    for path in files:
+        filename = os.path.basename(path)
+        doc_type = os.path.splitext(filename)[1].lstrip('.').upper()
+        for chunk_id, text in enumerate(split_text(read_document(path), chunk_size, chunk_overlap)):
+            rows.append((text, filename, doc_type, chunk_id))
+        paths.append(path)
+        if len(rows) >= unit_chunks:
+            yield paths, rows
+            paths, rows = [], []
+    if paths:
+        yield paths, rows
+
+
+class _Checkpoint:
+    """记录已完成的文档与分片文件，中断后可从断点继续"""
+
+    def __init__(self, output_file, params):
+        """
+        参数：
+        params: 影响分片内容的构建参数（切分长度、重叠、模型），与检查点中记录的不同时拒绝续跑，
+                避免合并后的知识库混有不同切分方式或不同模型的段落
+        """
+        self.parts_dir = f"{output_file}.parts"
+        self.path = os.path.join(self.parts_dir, "checkpoint.json")
+        self.params = params
+        self.done = set()
+        self.parts = []
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("params") != params:
+                raise ValueError(
+                    f"检查点的构建参数 {state.get('params')} 与本次 {params} 不一致，"
+                    f"请使用相同参数续跑，或加 --restart 从头构建"
+                )
+            self.done = set(state["done"])
+            self.parts = state["parts"]
+
+    def next_part_path(self):
+        return os.path.join(self.parts_dir, f"part-{len(self.parts):05d}.parquet")
+
+    def commit(self, part_path, paths):
+        """分片写完后再记录，保证检查点中的分片都是完整的（空文档没有分片）"""
+        if part_path:
+            self.parts.append(os.path.basename(part_path))
+        self.done.update(os.path.abspath(p) for p in paths)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"params": self.params, "done": sorted(self.done), "parts": self.parts}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+    @staticmethod
+    def remove(output_file):
+        shutil.rmtree(f"{output_file}.parts", ignore_errors=True)
+
+
+def _write_part(part_path, rows, vectors):
+    """将一个处理单元写为parquet分片"""
+    texts, filenames, types, chunk_ids = zip(*rows)
+    dim = vectors.shape[1]
+    embedding = pa.ListArray.from_arrays(
+        pa.array(np.arange(0, len(rows) * dim + 1, dim, dtype=np.int32)),
+        pa.array(vectors.ravel(), type=pa.float32()),
+    )
+    table = pa.Table.from_arrays([
+        pa.array(texts, type=pa.string()),
+        embedding,
+        pa.array(filenames, type=pa.string()),
+        pa.array(types, type=pa.string()),
+        pa.array(chunk_ids, type=pa.int64()),
+        pa.array([content_hash(t) for t in texts], type=pa.string()),
+    ], schema=SCHEMA)
+    tmp_path = f"{part_path}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, part_path)
+
+
+def _merge_parts(checkpoint, output_file):
+    """逐个分片按行组流式合并为最终parquet文件，内存占用与单个分片相当"""
+    tmp_path = f"{output_file}.tmp"
+    with pq.ParquetWriter(tmp_path, SCHEMA) as writer:
+        for name in checkpoint.parts:
+            part = pq.ParquetFile(os.path.join(checkpoint.parts_dir, name))
+            for i in range(part.num_row_groups):
+                writer.write_table(part.read_row_group(i))
+    os.replace(tmp_path, output_file)
+
+
+def _read_embedding_matrix(output_file):
+    """只读取嵌入列，直接由Arrow列表缓冲区构建归一化矩阵（不逐行创建数组对象）"""
+    parquet = pq.ParquetFile(output_file)
+    n_rows = parquet.metadata.num_rows
+    column = parquet.read(columns=["embedding"]).column("embedding").combine_chunks()
+    values = column.flatten().to_numpy(zero_copy_only=False)
+    if n_rows == 0 or values.size % n_rows:
+        raise ValueError("嵌入向量为空或维度不一致")
+    return normalize_rows(values.reshape(n_rows, -1))
+
+
+def _submit_unit(pool, rows, task_size, batch_size):
+    """把一个处理单元的段落按长度分组提交给进程池，返回 [(段落下标, Future)]"""
+    # 按长度排序后分组，同一批次内长度相近，减少padding浪费
+    order = sorted(range(len(rows)), key=lambda i: len(rows[i][0]))
+    tasks = [order[i:i + task_size] for i in range(0, len(order), task_size)]
+    return [
+        (task, pool.submit(_encode_task, [rows[i][0] for i in task], batch_size))
+        for task in tasks
+    ]
+
+
+def _finish_unit(checkpoint, paths, rows, futures):
+    """等待单元编码完成，写出分片并记录检查点（空文档没有分片）"""
+    if not rows:
+        checkpoint.commit(None, paths)
+        return
+
+    vectors = None
+    for task, future in futures:
+        encoded = future.result()
+        if vectors is None:
+            vectors = np.empty((len(rows), encoded.shape[1]), dtype=np.float32)
+        vectors[task] = encoded
+
+    part_path = checkpoint.next_part_path()
+    _write_part(part_path, rows, vectors)
+    checkpoint.commit(part_path, paths)
+    print(f"已完成 {len(checkpoint.done)} 个文档（本批 {len(rows)} 个段落）")
+
+
+def build(sources, output_file="embeddings.parquet", model_path="./local_model",
+          workers=None, torch_threads=1, batch_size=64, task_size=256, unit_chunks=4096,
+          chunk_size=1000, chunk_overlap=100, restart=False):
+    """
+    全量构建知识库嵌入文件
+
+    参数：
+    sources: 文档路径（文件或目录）
+    output_file: 输出parquet文件
+    workers: 编码进程数，默认 CPU核数 // torch_threads
+    torch_threads: 每个进程的torch线程数
+    batch_size: 模型前向计算的批大小
+    task_size: 每个进程任务包含的段落数
+    unit_chunks: 每个处理单元（检查点粒度）的段落数，决定内存上限
+    restart: 丢弃已有检查点，从头开始；不加时 chunk_size / chunk_overlap / model_path 须与检查点一致
+
+    返回：
+    写入的段落总数
+    """
+    workers = workers or max(1, (os.cpu_count() or 1) // torch_threads)
+    if restart:
+        _Checkpoint.remove(output_file)
+    checkpoint = _Checkpoint(output_file, {
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "model": os.path.abspath(model_path),
+    })
+    os.makedirs(checkpoint.parts_dir, exist_ok=True)
+    if checkpoint.done:
+        print(f"从检查点继续：已完成 {len(checkpoint.done)} 个文档")
+
+    files = [
+        path for path in iter_source_files(sources)
+        if os.path.abspath(path) not in checkpoint.done
+    ]
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(model_path, torch_threads)
+    ) as pool:
+        # 流水线：进程池编码第N个单元时，主进程读取、切分第N+1个单元并提交，再写出第N个单元；
+        # 分片与检查点仍按单元顺序提交
+        pending = None
+        for paths, rows in _iter_units(files, unit_chunks, chunk_size, chunk_overlap):
+            submitted = (paths, rows, _submit_unit(pool, rows, task_size, batch_size))
+            if pending is not None:
+                _finish_unit(checkpoint, *pending)
+            pending = submitted
+        if pending is not None:
+            _finish_unit(checkpoint, *pending)
+
+    if not checkpoint.parts:
+        print("没有可写入的段落")
+        return 0
+
+    print(f"合并分片写入 {output_file} ...")
+    _merge_parts(checkpoint, output_file)
+    total = pq.ParquetFile(output_file).metadata.num_rows
+    checkpoint.clear()
+
+    # 只有存在派生索引时才读取对应的列
+    refresh_derived_indexes(
+        output_file,
+        lambda: _read_embedding_matrix(output_file),
+        lambda: pq.read_table(output_file, columns=["text"]).column("text").to_numpy()
+    )
+    print(f"构建完成：{total} 个段落")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全量构建知识库嵌入（多进程编码，可断点续跑）")
+    parser.add_argument("sources", nargs="+", help="文档路径（文件或目录）")
+    parser.add_argument("--output", default="embeddings.parquet", help="输出parquet文件")
+    parser.add_argument("--model", default="./local_model", help="本地模型路径")
+    parser.add_argument("--workers", type=int, default=None, help="编码进程数")
+    parser.add_argument("--torch-threads", type=int, default=1, help="每个进程的torch线程数")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--task-size", type=int, default=256)
+    parser.add_argument("--unit-chunks", type=int, default=4096)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--restart", action="store_true", help="丢弃检查点，从头构建")
+    args = parser.parse_args()
+
+    build(
+        args.sources,
+        output_file=args.output,
+        model_path=args.model,
+        workers=args.workers,
+        torch_threads=args.torch_threads,
+        batch_size=args.batch_size,
+        task_size=args.task_size,
+        unit_chunks=args.unit_chunks,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        restart=args.restart,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# circuit_breaker.py
+# 外部接口调用的延迟控制：有总时限的抖动退避重试 + 按接口划分的熔断器（进程内各线程共享状态）
+import os
+import random
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求未发出即失败"""
+
+
+class RetryPolicy:
+    """
+    重试策略
+
+    最多尝试 max_attempts 次，所有尝试与等待的总耗时不超过 budget 秒；
+    第n次重试前等待 [0, min(max_delay, base_delay·2^n)) 之间的随机时长（full jitter），
+    避免大量请求在上游恢复时同时重试。
+    """
+
+    def __init__(self, max_attempts=4, budget=8.0, base_delay=0.5, max_delay=4.0):
+        self.max_attempts = max_attempts
+        self.budget = budget
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def deadline(self):
+        """本次调用的截止时间（time.monotonic）"""
+        return time.monotonic() + self.budget
+
+    def remaining(self, deadline):
+        return deadline - time.monotonic()
+
+    def next_delay(self, attempt, deadline):
+        """第attempt次（从0开始）尝试失败后的等待时长；次数或时间预算用完时返回None"""
+        if attempt + 1 >= self.max_attempts:
+            return None
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        # 等待后至少还要留出一次请求的时间
+        if self.remaining(deadline) - delay <= 0.1:
+            return None
+        return delay
+
+    def timeout(self, timeout, deadline):
+        """将 (连接超时, 读取超时) 限制在剩余预算内"""
+        remaining = max(self.remaining(deadline), 0.1)
+        connect_timeout, read_timeout = timeout
+        return min(connect_timeout, remaining), min(read_timeout, remaining)
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    closed：正常放行；连续失败 failure_threshold 次后转为 open。
+    open：直接拒绝请求，reset_timeout 秒后转为 half_open。
+    half_open：只放行一个探测请求，成功则恢复 closed，失败则重新 open；
+    探测请求被取消或以其他异常结束时由调用方 release() 归还，
+    超过 probe_timeout 秒仍未归还的探测视为丢失，允许新的探测请求。
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, probe_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = reset_timeout if probe_timeout is None else probe_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+        self._probe_token = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        是否放行本次请求
+
+        返回：
+        None 表示拒绝；0 表示正常放行；正整数表示本次请求为half_open状态下的探测请求（即探测令牌）
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "closed":
+                return 0
+            if self.state == "half_open":
+                if self._probe_in_flight and now - self._probe_started >= self.probe_timeout:
+                    print(f"⚠️ {self.name} 探测请求 {self.probe_timeout:.0f} 秒未结束，重新探测")
+                    self._probe_in_flight = False
+                if not self._probe_in_flight:
+                    self._probe_in_flight = True
+                    self._probe_started = now
+                    self._probe_token += 1
+                    return self._probe_token
+            self.rejected += 1
+            return None
+
+    def check(self):
+        """不放行时抛出 CircuitOpenError，否则返回 allow() 的结果（探测令牌），请求结束后交给 release()"""
+        token = self.allow()
+        if token is None:
+            raise CircuitOpenError(f"{self.name} 熔断中，{self.reset_timeout:.0f} 秒内暂停请求")
+        return token
+
+    def release(self, token):
+        """
+        归还探测请求（放在finally中调用）：已记录成功或失败时无操作；
+        探测被取消或以未计入熔断的异常结束时，允许下一个请求重新探测
+        """
+        if not token:
+            return
+        with self._lock:
+            if self.state == "half_open" and self._probe_in_flight and self._probe_token == token:
+                self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.state = "closed"
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == "half_open" or (
+                self.state == "closed" and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self.opened += 1
+                print(f"🔌 {self.name} 连续失败 {self.consecutive_failures} 次，熔断 {self.reset_timeout:.0f} 秒")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "successes": self.successes,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "opened": self.opened,
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """按接口名称获取进程内共享的熔断器"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    name,
+                    failure_threshold=int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5")),
+                    reset_timeout=float(os.getenv("BREAKER_RESET_TIMEOUT", "30")),
+                    probe_timeout=float(os.getenv("BREAKER_PROBE_TIMEOUT", "30"))
+                )
+                _breakers[name] = breaker
+    return breaker
+
+
+def breaker_stats():
+    """全部熔断器的状态（用于 /metrics）"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
+
+
+def default_retry_policy():
+    return RetryPolicy(
+        max_attempts=int(os.getenv("WEATHER_MAX_ATTEMPTS", "4")),
+        budget=float(os.getenv("WEATHER_RETRY_BUDGET", "8")),
+        base_delay=float(os.getenv("WEATHER_RETRY_BASE_DELAY", "0.5")),
+        max_delay=float(os.getenv("WEATHER_RETRY_MAX_DELAY", "4"))
+    )
+
+
+def is_retryable_status(status_code):
+    """429与5xx视为上游暂时不可用，可以重试并计入熔断；其余4xx（如密钥错误）重试无意义"""
+    return status_code == 429 or status_code >= 500
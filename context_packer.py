@@ -0,0 +1,190 @@
+# context_packer.py
+# 按LLM token预算组装RAG上下文：整句截断（中英文句末标点）+ 去除近似重复段落（MMR）
+import re
+import numpy as np
+
+_CJK = r"\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+# 估算规则：中日韩文字每字1个token，英文/数字每4个字符约1个token，其余可见符号各1个token
+_CJK_CHAR = re.compile(rf"[{_CJK}]")
+_WORD = re.compile(r"[A-Za-z0-9]+")
+_SYMBOL = re.compile(rf"[^\s{_CJK}A-Za-z0-9]")
+# 句子边界：中文句末标点（可带后引号/括号）、英文句末标点后接空白、换行
+_SENTENCE_END = re.compile(r"[。！？；…]+[”’」』）)]*|[.!?;]+(?=\s)|\n+")
+
+# 截断后不足该token数的残段不值得放入上下文
+MIN_TRUNCATED_TOKENS = 32
+
+
+def _estimate_tokens(text):
+    """按字符类别估算token数（对中文偏保守，预算不会被低估）"""
+    # 单字符类别用 sub 计数（在C层完成），避免为每个字符创建匹配对象
+    cjk = len(text) - len(_CJK_CHAR.sub("", text))
+    symbols = len(text) - len(_SYMBOL.sub("", text))
+    return cjk + symbols + sum((len(word) + 3) // 4 for word in _WORD.findall(text))
+
+
+# 与正则 \s（str.isspace）一致的空白字符码位
+_WHITESPACE_CODES = np.array([
+    9, 10, 11, 12, 13, 28, 29, 30, 31, 32, 133, 160, 5760, 8192, 8193, 8194, 8195, 8196,
+    8197, 8198, 8199, 8200, 8201, 8202, 8232, 8233, 8239, 8287, 12288,
+], dtype=np.uint32)
+
+
+def _estimate_tokens_many(texts, block_size=20000):
+    """
+    批量估算token数，结果与逐条调用 _estimate_tokens 相同
+
+    每块文本以换行拼接后转为码位数组，按字符类别向量化计数，
+    知识库加载时为数十万个段落预计算也只需几秒。
+    """
+    counts = np.zeros(len(texts), dtype=np.int32)
+    for block_start in range(0, len(texts), block_size):
+        block = texts[block_start:block_start + block_size]
+        lengths = np.array([len(text) for text in block], dtype=np.int64)
+        # 段落之间以换行分隔，英文单词不会跨段落连在一起
+        starts = np.zeros(len(block), dtype=np.int64)
+        np.cumsum(lengths[:-1] + 1, out=starts[1:])
+        codes = np.frombuffer("\n".join(block).encode("utf-32-le"), dtype=np.uint32)
+
+        cjk = (((codes >= 0x3400) & (codes <= 0x4DBF))
+               | ((codes >= 0x4E00) & (codes <= 0x9FFF))
+               | ((codes >= 0xF900) & (codes <= 0xFAFF)))
+        alnum = (((codes >= 0x30) & (codes <= 0x39))
+                 | ((codes >= 0x41) & (codes <= 0x5A))
+                 | ((codes >= 0x61) & (codes <= 0x7A)))
+        symbol = ~(cjk | alnum | np.isin(codes, _WHITESPACE_CODES))
+
+        weights = (cjk | symbol).astype(np.int64)
+        run_starts = np.flatnonzero(alnum & ~np.r_[False, alnum[:-1]])
+        run_ends = np.flatnonzero(alnum & ~np.r_[alnum[1:], False])
+        weights[run_starts] += (run_ends - run_starts + 4) // 4
+
+        cumulative = np.zeros(codes.size + 1, dtype=np.int64)
+        np.cumsum(weights, out=cumulative[1:])
+        counts[block_start:block_start + len(block)] = (
+            cumulative[starts + lengths] - cumulative[starts]
+        )
+    return counts
+
+
+class TokenCounter:
+    """
+    LLM token计数
+
+    提供LLM对应的 tokenizer.json（如Qwen分词器）时精确计数，否则按字符类别估算。
+    """
+
+    def __init__(self, tokenizer_file=None):
+        self.tokenizer = None
+        if tokenizer_file:
+            from tokenizers import Tokenizer
+            self.tokenizer = Tokenizer.from_file(tokenizer_file)
+
+    def count(self, text):
+        """单条文本的token数"""
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        return _estimate_tokens(text)
+
+    def count_many(self, texts):
+        """批量计算token数（知识库加载时为每个段落预计算一次）"""
+        texts = [str(text) for text in texts]
+        if self.tokenizer is None:
+            return _estimate_tokens_many(texts)
+        encodings = self.tokenizer.encode_batch(texts, add_special_tokens=False)
+        return np.array([len(encoding.ids) for encoding in encodings], dtype=np.int32)
+
+
+def split_sentences(text):
+    """按中英文句末标点与换行切分句子（标点保留在句末，拼接后与原文一致）"""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        sentences.append(text[start:match.end()])
+        start = match.end()
+    if start < len(text):
+        sentences.append(text[start:])
+    return sentences
+
+
+def truncate_to_tokens(text, max_tokens, counter):
+    """保留开头若干个完整句子，总token数不超过max_tokens；一句都放不下时返回空字符串"""
+    kept, used = [], 0
+    for sentence in split_sentences(text):
+        tokens = counter.count(sentence)
+        if used + tokens > max_tokens:
+            break
+        kept.append(sentence)
+        used += tokens
+    return "".join(kept).rstrip()
+
+
+def select_diverse(relevance, vectors, mmr_lambda=0.7, dedup_threshold=0.95):
+    """
+    MMR排序：每次选取 λ·相关度 − (1−λ)·与已选段落的最大相似度 最高的段落，
+    与已选段落余弦相似度不低于dedup_threshold的段落视为重复直接丢弃
+
+    参数：
+    relevance: 候选段落与查询的相似度
+    vectors: 候选段落的归一化向量
+
+    返回：
+    入选候选的下标列表（按入选顺序）
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    n = relevance.size
+    if n == 0:
+        return []
+    similarities = vectors @ vectors.T
+    max_similarity = np.zeros(n, dtype=np.float32)
+    remaining = np.ones(n, dtype=bool)
+
+    selected = []
+    while remaining.any():
+        scores = mmr_lambda * relevance - (1.0 - mmr_lambda) * max_similarity
+        best = int(np.argmax(np.where(remaining, scores, -np.inf)))
+        selected.append(best)
+        remaining[best] = False
+        max_similarity = np.maximum(max_similarity, similarities[best])
+        remaining &= max_similarity < dedup_threshold
+    return selected
+
+
+def pack_context(texts, token_counts, relevance, vectors, max_tokens, counter,
+                 mmr_lambda=0.7, dedup_threshold=0.95, prefix="相关段落：", separator="\n\n"):
+    """
+    在token预算内组装上下文
+
+    参数：
+    texts: 候选段落文本（按相关度从高到低）
+    token_counts: 各段落预计算的token数
+    relevance: 各段落与查询的相似度
+    vectors: 各段落的归一化向量（用于去重）
+    max_tokens: 上下文token预算
+    counter: TokenCounter
+
+    返回：
+    上下文字符串
+    """
+    prefix_tokens = counter.count(prefix)
+    separator_tokens = counter.count(separator)
+    ellipsis_tokens = counter.count("...")
+
+    parts, used = [], 0
+    for i in select_diverse(relevance, vectors, mmr_lambda, dedup_threshold):
+        overhead = prefix_tokens + (separator_tokens if parts else 0)
+        if used + overhead + int(token_counts[i]) <= max_tokens:
+            parts.append(f"{prefix}{texts[i]}")
+            used += overhead + int(token_counts[i])
+            continue
+
+        # 放不下整段时按整句截断；截断后的段落放入后预算已基本用完
+        available = max_tokens - used - overhead - ellipsis_tokens
+        if available < MIN_TRUNCATED_TOKENS:
+            break
+        truncated = truncate_to_tokens(texts[i], available, counter)
+        if truncated and counter.count(truncated) >= MIN_TRUNCATED_TOKENS:
+            parts.append(f"{prefix}{truncated}...")
+            break
+        # 该段首句过长，继续尝试后面较短的段落
+    return separator.join(parts)
@@ -1,4 +1,21 @@
 # gunicorn.conf.py
+import os
+
 timeout = 120
-workers = 2
-threads = 2
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "2"))  # http_session 按此设置连接池大小
+
+# 预加载模式（RAG_PRELOAD=1 开启，默认关闭）：在master进程中加载模型与知识库，worker通过fork
+# 以写时复制方式共享，嵌入矩阵以内存映射文件共享，增加worker数量不会成倍增加常驻内存。
+# 开启后master加载完成前worker不接受连接；默认由各worker启动后在后台预热，航线请求立即可用
+preload_app = os.getenv("RAG_PRELOAD", "0") == "1"
+if preload_app:
+    # app.py 导入时据此在master中同步加载，而不是启动后台预热线程
+    os.environ["RAG_PRELOAD"] = "1"
+
+
+def post_fork(server, worker):
+    """worker启动后重建后台线程（线程不会随fork复制）"""
+    if preload_app:
+        import main_logic
+        main_logic.after_fork()
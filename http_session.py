@@ -0,0 +1,56 @@
+# http_session.py
+# 对外HTTP请求（天气、地理编码）共用的连接池：keep-alive复用TCP/TLS连接，统一连接/读取超时
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# 每个主机的连接池大小：默认为gunicorn每个worker线程数的4倍（每次航线分析最多并发查询4个港口）
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", str(int(os.getenv("GUNICORN_THREADS", "2")) * 4)))
+# 缓存连接池的主机数（OpenWeatherMap、GeoNames等）
+POOL_HOSTS = int(os.getenv("HTTP_POOL_HOSTS", "8"))
+# (连接超时, 读取超时)，单位秒
+DEFAULT_TIMEOUT = (
+    float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+    float(os.getenv("HTTP_READ_TIMEOUT", "15")),
+)
+
+_lock = threading.Lock()
+_adapter = None
+_adapter_pid = None
+_local = threading.local()
+
+
+def _shared_adapter():
+    """进程内共享的连接池（urllib3连接池本身线程安全）；fork后在子进程中重建，不复用父进程的套接字"""
+    global _adapter, _adapter_pid
+    pid = os.getpid()
+    if _adapter is None or _adapter_pid != pid:
+        with _lock:
+            if _adapter is None or _adapter_pid != pid:
+                # 重试由调用方控制（如 WeatherService.safe_api_call），连接池层不再重试
+                _adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, max_retries=0)
+                _adapter_pid = pid
+    return _adapter
+
+
+def get_session():
+    """
+    当前线程的 requests.Session
+
+    Session对象本身不保证线程安全，因此每个线程各持有一个，
+    但都挂载同一个连接池，连接在线程之间复用。
+    """
+    adapter = _shared_adapter()
+    session = getattr(_local, "session", None)
+    if session is None or _local.adapter is not adapter:
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session, _local.adapter = session, adapter
+    return session
+
+
+def get(url, params=None, timeout=None, **kwargs):
+    """通过共享连接池发送GET请求，未指定timeout时使用 DEFAULT_TIMEOUT"""
+    return get_session().get(url, params=params, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
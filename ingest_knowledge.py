@@ -0,0 +1,284 @@
+# ingest_knowledge.py
+# 知识库增量导入工具：只为内容发生变化的段落重新生成嵌入
+import argparse
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+from vector_index import (
+    IVFIndex,
+    QuantizedMatrix,
+    full_precision_path_for,
+    index_path_for,
+    load_full_precision_matrix,
+    load_or_build_index,
+    normalize_rows,
+)
+from lexical_index import BM25Index, lexical_index_path_for, load_or_build_lexical_index
+
+SUPPORTED_EXTENSIONS = ('.txt', '.md')
+TABLE_COLUMNS = ['text', 'embedding', 'filename', 'type', 'chunk_id', 'content_hash']
+
+# 优先按段落、换行切分，其次按中英文句子边界，最后按字符
+SEPARATORS = ["\n\n", "\n", "。", "！", "？", "；", ". ", "! ", "? ", " ", ""]
+
+
+def read_document(path):
+    """读取文本文件（UTF-8，失败时尝试GB18030）"""
+    for encoding in ('utf-8-sig', 'gb18030'):
+        try:
+            with open(path, encoding=encoding) as f:
+                return f.read()
+        except UnicodeDecodeError:
+            continue
+    raise ValueError(f"无法识别文件编码: {path}")
+
+
+def _split_pieces(text, chunk_size, separators):
+    """递归切分为不超过chunk_size的片段（分隔符保留在片段末尾）"""
+    if len(text) <= chunk_size:
+        return [text]
+    separator = separators[0]
+    if separator == "":
+        return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+    if separator not in text:
+        return _split_pieces(text, chunk_size, separators[1:])
+
+    parts = text.split(separator)
+    pieces = []
+    for i, part in enumerate(parts):
+        if i < len(parts) - 1:
+            part += separator
+        if not part:
+            continue
+        if len(part) <= chunk_size:
+            pieces.append(part)
+        else:
+            pieces.extend(_split_pieces(part, chunk_size, separators[1:]))
+    return pieces
+
+
+def split_text(text, chunk_size=1000, chunk_overlap=100):
+    """
+    将文档切分为段落块
+
+    参数：
+    text: 文档全文
+    chunk_size: 每块最大字符数
+    chunk_overlap: 相邻块之间最多重叠的字符数（按完整片段重叠）
+
+    返回：
+    去除首尾空白后的段落块列表
+    """
+    chunks = []
+    current, current_len = [], 0
+    for piece in _split_pieces(text, chunk_size, SEPARATORS):
+        if current and current_len + len(piece) > chunk_size:
+            chunks.append("".join(current))
+            # 保留上一块末尾的若干片段作为重叠部分
+            while current and (current_len > chunk_overlap
+                               or current_len + len(piece) > chunk_size):
+                current_len -= len(current.pop(0))
+        current.append(piece)
+        current_len += len(piece)
+    if current:
+        chunks.append("".join(current))
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
+
+
+def content_hash(text):
+    """段落内容哈希，用于判断是否需要重新生成嵌入"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def iter_source_files(paths):
+    """展开输入路径（目录递归查找受支持的文本文件）"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def load_table(file_path):
+    """加载知识库表，文件不存在时返回空表"""
+    if not os.path.exists(file_path):
+        return pd.DataFrame(columns=TABLE_COLUMNS)
+    if file_path.endswith('.parquet'):
+        df = pd.read_parquet(file_path)
+    else:
+        df = pd.read_csv(file_path)
+        df['embedding'] = df['embedding'].apply(
+            lambda x: np.fromstring(x[1:-1], sep=', ', dtype=np.float32)
+        )
+    if 'content_hash' not in df.columns:
+        df['content_hash'] = df['text'].map(content_hash)
+    return df
+
+
+def save_table(df, file_path):
+    """原子写入parquet（先写临时文件再替换），运行中的服务不会读到半个文件"""
+    tmp_path = f"{file_path}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, file_path)
+
+
+def save_csv(df, file_path):
+    """导出与 embeddings.csv 相同格式的CSV（嵌入向量写为 "[a, b, ...]"）"""
+    out = df.copy()
+    out['embedding'] = out['embedding'].map(
+        lambda vec: "[" + ", ".join(f"{x:.8f}" for x in vec) + "]"
+    )
+    tmp_path = f"{file_path}.tmp"
+    out.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, file_path)
+
+
+def refresh_derived_indexes(embeddings_file, read_matrix, read_texts):
+    """
+    重建磁盘上已存在的派生索引（IVF、BM25、全精度矩阵），使其与新知识库一致
+
+    read_matrix / read_texts 为无参函数，分别返回归一化的嵌入矩阵与段落文本；
+    只在对应索引文件存在时才调用，没有派生索引时不读取知识库。
+    """
+    # 全精度与各量化方式的IVF索引分别存放，已存在的都要更新
+    ivf_paths = {
+        quantization: index_path_for(embeddings_file, "ivf", quantization)
+        for quantization in (None, *QuantizedMatrix.QUANTIZATION_TYPES)
+    }
+    ivf_paths = {quantization: path for quantization, path in ivf_paths.items() if os.path.exists(path)}
+    has_full_precision = os.path.exists(full_precision_path_for(embeddings_file))
+    matrix = read_matrix() if ivf_paths or has_full_precision else None
+
+    for quantization, ivf_path in ivf_paths.items():
+        print(f"更新IVF向量索引（{quantization or 'float32'}）...")
+        indexed = QuantizedMatrix.from_matrix(matrix, quantization) if quantization else matrix
+        # 沿用已有索引文件的nlist，避免服务加载时因参数不同再次重建；段落数已少于原nlist时使用默认值
+        params = IVFIndex.saved_params(ivf_path)
+        if params.get('nlist', 0) > matrix.shape[0]:
+            params = {}
+        load_or_build_index(indexed, index_type="ivf", embeddings_file=embeddings_file, **params)
+    if has_full_precision:
+        print("更新全精度矩阵...")
+        load_full_precision_matrix(matrix, embeddings_file)
+    lexical_path = lexical_index_path_for(embeddings_file)
+    if os.path.exists(lexical_path):
+        print("更新BM25词法索引...")
+        load_or_build_lexical_index(read_texts(), embeddings_file, **BM25Index.saved_params(lexical_path))
+
+
+def ingest(embeddings_file, sources=(), delete=(), model=None, model_path='./local_model',
+           chunk_size=1000, chunk_overlap=100, batch_size=64, csv_file=None):
+    """
+    增量导入文档：按 filename/chunk_id 更新或删除段落，只对内容哈希变化的段落编码
+
+    参数：
+    embeddings_file: 知识库parquet文件
+    sources: 新增或修改的文档路径（文件或目录）
+    delete: 需要删除的文档文件名
+    model: 已加载的SentenceTransformer（可选），为None时从model_path加载
+    csv_file: 同时导出的CSV路径（可选）
+
+    返回：
+    统计信息字典（added / updated / unchanged / deleted / encoded）
+    """
+    df = load_table(embeddings_file)
+    old_hashes = {
+        (filename, int(chunk_id)): h
+        for filename, chunk_id, h in zip(df['filename'], df['chunk_id'], df['content_hash'])
+    }
+    # 内容相同的段落（即使chunk_id变化）直接复用已有向量
+    known_vectors = dict(zip(df['content_hash'], df['embedding']))
+
+    new_rows = []
+    touched = set(delete)
+    for path in iter_source_files(sources):
+        filename = os.path.basename(path)
+        touched.add(filename)
+        doc_type = os.path.splitext(filename)[1].lstrip('.').upper()
+        for chunk_id, text in enumerate(split_text(read_document(path), chunk_size, chunk_overlap)):
+            h = content_hash(text)
+            new_rows.append({
+                'text': text,
+                'embedding': known_vectors.get(h),
+                'filename': filename,
+                'type': doc_type,
+                'chunk_id': chunk_id,
+                'content_hash': h,
+            })
+
+    new_keys = {(row['filename'], row['chunk_id']): row['content_hash'] for row in new_rows}
+    stats = {
+        'added': sum(key not in old_hashes for key in new_keys),
+        'updated': sum(key in old_hashes and old_hashes[key] != h for key, h in new_keys.items()),
+        'unchanged': sum(old_hashes.get(key) == h for key, h in new_keys.items()),
+        'deleted': sum(key[0] in touched and key not in new_keys for key in old_hashes),
+        'encoded': 0,
+    }
+    if not stats['added'] and not stats['updated'] and not stats['deleted']:
+        print("知识库无变化")
+        return stats
+
+    to_encode = [row for row in new_rows if row['embedding'] is None]
+    if to_encode:
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            print("加载词嵌入模型...")
+            model = SentenceTransformer(model_path)
+        print(f"生成嵌入：{len(to_encode)} 个段落")
+        vectors = model.encode([row['text'] for row in to_encode], batch_size=batch_size)
+        for row, vec in zip(to_encode, vectors):
+            row['embedding'] = np.asarray(vec, dtype=np.float32)
+        stats['encoded'] = len(to_encode)
+
+    kept = df[~df['filename'].isin(touched)]
+    result = pd.concat([kept, pd.DataFrame(new_rows, columns=TABLE_COLUMNS)], ignore_index=True)
+    result['chunk_id'] = result['chunk_id'].astype('int64')
+    save_table(result, embeddings_file)
+    if csv_file:
+        save_csv(result, csv_file)
+    refresh_derived_indexes(
+        embeddings_file,
+        lambda: normalize_rows(np.stack(result['embedding'].values)),
+        lambda: result['text'].values
+    )
+
+    print(
+        f"导入完成：新增 {stats['added']}，更新 {stats['updated']}，"
+        f"未变 {stats['unchanged']}，删除 {stats['deleted']}，编码 {stats['encoded']}"
+    )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="知识库增量导入（按内容哈希只编码变化的段落）")
+    parser.add_argument("sources", nargs="*", help="新增或修改的文档（文件或目录）")
+    parser.add_argument("--delete", nargs="*", default=[], help="需要删除的文档文件名")
+    parser.add_argument("--embeddings", default="embeddings.parquet", help="知识库parquet文件")
+    parser.add_argument("--model", default="./local_model", help="本地模型路径")
+    parser.add_argument("--csv", default=None, help="同时导出CSV（如 embeddings.csv）")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    if not args.sources and not args.delete:
+        parser.error("请提供需要导入的文档或 --delete 的文件名")
+
+    ingest(
+        args.embeddings,
+        sources=args.sources,
+        delete=args.delete,
+        model_path=args.model,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        batch_size=args.batch_size,
+        csv_file=args.csv,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# lexical_index.py
+import os
+import re
+import unicodedata
+import zlib
+from collections import Counter
+import numpy as np
+from vector_index import top_k
+
+# 中日韩文字连续片段 / 英文数字词（保留 1.2.3、SOLAS-74 这类编号）
+_TOKEN_PATTERN = re.compile(
+    r"[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+"
+    r"|[a-z0-9]+(?:[.\-/][a-z0-9]+)*"
+)
+_CJK_START = "\u3400"
+
+
+def tokenize(text):
+    """
+    BM25分词：中文按字符二元组（单字片段保留单字），英文/数字按词
+
+    例如 "苏伊士运河 SOLAS-74" -> ["苏伊", "伊士", "士运", "运河", "solas-74"]
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text):
+        run = match.group()
+        if run[0] >= _CJK_START:
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def texts_fingerprint(texts):
+    """计算段落文本指纹，用于判断磁盘索引是否与当前知识库一致"""
+    crc = 0
+    for text in texts:
+        crc = zlib.crc32(str(text).encode("utf-8") + b"\x00", crc)
+    return int(crc)
+
+
+class BM25Index:
+    """
+    基于倒排表的BM25词法索引
+
+    倒排表以CSR形式存储（词项偏移量 + 文档下标 + 预计算的BM25权重），
+    查询时只需把命中词项的权重累加到得分数组中。
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.empty(0, dtype=np.int32)
+        self.weights = np.empty(0, dtype=np.float32)
+        self.n_docs = 0
+        self.fingerprint = None
+
+    def build(self, texts):
+        """从段落文本构建索引"""
+        texts = list(texts)
+        self.n_docs = len(texts)
+        self.fingerprint = texts_fingerprint(texts)
+
+        postings = {}
+        doc_len = np.zeros(self.n_docs, dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len[doc_id] = sum(counts.values())
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append((doc_id, tf))
+
+        avg_len = float(doc_len.mean()) if self.n_docs and doc_len.mean() > 0 else 1.0
+        tokens = sorted(postings)
+        self.vocab = {token: i for i, token in enumerate(tokens)}
+
+        offsets = [0]
+        doc_ids, weights = [], []
+        for token in tokens:
+            docs, tfs = zip(*postings[token])
+            docs = np.array(docs, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+            idf = np.log(1.0 + (self.n_docs - docs.size + 0.5) / (docs.size + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * doc_len[docs] / avg_len)
+            doc_ids.append(docs)
+            weights.append((idf * tfs * (self.k1 + 1.0) / (tfs + norm)).astype(np.float32))
+            offsets.append(offsets[-1] + docs.size)
+
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.doc_ids = np.concatenate(doc_ids) if doc_ids else np.empty(0, dtype=np.int32)
+        self.weights = np.concatenate(weights) if weights else np.empty(0, dtype=np.float32)
+        return self
+
+    def score(self, query):
+        """返回所有段落的BM25得分数组"""
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for token in set(tokenize(query)):
+            term = self.vocab.get(token)
+            if term is None:
+                continue
+            start, end = self.offsets[term], self.offsets[term + 1]
+            # 同一词项的倒排表中文档下标不重复，可直接按下标累加
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+        return scores
+
+    def search(self, query, k):
+        """返回BM25得分最高的k个段落 (下标数组, 得分数组)，不含零分段落"""
+        scores = self.score(query)
+        indices = top_k(scores, k)
+        indices = indices[scores[indices] > 0]
+        return indices, scores[indices]
+
+    def candidates(self, query, limit):
+        """词法预筛选：返回最多limit个命中查询词的段落下标"""
+        return self.search(query, limit)[0]
+
+    def save(self, path):
+        """保存为npz文件"""
+        tokens = sorted(self.vocab, key=self.vocab.get)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            tokens=np.array(tokens, dtype=str),
+            offsets=self.offsets,
+            doc_ids=self.doc_ids,
+            weights=self.weights,
+            params=np.array([self.k1, self.b], dtype=np.float64),
+            n_docs=np.int64(self.n_docs),
+            fingerprint=np.int64(self.fingerprint),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, texts=None, **params):
+        """从npz文件加载；传入texts且与索引不一致，或k1/b与params（未传入的取默认值）不同时返回None"""
+        expected = cls(**params)
+        with np.load(path, allow_pickle=False) as data:
+            k1, b = data['params']
+            if not np.allclose([k1, b], [expected.k1, expected.b]):
+                return None
+            index = cls(k1=float(k1), b=float(b))
+            index.n_docs = int(data['n_docs'])
+            index.fingerprint = int(data['fingerprint'])
+            if texts is not None and index.fingerprint != texts_fingerprint(texts):
+                return None
+            index.vocab = {str(token): i for i, token in enumerate(data['tokens'])}
+            index.offsets = data['offsets']
+            index.doc_ids = data['doc_ids']
+            index.weights = data['weights']
+        return index
+
+    @staticmethod
+    def saved_params(path):
+        """读取索引文件的k1/b，用于按原参数重建；文件无法读取时返回空字典"""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                k1, b = data['params']
+            return {'k1': float(k1), 'b': float(b)}
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def __len__(self):
+        return self.n_docs
+
+
+def lexical_index_path_for(embeddings_file):
+    """词法索引与嵌入文件放在同一目录，例如 embeddings.bm25.npz"""
+    return f"{os.path.splitext(embeddings_file)[0]}.bm25.npz"
+
+
+def load_or_build_lexical_index(texts, embeddings_file=None, **params):
+    """加载磁盘上的BM25索引，不存在或已过期时重新构建并保存"""
+    texts = list(texts)
+    path = lexical_index_path_for(embeddings_file) if embeddings_file else None
+
+    if path and os.path.exists(path):
+        try:
+            index = BM25Index.load(path, texts, **params)
+            if index is not None:
+                return index
+            print(f"词法索引已过期，重新构建: {path}")
+        except Exception as e:
+            print(f"词法索引加载失败，重新构建: {str(e)}")
+
+    index = BM25Index(**params).build(texts)
+    if path:
+        try:
+            index.save(path)
+        except OSError as e:
+            print(f"词法索引保存失败: {str(e)}")
+    return index
@@ -1,46 +1,252 @@
 # main_logic.py
 
 import os
+import gc
 import json
+import threading
 from datetime import datetime
-from openai import OpenAI
-from rag_prompt_generator import RAGPromptGenerator
-from weather_service import WeatherService
+from answer_cache import SemanticAnswerCache
 import google.generativeai as genai
 
 # 配置 Google Gemini（可选，未使用可忽略）
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY", "dummy"))
 
-# ✅ 读取通义千问 API Key（强烈推荐使用环境变量）
-api_key = os.getenv("DASHSCOPE_API_KEY")
-if not api_key:
-    raise ValueError("❌ 未检测到 DASHSCOPE_API_KEY 环境变量，请在 Render 设置正确的值")
 
-# 初始化 OpenAI 兼容客户端（通义千问）
-client = OpenAI(
-    api_key=api_key,
-    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-)
+class _LazyResource:
+    """线程安全的懒加载单例：首次使用或后台预热时创建，创建失败时下次调用重试"""
+
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._value = None
+        self.status = "pending"
+        self.error = None
+
+    def get(self):
+        if self._value is not None:
+            return self._value
+        # 预热进行中时，请求线程在此等待同一次加载完成，不会重复加载
+        with self._lock:
+            if self._value is None:
+                self.status = "loading"
+                try:
+                    self._value = self._factory()
+                except Exception as e:
+                    self.status = "error"
+                    self.error = str(e)
+                    raise
+                self.status = "ready"
+                self.error = None
+        return self._value
+
+    def after_fork(self):
+        """fork后重建锁（父进程中的锁状态不应被子进程继承）"""
+        self._lock = threading.Lock()
+
+
+def _create_llm_client():
+    # ✅ 读取通义千问 API Key（强烈推荐使用环境变量）
+    from openai import OpenAI
+    api_key = os.getenv("DASHSCOPE_API_KEY")
+    if not api_key:
+        raise ValueError("❌ 未检测到 DASHSCOPE_API_KEY 环境变量，请在 Render 设置正确的值")
+
+    # 初始化 OpenAI 兼容客户端（通义千问）
+    return OpenAI(
+        api_key=api_key,
+        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
+    )
+
+
+def _create_weather_service():
+    from weather_service import WeatherService
+    return WeatherService(
+        geonames_user="shouxc",  # 可改为你自己的账号
+        owm_api_key=os.getenv("OWM_API_KEY", "dummy")  # 推荐也通过环境变量注入
+    )
+
+
+# gunicorn预加载模式下，master进程只加载模型与知识库，后台线程由worker在 after_fork 中启动
+_loading_in_master = False
+
+
+def create_rag_generator():
+    # 延迟导入：torch / sentence_transformers 只在首次需要RAG时加载
+    from rag_prompt_generator import RAGPromptGenerator
+    # RAG_ENCODER_BACKEND=onnx 时使用ONNX Runtime编码（不导入torch），RAG_ENCODER_QUANTIZED=1 使用int8模型
+    encoder_backend = os.getenv("RAG_ENCODER_BACKEND", "torch")
+    encoder_params = None
+    if encoder_backend == "onnx":
+        encoder_params = {"quantized": os.getenv("RAG_ENCODER_QUANTIZED") == "1"}
+    return RAGPromptGenerator(
+        embeddings_file="embeddings.parquet",
+        model_path="./local_model",
+        top_n=5,
+        similarity_threshold=0.4,
+        max_context_length=1500,  # 上下文token预算
+        batch_wait_ms=3,  # 并发请求的查询在3毫秒窗口内合并编码
+        query_cache_size=2048,
+        query_cache_path=os.getenv("RAG_QUERY_CACHE_PATH", "query_cache.npz"),  # 重启后缓存仍可命中
+        auto_reload_interval=60,  # ingest_knowledge.py 更新知识库后自动热加载
+        mmap_embeddings=True,  # 嵌入矩阵以内存映射方式共享，worker数量增加不会成倍占用内存
+        encoder_backend=encoder_backend,
+        encoder_params=encoder_params,
+        # 上下文按LLM token计算；提供Qwen的 tokenizer.json 时精确计数，否则按字符估算
+        context_tokenizer_file=os.getenv("RAG_CONTEXT_TOKENIZER"),
+        start_background_threads=not _loading_in_master
+    )
+
+
+# 独立检索服务地址（如 unix:///tmp/rag.sock），设置后web进程不加载模型，服务不可用时回退到进程内检索
+RAG_SERVICE_URL = os.getenv("RAG_SERVICE_URL")
+
+
+def _create_retrieval_client():
+    from retrieval_client import RetrievalClient
+    return RetrievalClient(
+        RAG_SERVICE_URL,
+        connect_timeout=float(os.getenv("RAG_SERVICE_CONNECT_TIMEOUT", "0.5")),
+        timeout=float(os.getenv("RAG_SERVICE_TIMEOUT", "5"))
+    )
+
+
+# 各组件均为懒加载：导入本模块不会加载模型，也不会因缺少 API Key 而失败
+_resources = {
+    "llm": _LazyResource("llm", _create_llm_client),
+    "weather": _LazyResource("weather", _create_weather_service),
+    "rag": _LazyResource("rag", create_rag_generator),
+}
+if RAG_SERVICE_URL:
+    _resources["rag_service"] = _LazyResource("rag_service", _create_retrieval_client)
+_warmup_lock = threading.Lock()
+_warmup_started = False
+
+
+def get_llm_client():
+    return _resources["llm"].get()
+
+
+def get_weather_service():
+    return _resources["weather"].get()
+
+
+def get_rag_generator():
+    return _resources["rag"].get()
 
-# 初始化天气服务
-weather_service = WeatherService(
-    geonames_user="shouxc",  # 可改为你自己的账号
-    owm_api_key=os.getenv("OWM_API_KEY", "dummy")  # 推荐也通过环境变量注入
-)
 
-# 初始化 RAG 组件（增强型分析）
-rag_generator = RAGPromptGenerator(
-    embeddings_file="embeddings.parquet",
-    model_path="./local_model",
-    top_n=5,
-    similarity_threshold=0.4,
-    max_context_length=1500
+def get_retrieval_client():
+    """未配置检索服务时返回None"""
+    resource = _resources.get("rag_service")
+    return resource.get() if resource is not None else None
+
+
+def _warm_targets():
+    """需要预热的组件：使用检索服务时本地模型只在回退时按需加载"""
+    return [
+        resource for name, resource in _resources.items()
+        if not (RAG_SERVICE_URL and name == "rag")
+    ]
+
+
+def _warm(resource):
+    try:
+        resource.get()
+        print(f"✅ 预热完成：{resource.name}")
+    except Exception as e:
+        print(f"❌ 预热失败：{resource.name}：{str(e)}")
+
+
+def preload():
+    """
+    在gunicorn master进程中同步加载RAG组件（预加载模式），随后fork的worker以写时复制方式共享。
+    只加载模型权重与知识库，不做推理、不创建网络客户端，避免fork后继承线程池或连接状态。
+    """
+    global _loading_in_master
+    if not RAG_SERVICE_URL:
+        _loading_in_master = True
+        try:
+            _warm(_resources["rag"])
+        finally:
+            _loading_in_master = False
+    # 冻结已有对象，避免worker中的垃圾回收触碰这些对象而触发写时复制
+    gc.freeze()
+
+
+def after_fork():
+    """worker进程fork后调用：启动RAG后台线程（master中不启动），并在后台预热其余组件"""
+    global _warmup_started
+    for resource in _resources.values():
+        resource.after_fork()
+    rag = _resources["rag"]
+    if rag._value is not None:
+        rag._value.after_fork()
+    with _warmup_lock:
+        _warmup_started = False
+    start_warmup(preload_in_master=False)
+
+
+def start_warmup(preload_in_master=None):
+    """
+    预热各组件（只启动一次），不阻塞服务启动
+
+    参数：
+    preload_in_master: 是否为gunicorn预加载模式（默认读取 RAG_PRELOAD 环境变量）。
+                       预加载模式下在当前进程同步加载RAG，由 after_fork 完成其余预热
+    """
+    global _warmup_started
+    if preload_in_master is None:
+        preload_in_master = os.getenv("RAG_PRELOAD") == "1"
+    with _warmup_lock:
+        if _warmup_started:
+            return
+        _warmup_started = True
+    if preload_in_master:
+        preload()
+        return
+    for resource in _warm_targets():
+        threading.Thread(
+            target=_warm, args=(resource,), name=f"warmup-{resource.name}", daemon=True
+        ).start()
+
+
+# 大模型客户端只依赖外部API Key，单独报告、不影响就绪状态
+_NON_GATING = ("llm",)
+
+
+def readiness():
+    """
+    各组件加载状态
+
+    ready 为 True 表示本进程加载的组件（检索、天气）全部预热完成；
+    大模型客户端的状态在 llm 字段中单独报告，缺少或错误的 API Key 不会让服务一直不就绪
+    """
+    components = {
+        name: resource.status if resource.error is None else f"error: {resource.error}"
+        for name, resource in _resources.items()
+    }
+    return {
+        "ready": all(
+            resource.status == "ready" for resource in _warm_targets()
+            if resource.name not in _NON_GATING
+        ),
+        "components": {name: status for name, status in components.items() if name not in _NON_GATING},
+        "llm": components["llm"],
+    }
+
+# 语义回答缓存：相近问题在有效期内直接复用分析报告，避免重复调用大模型
+answer_cache = SemanticAnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+    max_distance=float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.05")),
+    ttl=int(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    tool_ttl=int(os.getenv("ANSWER_CACHE_TOOL_TTL", "600"))  # 含实时天气的回答更快过期
 )
 
 # 工具调用：天气
 def get_current_weather(arguments):
     try:
         location = arguments.get("location")
+        weather_service = get_weather_service()
         geo_data = weather_service.get_geodata(location)
         weather_data = weather_service.get_weather(lat=geo_data["lat"], lon=geo_data["lon"])
         return f"{weather_data['location_name']} 当前天气：{weather_data['weather_desc']}, 温度：{weather_data['temp']}°C"
@@ -79,8 +285,19 @@ def process_tool_calls(assistant_message):
             })
     return tool_responses
 
+def _remote_rag_prompt(user_input, filters=None):
+    """通过检索服务生成 (查询向量, 增强prompt, 知识库版本)；未配置或服务不可用时返回 (None, None, None)"""
+    if not RAG_SERVICE_URL:
+        return None, None, None
+    from retrieval_client import RetrievalServiceError
+    try:
+        return get_retrieval_client().generate_prompt_with_version(user_input, filters)
+    except RetrievalServiceError as e:
+        print(f"⚠️ 检索服务不可用，回退到进程内检索：{str(e)}")
+        return None, None, None
+
 # 主逻辑：4.7 航线分析逻辑
-def run_4_7_logic(user_input: str) -> str:
+def run_4_7_logic(user_input: str, filters: dict = None) -> str:
     system_prompt = """作为海运智能决策系统，请按以下结构输出分析报告：
 
 【航线推荐】
@@ -103,16 +320,36 @@ def run_4_7_logic(user_input: str) -> str:
 
     messages = [{"role": "system", "content": system_prompt}]
 
+    query_vec = kb_version = None
     try:
-        enhanced_prompt = rag_generator.generate_prompt(user_input)
+        query_vec, enhanced_prompt, kb_version = _remote_rag_prompt(user_input, filters)
+        if query_vec is None:
+            rag_generator = get_rag_generator()
+            query_vec = rag_generator.encode_query(user_input)
+            kb_version = rag_generator.kb_version
+        # 知识库热加载后旧报告失效
+        answer_cache.set_version(kb_version)
+        # 限定资料范围（filters）的查询不与全库查询共享缓存
+        cached_report = answer_cache.get(query_vec, user_input) if not filters else None
+        if cached_report is not None:
+            print("✅ 命中语义回答缓存")
+            return cached_report
+
+        if enhanced_prompt is None:
+            enhanced_prompt = rag_generator.generate_prompt(
+                user_input, query_vec=query_vec, filters=filters
+            )
         print("✅ RAG 提示词生成成功")
     except Exception as e:
         print(f"❌ RAG 处理失败：{str(e)}")
         enhanced_prompt = user_input
+        # 未使用知识库生成的报告不写入语义缓存（put在query_vec为None时不写入）
+        query_vec = None
 
     messages.append({"role": "user", "content": enhanced_prompt})
 
     try:
+        client = get_llm_client()
         completion = client.chat.completions.create(
             model="qwen-plus",
             messages=messages,
@@ -151,9 +388,17 @@ def run_4_7_logic(user_input: str) -> str:
                 model="qwen-plus",
                 messages=messages
             )
-            return final_response.choices[0].message.content.strip()
+            report = final_response.choices[0].message.content.strip()
         except Exception as e:
             print(f"❌ 生成最终回复失败：{str(e)}")
             return "工具调用成功，但生成最终分析报告失败。"
 
-    return assistant_message.content.strip()
+        # 含实时工具数据的报告使用较短的有效期
+        if not filters:
+            answer_cache.put(query_vec, report, used_tools=True, query_text=user_input, version=kb_version)
+        return report
+
+    report = assistant_message.content.strip()
+    if not filters:
+        answer_cache.put(query_vec, report, query_text=user_input, version=kb_version)
+    return report
@@ -0,0 +1,249 @@
+# onnx_encoder.py
+# 本地句向量模型的ONNX Runtime推理后端：BertModel + 均值池化 + L2归一化（与 local_model/modules.json 一致）
+# 推理时只依赖 onnxruntime 与 tokenizers，不导入 torch
+import argparse
+import json
+import os
+import numpy as np
+from vector_index import normalize_rows
+
+ONNX_FILE = "model.onnx"
+QUANTIZED_ONNX_FILE = "model.int8.onnx"
+
+# 校验用的示例文本（中英文混合、长短不一）
+VERIFY_TEXTS = [
+    "苏伊士运河通航条件",
+    "今天上海港的天气怎么样？",
+    "船舶在恶劣天气下进港需要注意哪些安全事项",
+    "SOLAS-74 公约对救生设备的要求",
+    "What is the average waiting time at the port of Singapore?",
+    "港口",
+    "集装箱船靠泊作业流程：引航、系缆、装卸、离泊。" * 8,
+]
+
+
+def onnx_path_for(model_path, quantized=False):
+    """ONNX模型放在本地模型目录的 onnx/ 子目录下"""
+    return os.path.join(model_path, "onnx", QUANTIZED_ONNX_FILE if quantized else ONNX_FILE)
+
+
+def _read_json(model_path, name, default=None):
+    path = os.path.join(model_path, name)
+    if not os.path.exists(path):
+        return default
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class OnnxSentenceEncoder:
+    """
+    ONNX Runtime句向量编码器
+
+    encode() 与 SentenceTransformer.encode 的常用用法兼容（单条文本返回一维向量，
+    列表返回二维矩阵），可直接替换 RAGPromptGenerator 中的模型。
+    """
+
+    def __init__(self, model_path="./local_model", quantized=False, onnx_file=None,
+                 num_threads=None, max_seq_length=None):
+        """
+        参数：
+        model_path: 本地模型路径（读取 tokenizer.json 与池化配置）
+        quantized: 使用动态int8量化后的模型
+        onnx_file: 指定ONNX文件路径，默认为 model_path/onnx/model(.int8).onnx
+        num_threads: ONNX Runtime算子内线程数，None表示由运行时决定
+        max_seq_length: 最大序列长度，默认读取 sentence_bert_config.json
+        """
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        onnx_file = onnx_file or onnx_path_for(model_path, quantized)
+        if not os.path.exists(onnx_file):
+            raise FileNotFoundError(
+                f"ONNX模型不存在: {onnx_file}，请先运行 python onnx_encoder.py export"
+                + (" --quantize" if quantized else "")
+            )
+
+        pooling = _read_json(model_path, os.path.join("1_Pooling", "config.json"), {})
+        if pooling and not pooling.get("pooling_mode_mean_tokens"):
+            raise ValueError("ONNX后端只支持均值池化（pooling_mode_mean_tokens）")
+
+        self.onnx_file = onnx_file
+        self.quantized = quantized
+        self.max_seq_length = max_seq_length or _read_json(
+            model_path, "sentence_bert_config.json", {}
+        ).get("max_seq_length", 256)
+
+        # 分词：与 transformers 快速分词器使用同一份 tokenizer.json
+        tokenizer_config = _read_json(model_path, "tokenizer_config.json", {})
+        pad_token = tokenizer_config.get("pad_token", "[PAD]")
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.enable_padding(
+            pad_id=self.tokenizer.token_to_id(pad_token) or 0, pad_token=pad_token
+        )
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            onnx_file, options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {node.name for node in self.session.get_inputs()}
+        output = self.session.get_outputs()[0]
+        self._output_name = output.name
+        self.dimension = output.shape[-1] if isinstance(output.shape[-1], int) else 0
+
+    def _encode_batch(self, texts):
+        """编码一个批次：前向计算 -> 按attention mask做均值池化 -> L2归一化"""
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        hidden = self.session.run([self._output_name], feeds)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return normalize_rows(pooled)
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        """
+        编码文本，返回float32向量（已归一化）
+
+        按长度排序后分批，同一批次内长度相近，减少padding带来的无效计算。
+        其余关键字参数（如 show_progress_bar）为兼容SentenceTransformer而忽略。
+        """
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        if not sentences:
+            return np.empty((0, self.dimension), dtype=np.float32)
+
+        order = np.argsort([len(text) for text in sentences], kind="stable")
+        vectors = None
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            encoded = self._encode_batch([sentences[i] for i in batch])
+            if vectors is None:
+                vectors = np.empty((len(sentences), encoded.shape[1]), dtype=np.float32)
+            vectors[batch] = encoded
+        return vectors[0] if single else vectors
+
+
+def quantize_onnx(model_path="./local_model"):
+    """对导出的ONNX模型做动态int8量化（权重int8，激活在推理时动态量化）"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    source = onnx_path_for(model_path)
+    target = onnx_path_for(model_path, quantized=True)
+    quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+    return target
+
+
+def export_onnx(model_path="./local_model", quantize=False, opset=14):
+    """
+    将本地模型的Transformer部分导出为ONNX（需要torch与transformers，离线执行一次即可）
+
+    池化与归一化在 OnnxSentenceEncoder 中用numpy完成，导出的图只输出 last_hidden_state。
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    model = AutoModel.from_pretrained(model_path)
+    model.eval()
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    sample = tokenizer(VERIFY_TEXTS[:2], padding=True, return_tensors="pt")
+
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    path = onnx_path_for(model_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            do_constant_folding=True,
+        )
+    print(f"已导出: {path}")
+
+    if quantize:
+        print(f"已量化: {quantize_onnx(model_path)}")
+    return path
+
+
+def verify_encoder(model_path="./local_model", encoder=None, texts=None, min_cosine=None):
+    """
+    与PyTorch（SentenceTransformer）的编码结果逐条对比
+
+    参数：
+    encoder: 待校验的编码器，默认加载未量化的ONNX模型
+    texts: 校验文本，默认使用 VERIFY_TEXTS
+    min_cosine: 每条文本要求的最小余弦相似度；默认float32模型0.9999、int8模型0.99
+
+    返回：
+    差异统计字典（max_abs_diff / min_cosine / mean_cosine / threshold / passed）
+    """
+    from sentence_transformers import SentenceTransformer
+
+    encoder = encoder or OnnxSentenceEncoder(model_path)
+    texts = list(texts or VERIFY_TEXTS)
+    if min_cosine is None:
+        min_cosine = 0.99 if getattr(encoder, "quantized", False) else 0.9999
+
+    reference = normalize_rows(SentenceTransformer(model_path).encode(texts))
+    candidate = normalize_rows(encoder.encode(texts))
+    cosine = np.sum(reference * candidate, axis=1)
+    return {
+        "max_abs_diff": float(np.abs(reference - candidate).max()),
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "threshold": min_cosine,
+        "passed": bool(cosine.min() >= min_cosine),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地句向量模型的ONNX导出与校验")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="导出ONNX模型（需要torch），并与PyTorch结果对比")
+    export_parser.add_argument("--model", default="./local_model", help="本地模型路径")
+    export_parser.add_argument("--quantize", action="store_true", help="同时导出动态int8量化模型")
+    export_parser.add_argument("--opset", type=int, default=14)
+
+    verify_parser = subparsers.add_parser("verify", help="对比ONNX与PyTorch的编码结果")
+    verify_parser.add_argument("--model", default="./local_model", help="本地模型路径")
+    verify_parser.add_argument("--quantized", action="store_true", help="校验int8量化模型")
+    verify_parser.add_argument("--min-cosine", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.model, quantize=args.quantize, opset=args.opset)
+        variants = [False, True] if args.quantize else [False]
+        min_cosine = None
+    else:
+        variants = [args.quantized]
+        min_cosine = args.min_cosine
+
+    failed = False
+    for quantized in variants:
+        encoder = OnnxSentenceEncoder(args.model, quantized=quantized)
+        report = verify_encoder(args.model, encoder, min_cosine=min_cosine)
+        name = "int8" if quantized else "float32"
+        print(f"[{name}] " + json.dumps(report, ensure_ascii=False))
+        failed = failed or not report["passed"]
+    if failed:
+        raise SystemExit("ONNX编码结果与PyTorch差异超出容差")
+    print("校验通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# query_batcher.py
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+
+class BatcherClosedError(RuntimeError):
+    """微批处理器已关闭，查询未被编码"""
+
+
+class MicroBatcher:
+    """
+    查询编码微批处理器
+
+    并发线程提交的查询进入同一队列，后台线程在 max_wait_ms 时间窗口内
+    收集最多 max_batch_size 条查询，合并为一次 encode 调用，再把结果分发
+    给各自等待的调用方。模型正在前向计算时到达的查询会自然积攒到下一批。
+    每个提交的查询都一定会得到结果或异常：编码失败、返回数量不符或处理器关闭时，
+    对应的 Future 以异常结束。
+    """
+
+    def __init__(self, encode_fn, max_batch_size=32, max_wait_ms=3, timeout=30.0):
+        """
+        参数：
+        encode_fn: 批量编码函数，输入文本列表，返回等长的向量序列
+        max_batch_size: 单批最大查询数
+        max_wait_ms: 收到首条查询后等待更多查询的最长时间（毫秒）
+        timeout: encode() 默认的最长等待时间（秒）
+        """
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._closed = False
+        # 保证关闭信号之后不会再有查询入队
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(
+            target=self._run, name="query-micro-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, text):
+        """提交一条查询，返回 Future，结果为该查询的向量"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise BatcherClosedError("微批处理器已关闭")
+            self._queue.put((text, future))
+        return future
+
+    def encode(self, text, timeout=None):
+        """
+        提交并阻塞等待单条查询的向量
+
+        timeout为None时使用 self.timeout；超时抛出 concurrent.futures.TimeoutError，
+        尚未开始编码的查询随之取消。
+        """
+        future = self.submit(text)
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def close(self):
+        """停止后台线程（已排队的查询会先处理完）"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._worker.join()
+
+    def _collect(self, first):
+        """以首条查询为起点，在时间窗口内收集一批查询"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # 先取出已排队的查询，队列为空时在剩余窗口内等待新查询
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # 关闭信号放回队列，由主循环处理
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._fail_pending(BatcherClosedError("微批处理器已关闭"))
+                return
+            # 跳过等待超时后已被取消的查询
+            batch = [
+                (text, future) for text, future in self._collect(item)
+                if future.set_running_or_notify_cancel()
+            ]
+            if not batch:
+                continue
+            try:
+                vectors = self.encode_fn([text for text, _ in batch])
+                if len(vectors) != len(batch):
+                    raise ValueError(f"编码结果数量不符：提交 {len(batch)} 条，返回 {len(vectors)} 条")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vec in zip(batch, vectors):
+                future.set_result(vec)
+
+    def _fail_pending(self, error):
+        """关闭后队列中剩余的查询（正常情况下没有）以异常结束"""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(error)
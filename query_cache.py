@@ -0,0 +1,127 @@
+# query_cache.py
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query_text(text):
+    """
+    查询文本归一化（作为缓存键）
+
+    - NFKC：全角字母/数字/标点转换为半角
+    - 去除标点符号（如“？”“，”“?”）
+    - 合并连续空白、去除首尾空白，英文统一小写
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    text = "".join(
+        " " if unicodedata.category(ch).startswith("P") else ch for ch in text
+    )
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+class QueryEmbeddingCache:
+    """查询向量LRU缓存（线程安全，可选磁盘持久化）"""
+
+    def __init__(self, max_size=1024, persist_path=None, fingerprint=None):
+        """
+        参数：
+        max_size: 最大缓存条目数
+        persist_path: 持久化文件路径（.npz），为None时仅在内存中缓存
+        fingerprint: 编码器指纹（模型路径、编码后端、向量维度等），随缓存一起保存；
+                     加载时与文件中的指纹不同则丢弃文件，避免换模型后返回旧模型的向量
+        """
+        self.max_size = max_size
+        self.persist_path = persist_path
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+
+        if persist_path and os.path.exists(persist_path):
+            try:
+                self.load(persist_path)
+            except Exception as e:
+                print(f"查询缓存加载失败，使用空缓存: {str(e)}")
+
+    def get(self, query):
+        """按归一化文本查找向量，未命中返回None"""
+        key = normalize_query_text(query)
+        with self._lock:
+            vec = self._entries.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, query, vec):
+        """写入查询向量，超出容量时淘汰最久未使用的条目"""
+        if self.max_size <= 0:
+            return
+        key = normalize_query_text(query)
+        vec = np.asarray(vec, dtype=np.float32)
+        with self._lock:
+            self._entries[key] = vec
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def stats(self):
+        """命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def save(self, path=None):
+        """保存到磁盘（原子替换），按LRU顺序写入以便重启后保持淘汰顺序"""
+        path = path or self.persist_path
+        if not path:
+            return
+        with self._lock:
+            if not self._entries:
+                return
+            keys = np.array(list(self._entries.keys()), dtype=str)
+            vectors = np.stack(list(self._entries.values()))
+            self._dirty = False
+        # 临时文件名带进程号：多个worker或检索服务同时保存时不会互相覆盖
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, keys=keys, vectors=vectors, fingerprint=np.array(self.fingerprint or "", dtype=str))
+        os.replace(tmp_path, path)
+
+    def save_if_dirty(self):
+        """仅在有新写入时保存"""
+        if self._dirty:
+            self.save()
+
+    def load(self, path):
+        """从磁盘加载缓存条目"""
+        if self.max_size <= 0:
+            return
+        with np.load(path, allow_pickle=False) as data:
+            fingerprint = str(data["fingerprint"]) if "fingerprint" in data.files else None
+            if fingerprint != (self.fingerprint or ""):
+                print(f"查询缓存由其他编码器生成，已丢弃: {path}")
+                return
+            keys = data["keys"]
+            vectors = data["vectors"]
+        with self._lock:
+            for key, vec in zip(keys[-self.max_size:], vectors[-self.max_size:]):
+                self._entries[str(key)] = vec
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,17 +1,112 @@
 # rag_prompt_generator.py
 import pandas as pd
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+import pyarrow as pa
+import pyarrow.parquet as pq
+from vector_index import (
+    QuantizedMatrix,
+    load_full_precision_matrix,
+    load_or_build_index,
+    normalize_rows,
+    normalize_vector,
+    open_mapped_matrix,
+    rescore,
+    top_k,
+)
+from lexical_index import load_or_build_lexical_index
+from context_packer import TokenCounter, pack_context
+from text_store import build_text_store, open_text_store
+from query_batcher import BatcherClosedError, MicroBatcher
+from query_cache import QueryEmbeddingCache
+import atexit
+import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+ENCODER_BACKENDS = ("torch", "onnx")
+
+
+def _load_encoder(model_path, backend, params):
+    """加载查询编码器；torch / sentence_transformers 只在torch后端下导入"""
+    if backend == "onnx":
+        from onnx_encoder import OnnxSentenceEncoder
+        return OnnxSentenceEncoder(model_path, **params)
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_path, **params)
+
+
+def _encoder_fingerprint(model_path, backend, params, dim):
+    """查询编码器指纹：模型路径、编码后端及其参数、向量维度，任一变化时持久化的查询向量失效"""
+    return json.dumps(
+        [os.path.abspath(model_path), backend, sorted((params or {}).items()), int(dim)],
+        ensure_ascii=False, default=str
+    )
+
+
+class _KnowledgeSnapshot:
+    """
+    一次加载得到的知识库状态，热更新时整体替换
+
+    段落文本存放在内存映射的文本表中，元数据列（filename、type等）为Arrow表，
+    检索热路径只按行号读取选中的几段文本，不经过pandas。
+    """
+
+    def __init__(self, meta, texts, embeddings, full_embeddings, index, lexical_index,
+                 partitions, token_counts, mtime):
+        self.meta = meta
+        self.texts = texts
+        self.embeddings = embeddings
+        self.full_embeddings = full_embeddings
+        self.index = index
+        self.lexical_index = lexical_index
+        self.partitions = partitions
+        self.token_counts = token_counts
+        self.mtime = mtime
+
+    def __len__(self):
+        return len(self.texts)
+
+    def frame(self, rows=None):
+        """构建包含文本与元数据列的DataFrame；rows为None时包含全部段落（会解码全部文本）"""
+        if rows is None:
+            rows = np.arange(len(self.texts))
+        rows = np.asarray(rows, dtype=np.int64)
+        df = self.meta.take(pa.array(rows)).to_pandas()
+        df.insert(0, 'text', self.texts.get_many(rows))
+        df.index = pd.Index(rows)
+        return df
+
 
 class RAGPromptGenerator:
+    # 支持按元数据过滤检索的列（加载时为每个取值预计算行号数组）
+    PARTITION_COLUMNS = ("type", "filename")
+
     def __init__(self, 
                  embeddings_file="embeddings.parquet",
                  model_path='./local_model',
                  top_n=7,
                  similarity_threshold=0.5,
-                 max_context_length=2000):
+                 max_context_length=2000,
+                 index_type="exact",
+                 index_params=None,
+                 batch_wait_ms=None,
+                 max_batch_size=32,
+                 query_cache_size=1024,
+                 query_cache_path=None,
+                 quantization=None,
+                 rescore_factor=4,
+                 lexical_mode=None,
+                 lexical_params=None,
+                 auto_reload_interval=None,
+                 mmap_embeddings=False,
+                 encoder_backend="torch",
+                 encoder_params=None,
+                 context_tokenizer_file=None,
+                 mmr_lambda=0.7,
+                 dedup_threshold=0.95,
+                 start_background_threads=True):
         """
         RAG增强Prompt生成器
         
@@ -20,7 +115,29 @@ class RAGPromptGenerator:
         model_path: 本地模型路径
         top_n: 最大返回段落数
         similarity_threshold: 相似度阈值
-        max_context_length: 上下文最大长度
+        max_context_length: 上下文最大长度（按LLM token计）
+        index_type: 向量索引类型，"exact"为精确检索，"ivf"为倒排近似检索
+        index_params: 索引参数，如 {"nlist": 256, "nprobe": 16}（nprobe越大召回越高）
+        batch_wait_ms: 微批等待窗口（毫秒），设置后并发查询合并为一次编码；None表示不启用
+        max_batch_size: 单次编码的最大查询数
+        query_cache_size: 查询向量LRU缓存容量（按归一化文本命中），0表示不缓存
+        query_cache_path: 查询缓存持久化文件（.npz），重启后可直接复用；None表示不持久化
+        quantization: 嵌入矩阵量化方式，"int8"（内存约为1/4，扫描与float32基本持平）；None表示使用float32
+        rescore_factor: 量化检索时先取 top_n*rescore_factor 个候选，再用全精度向量重排序
+        lexical_mode: BM25词法检索方式，"prefilter"先按词法预筛选候选再做向量打分，
+                      "hybrid"融合词法与向量得分；None表示仅使用向量检索
+        lexical_params: 词法检索参数，如 {"prefilter_size": 200, "fusion_weight": 0.3}
+        auto_reload_interval: 检查嵌入文件更新的间隔（秒），文件变化后自动热加载；None表示不检查
+        mmap_embeddings: 将归一化矩阵保存为 .f32.npy 并以内存映射方式使用，
+                         多个worker进程共享同一份物理内存
+        encoder_backend: 查询编码后端，"torch"为SentenceTransformer，
+                         "onnx"为ONNX Runtime（需先运行 python onnx_encoder.py export，不导入torch）
+        encoder_params: 编码器参数，如onnx后端的 {"quantized": True, "num_threads": 4}
+        context_tokenizer_file: LLM的 tokenizer.json，用于精确计算上下文token数；None时按字符类别估算
+        mmr_lambda: 组装上下文时相关度与多样性的权衡（1为只看相关度）
+        dedup_threshold: 与已选段落余弦相似度不低于该值的段落视为重复，不放入上下文
+        start_background_threads: 是否立即启动微批编码与热加载线程；gunicorn预加载模式下master进程传False，
+                                  由fork出的worker在 after_fork() 中启动，master不编码查询、不重建快照
         """
         if not os.path.exists(embeddings_file):
             raise FileNotFoundError(f"嵌入文件不存在: {embeddings_file}")
@@ -28,83 +145,470 @@ class RAGPromptGenerator:
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"模型路径不存在: {model_path}")
 
+        if encoder_backend not in ENCODER_BACKENDS:
+            raise ValueError(f"不支持的编码后端: {encoder_backend}，可选：{'、'.join(ENCODER_BACKENDS)}")
+
         # 初始化配置
         self.top_n = top_n
         self.similarity_threshold = similarity_threshold
         self.max_context_length = max_context_length
+        self.max_batch_size = max_batch_size
+        self.mmr_lambda = mmr_lambda
+        self.dedup_threshold = dedup_threshold
+        self.token_counter = TokenCounter(context_tokenizer_file)
         
-        # 加载资源
-        print("加载知识库...")
-        self.df = self._load_embeddings(embeddings_file)
+        self.embeddings_file = embeddings_file
+        self.index_type = index_type
+        self.index_params = dict(index_params or {})
+        self.quantization = quantization
+        self.rescore_factor = max(1, rescore_factor)
+        self.mmap_embeddings = mmap_embeddings
+        self.batch_wait_ms = batch_wait_ms
+        self.auto_reload_interval = auto_reload_interval
+        self.encoder_backend = encoder_backend
+
+        if lexical_mode not in (None, "prefilter", "hybrid"):
+            raise ValueError(f"不支持的词法检索方式: {lexical_mode}，可选：prefilter、hybrid")
+        self.lexical_mode = lexical_mode
+        self.lexical_params = dict(lexical_params or {})
+        self.prefilter_size = self.lexical_params.pop("prefilter_size", 200)
+        self.fusion_weight = self.lexical_params.pop("fusion_weight", 0.3)
         
-        print("加载词嵌入模型...")
-        self.model = SentenceTransformer(model_path)
-    
-    def _load_embeddings(self, file_path):
-        """加载嵌入数据"""
-        if file_path.endswith('.parquet'):
-            return pd.read_parquet(file_path)
+        # 加载资源：词嵌入模型在后台线程中与知识库、索引并行加载
+        self._reload_lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            model_future = executor.submit(
+                _load_encoder, model_path, encoder_backend, dict(encoder_params or {})
+            )
+            self._kb = self._load_knowledge_base()
+            print("加载词嵌入模型...")
+            self.model = model_future.result()
+
+        # 查询向量缓存（可选持久化，进程退出时自动保存）
+        self.query_cache = QueryEmbeddingCache(
+            max_size=query_cache_size,
+            persist_path=query_cache_path,
+            fingerprint=_encoder_fingerprint(
+                model_path, encoder_backend, encoder_params, self._kb.embeddings.shape[1]
+            )
+        )
+        if query_cache_path:
+            atexit.register(self.query_cache.save_if_dirty)
+
+        self.batcher = None
+        self._stop_reload = threading.Event()
+        if start_background_threads:
+            self._start_background_threads()
+
+    def _start_background_threads(self):
+        """启动微批编码线程与知识库热更新线程（均为可选）"""
+        # 并发查询微批编码
+        if self.batch_wait_ms is not None:
+            self.batcher = MicroBatcher(
+                self._encode_queries,
+                max_batch_size=self.max_batch_size,
+                max_wait_ms=self.batch_wait_ms
+            )
+
+        # 知识库热更新：后台线程定期检查嵌入文件修改时间
+        if self.auto_reload_interval:
+            threading.Thread(
+                target=self._auto_reload_loop,
+                args=(self.auto_reload_interval,),
+                name="rag-auto-reload",
+                daemon=True
+            ).start()
+
+    def after_fork(self):
+        """
+        在fork出的子进程（如gunicorn worker）中调用：
+        线程不会随fork复制，需要重新创建锁与后台线程；模型与矩阵继续共享父进程内存
+        """
+        self._reload_lock = threading.Lock()
+        self._stop_reload = threading.Event()
+        self._start_background_threads()
+
+    # 当前知识库快照的便捷访问
+    # df 按需构建（解码全部文本，仅用于调试与兼容），检索热路径不使用
+    df = property(lambda self: self._kb.frame())
+    texts = property(lambda self: self._kb.texts)
+    n_chunks = property(lambda self: len(self._kb))
+    embeddings = property(lambda self: self._kb.embeddings)
+    full_embeddings = property(lambda self: self._kb.full_embeddings)
+    index = property(lambda self: self._kb.index)
+    lexical_index = property(lambda self: self._kb.lexical_index)
+    # 知识库版本（嵌入文件修改时间），热加载后变化，用于使依赖旧知识库的缓存失效
+    kb_version = property(lambda self: self._kb.mtime)
+
+    def _load_knowledge_base(self):
+        """加载嵌入文件并构建矩阵与索引，返回新的知识库快照"""
+        embeddings_file = self.embeddings_file
+        mtime = os.path.getmtime(embeddings_file)
+
+        print("加载知识库...")
+        if embeddings_file.endswith('.parquet'):
+            # 按列读取：元数据列常驻，文本列写入内存映射文本表，嵌入列只在需要时读取
+            parquet = pq.ParquetFile(embeddings_file)
+            n_rows = parquet.metadata.num_rows
+            meta = parquet.read(columns=[
+                name for name in parquet.schema_arrow.names if name not in ('text', 'embedding')
+            ])
+            texts = open_text_store(embeddings_file, n_rows)
+            if texts is None:
+                texts = build_text_store(embeddings_file, parquet.read(columns=['text']).column('text'))
+            read_matrix = lambda: self._read_embedding_column(parquet, n_rows)
         else:
-            df = pd.read_csv(file_path)
-            df['embedding'] = df['embedding'].apply(
-                lambda x: np.fromstring(x[1:-1], sep=', ')
+            df = self._load_embeddings(embeddings_file)
+            n_rows = len(df)
+            meta = pa.Table.from_pandas(
+                df.drop(columns=['text', 'embedding']), preserve_index=False
+            )
+            texts = open_text_store(embeddings_file, n_rows) or build_text_store(
+                embeddings_file, df['text'].values
+            )
+            read_matrix = lambda: self._build_embedding_matrix(df)
+
+        # 已有最新的 .f32.npy 时直接映射，不再读取与解析嵌入列
+        use_mapped = self.mmap_embeddings or self.quantization
+        embeddings = open_mapped_matrix(embeddings_file, n_rows=n_rows) if use_mapped else None
+        if embeddings is None:
+            embeddings = read_matrix()
+            if use_mapped:
+                embeddings = load_full_precision_matrix(embeddings, embeddings_file)
+
+        # 量化存储：常驻内存只保留量化矩阵，全精度矩阵以内存映射方式用于重排序
+        full_embeddings = None
+        if self.quantization:
+            full_embeddings = embeddings
+            embeddings = QuantizedMatrix.from_matrix(full_embeddings, self.quantization)
+
+        print("加载向量索引...")
+        index = load_or_build_index(
+            embeddings,
+            index_type=self.index_type,
+            embeddings_file=embeddings_file,
+            **self.index_params
+        )
+
+        # 词法索引（BM25，可选）
+        lexical_index = None
+        if self.lexical_mode:
+            print("加载词法索引...")
+            lexical_index = load_or_build_lexical_index(
+                texts, embeddings_file, **self.lexical_params
             )
-            return df
+
+        partitions = self._build_partitions(meta)
+
+        # 预计算每个段落的LLM token数，组装上下文时无需重复分词
+        token_counts = self.token_counter.count_many(texts)
+
+        return _KnowledgeSnapshot(
+            meta, texts, embeddings, full_embeddings, index, lexical_index, partitions,
+            token_counts, mtime
+        )
+
+    @classmethod
+    def _build_partitions(cls, meta):
+        """为每个过滤列的每个取值预计算有序行号数组，过滤检索时只对这些行打分"""
+        partitions = {}
+        for column in cls.PARTITION_COLUMNS:
+            if column not in meta.column_names:
+                continue
+            encoded = meta.column(column).combine_chunks().dictionary_encode()
+            codes = encoded.indices.to_numpy(zero_copy_only=False)
+            values = encoded.dictionary.to_pylist()
+            valid = np.flatnonzero(encoded.is_valid().to_numpy(zero_copy_only=False))
+            # 稳定排序后按取值切分，每组内行号保持升序
+            order = valid[np.argsort(codes[valid], kind='stable')]
+            bounds = np.cumsum(np.bincount(codes[valid].astype(np.int64), minlength=len(values)))
+            partitions[column] = {
+                str(value): order[start:end].astype(np.int64)
+                for value, start, end in zip(values, np.r_[0, bounds[:-1]], bounds)
+                if end > start
+            }
+        return partitions
+
+    def available_filters(self):
+        """返回可用的过滤条件，如 {"type": ["TXT"], "filename": [...]}"""
+        return {
+            column: sorted(values) for column, values in self._kb.partitions.items()
+        }
+
+    def reload(self):
+        """
+        热加载知识库：在后台构建新快照，完成后整体替换，
+        正在进行的检索继续使用旧快照，不需要重启服务
+        """
+        with self._reload_lock:
+            self._kb = self._load_knowledge_base()
+        print(f"知识库已热加载：{len(self._kb)} 个段落")
+
+    def reload_if_changed(self):
+        """嵌入文件修改时间变化时热加载，返回是否进行了加载"""
+        try:
+            changed = os.path.getmtime(self.embeddings_file) != self._kb.mtime
+        except OSError:
+            return False
+        if changed:
+            self.reload()
+        return changed
+
+    def _auto_reload_loop(self, interval):
+        while not self._stop_reload.wait(interval):
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                print(f"知识库热加载失败，继续使用旧数据: {str(e)}")
     
-    def _find_similar_texts(self, query_vec):
-        """查找相似文本"""
-        embeddings = np.stack(self.df['embedding'].values)
-        similarities = cosine_similarity([query_vec], embeddings)[0]
-        
-        qualified_indices = np.where(similarities >= self.similarity_threshold)[0]
-        
-        if qualified_indices.size == 0:
-            top_indices = np.argsort(-similarities)[:self.top_n]
-        else:
-            sorted_indices = np.argsort(-similarities[qualified_indices])
-            top_indices = qualified_indices[sorted_indices][:self.top_n]
-        
-        return self.df.iloc[top_indices]
+    def _load_embeddings(self, file_path):
+        """加载CSV格式的嵌入数据（parquet按列读取，见 _load_knowledge_base）"""
+        df = pd.read_csv(file_path)
+        df['embedding'] = df['embedding'].apply(
+            lambda x: np.fromstring(x[1:-1], sep=', ')
+        )
+        return df
+
+    @staticmethod
+    def _read_embedding_column(parquet, n_rows):
+        """只读取parquet的嵌入列，直接由Arrow列表缓冲区构建矩阵（不逐行创建数组对象）"""
+        column = parquet.read(columns=['embedding']).column('embedding').combine_chunks()
+        values = column.flatten().to_numpy(zero_copy_only=False)
+        if n_rows == 0 or values.size % n_rows:
+            raise ValueError("嵌入向量为空或维度不一致")
+        return normalize_rows(values.reshape(n_rows, -1))
+
+    @staticmethod
+    def _build_embedding_matrix(df):
+        """构建连续、L2归一化的float32嵌入矩阵（仅在加载时执行一次）"""
+        return normalize_rows(np.stack(df['embedding'].values))
+
+    def _dense_search(self, kb, query_vec, k):
+        """向量检索前k个段落 (下标数组, 相似度数组)"""
+        if kb.full_embeddings is None:
+            return kb.index.search(query_vec, k)
+        # 量化矩阵粗排，少量候选用全精度向量精排，阈值判断基于精确相似度
+        candidates, _ = kb.index.search(query_vec, k * self.rescore_factor)
+        return rescore(kb.full_embeddings, candidates, query_vec, k)
+
+    @staticmethod
+    def _exact_scores(kb, rows, query_vec):
+        """计算指定段落与查询向量的精确相似度"""
+        matrix = kb.embeddings if kb.full_embeddings is None else kb.full_embeddings
+        return np.asarray(matrix[rows], dtype=np.float32) @ query_vec
+
+    def _hybrid_search(self, kb, query_vec, user_query):
+        """融合检索：向量与BM25各取候选，按加权得分排序，相似度仍为向量相似度"""
+        pool = self.top_n * 4
+        dense_indices, _ = self._dense_search(kb, query_vec, pool)
+        lexical_scores = kb.lexical_index.score(user_query)
+        lexical_indices = top_k(lexical_scores, pool)
+        lexical_indices = lexical_indices[lexical_scores[lexical_indices] > 0]
+
+        candidates = np.union1d(dense_indices, lexical_indices)
+        similarities = self._exact_scores(kb, candidates, query_vec)
+        lexical = lexical_scores[candidates]
+        if lexical.max(initial=0) > 0:
+            lexical = lexical / lexical.max()
+        fused = (1.0 - self.fusion_weight) * similarities + self.fusion_weight * lexical
+
+        best = top_k(fused, self.top_n)
+        return candidates[best], similarities[best]
+
+    @staticmethod
+    def _filter_rows(kb, filters):
+        """
+        将过滤条件转换为行号数组：同一列的多个取值取并集，不同列之间取交集
+
+        filters示例：{"type": "TXT"}、{"filename": ["基本港.txt", "主要航线.txt"]}
+        """
+        rows = None
+        for column, values in filters.items():
+            if column not in kb.partitions:
+                raise ValueError(
+                    f"不支持的过滤列: {column}，可选：{', '.join(kb.partitions)}"
+                )
+            if isinstance(values, str):
+                values = [values]
+            parts = [kb.partitions[column].get(str(v)) for v in values]
+            parts = [part for part in parts if part is not None]
+            column_rows = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+            rows = column_rows if rows is None else np.intersect1d(rows, column_rows, assume_unique=True)
+        return rows
+
+    def _filtered_search(self, kb, query_vec, rows, user_query=None):
+        """只对分区内的行打分（开销与分区大小成正比），融合模式下同样叠加BM25得分"""
+        if rows.size == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        similarities = self._exact_scores(kb, rows, query_vec)
+        ranking = similarities
+        if self.lexical_mode == "hybrid" and kb.lexical_index is not None and user_query:
+            lexical = kb.lexical_index.score(user_query)[rows]
+            if lexical.max(initial=0) > 0:
+                lexical = lexical / lexical.max()
+            ranking = (1.0 - self.fusion_weight) * similarities + self.fusion_weight * lexical
+        best = top_k(ranking, self.top_n)
+        return rows[best], similarities[best]
+
+    def _search(self, kb, query_vec, user_query=None, filters=None):
+        """按配置的检索方式返回前top_n个段落 (下标数组, 相似度数组)"""
+        if filters:
+            rows = self._filter_rows(kb, filters)
+            if rows.size < len(kb):
+                return self._filtered_search(kb, query_vec, rows, user_query)
+
+        if kb.lexical_index is not None and user_query:
+            if self.lexical_mode == "hybrid":
+                return self._hybrid_search(kb, query_vec, user_query)
+
+            # 词法预筛选：只对命中查询词的段落做向量打分，命中过少时退回全量向量检索
+            candidates = kb.lexical_index.candidates(user_query, self.prefilter_size)
+            if candidates.size >= self.top_n:
+                similarities = self._exact_scores(kb, candidates, query_vec)
+                best = top_k(similarities, self.top_n)
+                return candidates[best], similarities[best]
+
+        return self._dense_search(kb, query_vec, self.top_n)
+
+    def _retrieve(self, query_vec, user_query=None, filters=None):
+        """检索相似段落，返回 (知识库快照, 行号数组, 相似度数组)"""
+        # 整个检索过程使用同一个知识库快照，热加载不会造成数据不一致
+        kb = self._kb
+
+        # 归一化后的向量点积即为余弦相似度
+        query_vec = normalize_vector(query_vec)
+        top_indices, similarities = self._search(kb, query_vec, user_query, filters)
+
+        # 先取整体前top_n；若其中有达到阈值的段落，则只保留达标部分
+        # （与“达标段落按相似度取前top_n，否则取最相似top_n”的语义一致）
+        qualified = similarities >= self.similarity_threshold
+        if qualified.any():
+            top_indices, similarities = top_indices[qualified], similarities[qualified]
+
+        return kb, top_indices, similarities
+
+    def _find_similar_texts(self, query_vec, user_query=None, filters=None):
+        """查找相似文本（filters为元数据过滤条件，可选）"""
+        kb, top_indices, _ = self._retrieve(query_vec, user_query, filters)
+        return kb.frame(top_indices)
+
+    def _create_prompt_context(self, kb, indices, similarities):
+        """
+        创建上下文内容：按token预算装入段落，近似重复的段落只保留一个，
+        放不下整段时在中英文句子边界处截断
+        """
+        source = kb.full_embeddings if kb.full_embeddings is not None else kb.embeddings
+        vectors = np.asarray(source[indices], dtype=np.float32)
+        return pack_context(
+            kb.texts.get_many(indices),
+            kb.token_counts[indices],
+            similarities,
+            vectors,
+            self.max_context_length,
+            self.token_counter,
+            mmr_lambda=self.mmr_lambda,
+            dedup_threshold=self.dedup_threshold,
+        )
     
-    def _create_prompt_context(self, similar_texts):
-        """创建上下文内容"""
-        context_parts = []
-        current_length = 0
+    def _encode_queries(self, queries):
+        """批量生成查询向量（一次前向计算）"""
+        return self.model.encode(list(queries), batch_size=self.max_batch_size)
+
+    def _encode_query(self, user_query):
+        """生成单条查询向量；优先命中缓存，启用微批时与并发查询合并编码"""
+        query_vec = self.query_cache.get(user_query)
+        if query_vec is not None:
+            return query_vec
+
+        batcher = self.batcher
+        try:
+            query_vec = batcher.encode(user_query) if batcher is not None else None
+        except BatcherClosedError:
+            query_vec = None  # 微批处理器已关闭，直接编码
+        if query_vec is None:
+            query_vec = self._encode_queries([user_query])[0]
+        self.query_cache.put(user_query, query_vec)
+        return query_vec
+
+    def _encode_query_batch(self, queries):
+        """批量生成查询向量，只对未命中缓存的查询做一次编码"""
+        query_vecs = [self.query_cache.get(query) for query in queries]
+        missing = [i for i, vec in enumerate(query_vecs) if vec is None]
+        if missing:
+            encoded = self._encode_queries([queries[i] for i in missing])
+            for i, vec in zip(missing, encoded):
+                query_vecs[i] = vec
+                self.query_cache.put(queries[i], vec)
+        return query_vecs
+
+    def cache_stats(self):
+        """查询向量缓存命中统计"""
+        return self.query_cache.stats()
+
+    def encode_query(self, user_query):
+        """
+        生成查询向量（经过缓存与微批处理），可传给 generate_prompt 复用
         
-        for text in similar_texts['text'].values:
-            text_segment = f"相关段落：{text}"
-            added_length = len(text_segment) + 2
-            
-            if current_length + added_length > self.max_context_length:
-                available_length = self.max_context_length - current_length - 20
-                if available_length > 50:
-                    truncated = text[:available_length].rsplit('.', 1)[0] + "..."
-                    context_parts.append(f"相关段落：{truncated}")
-                break
-                
-            context_parts.append(text_segment)
-            current_length += added_length
+        参数：
+        user_query: 用户查询文本
         
-        return "\n\n".join(context_parts)
-    
-    def generate_prompt(self, user_query):
+        返回：
+        查询向量
+        """
+        return self._encode_query(user_query)
+
+    def generate_prompt(self, user_query, query_vec=None, filters=None):
         """
         生成增强后的prompt
         
         参数：
         user_query: 用户查询文本
+        query_vec: 已计算好的查询向量（可选），为None时自动编码
+        filters: 元数据过滤条件（可选），如 {"type": "TXT"} 或 {"filename": ["基本港.txt"]}
         
         返回：
         增强后的prompt字符串
         """
         # 生成查询向量
-        query_vec = self.model.encode([user_query])[0]
+        if query_vec is None:
+            query_vec = self._encode_query(user_query)
+        return self._build_prompt(user_query, query_vec, filters)
+
+    def generate_prompts(self, queries, filters=None):
+        """
+        批量生成增强后的prompt（所有查询合并为一次编码）
         
+        参数：
+        queries: 用户查询文本列表
+        filters: 元数据过滤条件（可选），对所有查询生效
+        
+        返回：
+        与输入顺序一致的prompt字符串列表
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        query_vecs = self._encode_query_batch(queries)
+        return [
+            self._build_prompt(query, query_vec, filters)
+            for query, query_vec in zip(queries, query_vecs)
+        ]
+
+    def close(self):
+        """释放后台资源（微批线程、热加载线程），并保存查询缓存"""
+        self._stop_reload.set()
+        if self.batcher is not None:
+            self.batcher.close()
+            self.batcher = None
+        self.query_cache.save_if_dirty()
+
+    def _build_prompt(self, user_query, query_vec, filters=None):
+        """根据查询向量检索并组装prompt"""
         # 查找相似文本
-        similar_texts = self._find_similar_texts(query_vec)
+        kb, indices, similarities = self._retrieve(query_vec, user_query, filters)
         
         # 构建上下文
-        context = self._create_prompt_context(similar_texts)
+        context = self._create_prompt_context(kb, indices, similarities)
         
         # 组装最终prompt
         return (
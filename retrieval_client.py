@@ -0,0 +1,132 @@
+# retrieval_client.py
+# 检索服务（retrieval_service.py）的轻量客户端：只依赖标准库与numpy，web进程无需加载模型
+import http.client
+import json
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+import numpy as np
+
+
+class RetrievalServiceError(Exception):
+    """检索服务不可用或返回错误，调用方应回退到进程内检索"""
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """通过Unix套接字发送HTTP请求"""
+
+    def __init__(self, path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class RetrievalClient:
+    """
+    检索服务客户端
+
+    连接失败或超时后在 retry_after 秒内直接判定服务不可用，
+    避免每个请求都等待一次超时。
+    """
+
+    def __init__(self, url, connect_timeout=0.5, timeout=5.0, retry_after=30.0):
+        """
+        参数：
+        url: 服务地址，如 "unix:///tmp/rag.sock" 或 "http://127.0.0.1:8600"
+        connect_timeout: 建立连接的超时（秒）
+        timeout: 等待响应的超时（秒）
+        retry_after: 服务不可用后暂停调用的时长（秒）
+        """
+        try:
+            parts = urlsplit(url)
+            port = parts.port
+        except (TypeError, ValueError) as e:
+            raise RetrievalServiceError(f"无效的检索服务地址: {url!r}（{str(e)}）") from e
+        if parts.scheme not in ("unix", "http"):
+            raise RetrievalServiceError(f"不支持的检索服务地址: {url}，应为 unix:///path 或 http://host:port")
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._unix_path = parts.path if parts.scheme == "unix" else None
+        self._host = parts.hostname
+        self._port = port or 80
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._unix_path:
+            return _UnixHTTPConnection(self._unix_path, timeout=self.connect_timeout)
+        return http.client.HTTPConnection(self._host, self._port, timeout=self.connect_timeout)
+
+    def _mark_down(self):
+        with self._lock:
+            self._down_until = time.monotonic() + self.retry_after
+
+    def _request(self, method, path, payload=None):
+        if time.monotonic() < self._down_until:
+            raise RetrievalServiceError("检索服务暂不可用")
+
+        connection = self._connection()
+        try:
+            connection.connect()
+            connection.sock.settimeout(self.timeout)
+            body = None if payload is None else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            status, data = response.status, response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self._mark_down()
+            raise RetrievalServiceError(f"检索服务请求失败: {str(e)}") from e
+        finally:
+            connection.close()
+
+        try:
+            result = json.loads(data or b"{}")
+        except ValueError as e:
+            raise RetrievalServiceError(f"检索服务返回无效数据: {str(e)}") from e
+        if not isinstance(result, dict):
+            raise RetrievalServiceError("检索服务返回无效数据: 应为JSON对象")
+        if status != 200:
+            raise RetrievalServiceError(f"检索服务返回 {status}: {result.get('error', '')}")
+        return result
+
+    def generate_prompt(self, user_query, filters=None):
+        """
+        远程生成增强prompt
+
+        返回：
+        (查询向量, 增强后的prompt字符串)
+        """
+        query_vec, prompt, _ = self.generate_prompt_with_version(user_query, filters)
+        return query_vec, prompt
+
+    def generate_prompt_with_version(self, user_query, filters=None):
+        """同 generate_prompt，另返回服务端当前的知识库版本（热加载后变化）"""
+        result = self._request("POST", "/prompt", {"query": user_query, "filters": filters})
+        try:
+            query_vec = np.asarray(result["query_vec"], dtype=np.float32)
+            prompt = result["prompt"]
+        except (KeyError, TypeError, ValueError) as e:
+            raise RetrievalServiceError(f"检索服务响应不完整: {e!r}") from e
+        if query_vec.ndim != 1 or query_vec.size == 0 or not isinstance(prompt, str):
+            raise RetrievalServiceError("检索服务响应不完整: 查询向量或prompt无效")
+        return query_vec, prompt, result.get("kb_version")
+
+    def generate_prompts(self, queries, filters=None):
+        """远程批量生成增强prompt，返回与输入顺序一致的列表"""
+        queries = list(queries)
+        result = self._request("POST", "/prompts", {"queries": queries, "filters": filters})
+        prompts = result.get("prompts")
+        if not isinstance(prompts, list) or len(prompts) != len(queries):
+            raise RetrievalServiceError("检索服务响应不完整: prompts数量与查询不一致")
+        return prompts
+
+    def health(self):
+        """服务状态（段落数、查询缓存统计）"""
+        return self._request("GET", "/health")
@@ -0,0 +1,134 @@
+# retrieval_service.py
+# 独立检索服务：单独持有词嵌入模型、知识库与索引，通过本地Unix套接字或HTTP为web worker生成增强prompt
+#   python retrieval_service.py --unix /tmp/rag.sock      （web进程设置 RAG_SERVICE_URL=unix:///tmp/rag.sock）
+#   python retrieval_service.py --port 8600               （web进程设置 RAG_SERVICE_URL=http://127.0.0.1:8600）
+# 每个请求由独立线程处理，并发请求的查询编码由生成器的微批线程合并为一次前向计算
+import argparse
+import json
+import os
+import signal
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "RAGRetrieval/1.0"
+
+    def address_string(self):
+        # Unix套接字的客户端地址为空字符串
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        """不逐条打印访问日志，错误单独输出"""
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send(404, {"error": f"未知路径: {self.path}"})
+            return
+        generator = self.server.generator
+        self._send(200, {
+            "status": "ok",
+            "chunks": generator.n_chunks,
+            "kb_version": generator.kb_version,
+            "query_cache": generator.cache_stats(),
+        })
+
+    def do_POST(self):
+        generator = self.server.generator
+        try:
+            body = self._read_json()
+            filters = body.get("filters")
+            if self.path == "/prompt":
+                query = body["query"]
+                query_vec = generator.encode_query(query)
+                prompt = generator.generate_prompt(query, query_vec=query_vec, filters=filters)
+                self._send(200, {
+                    "prompt": prompt,
+                    "query_vec": np.asarray(query_vec, dtype=np.float32).tolist(),
+                    "kb_version": generator.kb_version,
+                })
+            elif self.path == "/prompts":
+                prompts = generator.generate_prompts(body["queries"], filters=filters)
+                self._send(200, {"prompts": prompts})
+            else:
+                self._send(404, {"error": f"未知路径: {self.path}"})
+        except (KeyError, TypeError, ValueError) as e:
+            self._send(400, {"error": f"请求参数错误: {str(e)}"})
+        except Exception as e:
+            print(f"❌ 检索请求处理失败：{str(e)}")
+            self._send(500, {"error": str(e)})
+
+
+# 监听队列长度：web worker并发请求较多时，默认的5会导致连接被拒绝
+LISTEN_BACKLOG = 128
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+
+class _TCPHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = LISTEN_BACKLOG
+
+
+def create_server(generator, host="127.0.0.1", port=8600, unix_socket=None):
+    """创建检索服务（unix_socket不为空时监听Unix套接字，否则监听TCP地址）"""
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)  # 上次未正常退出时残留的套接字文件
+        server = _UnixHTTPServer(unix_socket, _Handler)
+    else:
+        server = _TCPHTTPServer((host, port), _Handler)
+    server.generator = generator
+    return server
+
+
+def _stop(signum, frame):
+    # serve_forever 运行在主线程，不能在信号处理函数中调用 shutdown()，以异常方式退出循环
+    raise KeyboardInterrupt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG检索服务（持有模型与知识库，供web worker调用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--unix", default=None, help="监听的Unix套接字路径（优先于 --host/--port）")
+    args = parser.parse_args()
+
+    # 与web进程的进程内检索使用同一份配置
+    from main_logic import create_rag_generator
+    generator = create_rag_generator()
+    server = create_server(generator, args.host, args.port, args.unix)
+    address = args.unix or f"{args.host}:{args.port}"
+    print(f"✅ 检索服务已启动：{address}（{generator.n_chunks} 个段落）")
+
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        generator.close()
+        if args.unix and os.path.exists(args.unix):
+            os.unlink(args.unix)
+
+
+if __name__ == "__main__":
+    main()
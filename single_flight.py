@@ -0,0 +1,111 @@
+# single_flight.py
+# 请求合并：相同键的调用同时只执行一次，并发的相同调用等待并共享第一次调用的结果（或异常）
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """线程版本：等待者阻塞在Event上，不发出重复请求"""
+
+    def __init__(self):
+        self.leaders = 0
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """执行fn()并返回结果；同一key已有调用在进行时等待其完成并返回相同结果"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "shared": self.shared}
+
+
+# 领头调用被取消时交给等待者的标记：等待者重新竞争，由第一个醒来的接手调用
+_LEADER_CANCELLED = object()
+
+
+class AsyncSingleFlight:
+    """协程版本：同一事件循环内的等待者共享同一个Future"""
+
+    def __init__(self):
+        self.leaders = 0
+        self.shared = 0
+        self._calls = {}
+
+    async def do(self, key, fn):
+        """
+        await fn() 并返回结果；同一key已有调用在进行时等待其完成并返回相同结果
+
+        领头的调用被取消时，只有它自己收到 CancelledError，等待者中的一个接手重新调用fn()，
+        其余等待者改为等待新的调用。
+        """
+        loop = asyncio.get_running_loop()
+        # 不同事件循环的Future不能互相等待，按事件循环区分
+        flight_key = (id(loop), key)
+        counted = False
+        while True:
+            future = self._calls.get(flight_key)
+            if future is None:
+                break
+            if not counted:
+                self.shared += 1
+                counted = True
+            # shield：某个等待者被取消时不影响其他等待者
+            result = await asyncio.shield(future)
+            if result is not _LEADER_CANCELLED:
+                return result
+
+        future = self._calls[flight_key] = loop.create_future()
+        self.leaders += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.set_result(_LEADER_CANCELLED)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._calls.pop(flight_key, None)
+
+    def stats(self):
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "shared": self.shared}
@@ -0,0 +1,48 @@
+import numpy as np
+
+from answer_cache import SemanticAnswerCache, entity_signature
+
+
+def _vec(seed):
+    return np.random.default_rng(seed).standard_normal(384).astype(np.float32)
+
+
+def test_port_order_and_port_name_do_not_share_reports():
+    cache = SemanticAnswerCache()
+    vec = _vec(0)
+    cache.put(vec, "上海→鹿特丹报告", query_text="从上海到鹿特丹")
+
+    # 向量几乎相同（平均池化），但港口顺序或港口名不同
+    assert cache.get(vec, "从鹿特丹到上海") is None
+    assert cache.get(vec, "从上海到汉堡") is None
+    assert cache.get(vec, " 从上海到鹿特丹？") == "上海→鹿特丹报告"
+
+
+def test_nearly_identical_questions_share_reports():
+    cache = SemanticAnswerCache()
+    vec = _vec(2)
+    cache.put(vec, "基本港报告", query_text="世界基本港有哪些")
+    assert cache.get(vec, "世界基本港是哪些") == "基本港报告"
+    assert entity_signature("上海港到鹿特丹港的航线风险") == entity_signature("请分析从上海至鹿特丹的航线")
+    assert entity_signature("上海到新加坡 20 天") != entity_signature("上海到新加坡 30 天")
+
+
+def test_signature_ignores_punctuation_width_and_case():
+    assert entity_signature("Shanghai 到 Rotterdam？") == entity_signature("shanghai到ＲＯＴＴＥＲＤＡＭ?")
+    assert entity_signature("Shanghai to Rotterdam") != entity_signature("Rotterdam to Shanghai")
+
+
+def test_version_change_clears_cache():
+    cache = SemanticAnswerCache()
+    vec = _vec(1)
+    cache.set_version(1.0)
+    cache.put(vec, "旧报告", query_text="世界基本港", version=1.0)
+    assert cache.get(vec, "世界基本港") == "旧报告"
+
+    cache.set_version(2.0)
+    assert cache.get(vec, "世界基本港") is None
+    # 热加载前开始生成、之后才写入的报告不进入缓存
+    cache.put(vec, "旧报告", query_text="世界基本港", version=1.0)
+    assert cache.get(vec, "世界基本港") is None
+    cache.put(vec, "新报告", query_text="世界基本港", version=2.0)
+    assert cache.get(vec, "世界基本港") == "新报告"
@@ -0,0 +1,18 @@
+import pytest
+
+from build_embeddings import _Checkpoint
+
+
+def test_checkpoint_refuses_resume_with_different_chunking(tmp_path):
+    output_file = str(tmp_path / "embeddings.parquet")
+    params = {"chunk_size": 1000, "chunk_overlap": 100, "model": "/models/a"}
+    checkpoint = _Checkpoint(output_file, params)
+    (tmp_path / "embeddings.parquet.parts").mkdir()
+    checkpoint.commit(None, [str(tmp_path / "a.txt")])
+
+    assert _Checkpoint(output_file, dict(params)).done == {str(tmp_path / "a.txt")}
+    with pytest.raises(ValueError):
+        _Checkpoint(output_file, dict(params, chunk_size=500))
+
+    _Checkpoint.remove(output_file)
+    assert not _Checkpoint(output_file, dict(params, chunk_size=500)).done
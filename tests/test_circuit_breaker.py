@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import circuit_breaker
+import http_session
+from circuit_breaker import CircuitBreaker
+from weather_cache import WeatherCache
+from weather_service import AsyncWeatherService, WeatherService
+
+
+def _half_open_breaker(monkeypatch, name, probe_timeout=60.0):
+    """注册一个已熔断、立即进入half_open的熔断器（测试结束后自动移除）"""
+    breaker = CircuitBreaker(name, failure_threshold=1, reset_timeout=0.0, probe_timeout=probe_timeout)
+    breaker.record_failure()
+    monkeypatch.setitem(circuit_breaker._breakers, name, breaker)
+    return breaker
+
+
+def test_cancelled_async_probe_is_released(monkeypatch):
+    name = "test-cancelled-probe"
+    breaker = _half_open_breaker(monkeypatch, name)
+    delay = {"seconds": 1.0}
+
+    async def handler(request):
+        await asyncio.sleep(delay["seconds"])
+        return httpx.Response(200, json={"ok": True})
+
+    async def main():
+        service = AsyncWeatherService("user", "key", cache=WeatherCache())
+        service._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(service.safe_api_call("http://owm.test/weather", {}, name), 0.1)
+            assert breaker.stats()["state"] == "half_open"
+
+            # 被取消的探测已归还，上游恢复后下一个请求可以探测并关闭熔断器
+            delay["seconds"] = 0.0
+            response = await service.safe_api_call("http://owm.test/weather", {}, name)
+            assert response.status_code == 200
+        finally:
+            await service.aclose()
+
+    asyncio.run(main())
+    assert breaker.stats()["state"] == "closed"
+    assert breaker.stats()["rejected"] == 0
+
+
+def test_sync_probe_released_on_unexpected_error(monkeypatch):
+    name = "test-sync-probe"
+    breaker = _half_open_breaker(monkeypatch, name)
+
+    def broken_get(url, params=None, timeout=None):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(http_session, "get", broken_get)
+    service = WeatherService("user", "key", cache=WeatherCache())
+    with pytest.raises(RuntimeError):
+        service.safe_api_call("http://owm.test/weather", {}, name)
+
+    assert breaker.allow()  # 新的探测令牌
+    assert breaker.stats()["rejected"] == 0
+
+
+def test_lost_probe_expires_after_probe_timeout(monkeypatch):
+    breaker = _half_open_breaker(monkeypatch, "test-lost-probe", probe_timeout=0.05)
+    token = breaker.allow()
+    assert token
+    assert breaker.allow() is None  # 探测进行中，其余请求被拒绝
+
+    time.sleep(0.06)
+    new_token = breaker.allow()
+    assert new_token and new_token != token
+    # 过期的旧令牌不能归还新的探测
+    breaker.release(token)
+    assert breaker.allow() is None
@@ -0,0 +1,56 @@
+import numpy as np
+
+from context_packer import (
+    TokenCounter,
+    _estimate_tokens,
+    _estimate_tokens_many,
+    pack_context,
+    split_sentences,
+)
+
+
+def _orthogonal(n, dim=8):
+    return np.eye(n, dim, dtype=np.float32)
+
+
+def test_context_stays_within_budget_and_cuts_at_sentence_end():
+    counter = TokenCounter()
+    first = "上海港今日大雾。" * 10                        # 80个token
+    second = "鹿特丹港运行正常。" * 5 + "苏伊士运河通行顺畅。" * 5  # 95个token
+    texts = [first, second]
+    token_counts = counter.count_many(texts)
+    max_tokens = 150
+
+    context = pack_context(texts, token_counts, [0.9, 0.8], _orthogonal(2), max_tokens, counter)
+
+    assert counter.count(context) <= max_tokens
+    parts = context.split("\n\n")
+    assert parts[0] == f"相关段落：{first}"
+    # 第二段放不下，按整句截断并以省略号结尾
+    truncated = parts[1][len("相关段落："):-len("...")]
+    assert parts[1].endswith("...") and truncated.endswith("。")
+    assert second.startswith(truncated) and len(truncated) < len(second)
+
+
+def test_fragment_below_minimum_is_dropped():
+    counter = TokenCounter()
+    texts = ["港口" * 60, "天气" * 60]
+    context = pack_context(texts, counter.count_many(texts), [0.9, 0.8], _orthogonal(2), 140, counter)
+    # 剩余预算不足以放下一个像样的截断段落
+    assert context == f"相关段落：{texts[0]}"
+
+
+def test_near_duplicate_paragraphs_are_removed():
+    counter = TokenCounter()
+    texts = ["上海港大雾。", "上海港大雾！", "新加坡港晴。"]
+    vectors = np.array([[1, 0, 0], [0.999, 0.045, 0], [0, 1, 0]], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    context = pack_context(texts, counter.count_many(texts), [0.9, 0.89, 0.5], vectors, 1000, counter)
+    assert context.split("\n\n") == ["相关段落：上海港大雾。", "相关段落：新加坡港晴。"]
+
+
+def test_sentence_split_and_batch_estimate_are_consistent():
+    text = "Port of Rotterdam is open. 上海港大雾！“注意安全。”\n下一段"
+    assert "".join(split_sentences(text)) == text
+    texts = [text, "SOLAS-74 公约", "", "a　b"]
+    assert _estimate_tokens_many(texts).tolist() == [_estimate_tokens(t) for t in texts]
@@ -0,0 +1,16 @@
+from lexical_index import BM25Index, lexical_index_path_for, load_or_build_lexical_index
+
+
+def test_bm25_index_rebuilt_when_params_change(tmp_path):
+    texts = ["上海港 大雾 停航", "宁波港 台风 预警", "shanghai port fog"]
+    embeddings_file = str(tmp_path / "embeddings.parquet")
+
+    load_or_build_lexical_index(texts, embeddings_file)
+    path = lexical_index_path_for(embeddings_file)
+    assert BM25Index.load(path, texts) is not None
+    assert BM25Index.load(path, texts, k1=1.2) is None
+
+    index = load_or_build_lexical_index(texts, embeddings_file, k1=1.2, b=0.5)
+    assert (index.k1, index.b) == (1.2, 0.5)
+    assert BM25Index.saved_params(path) == {"k1": 1.2, "b": 0.5}
+    assert BM25Index.load(path, texts, k1=1.2, b=0.5) is not None
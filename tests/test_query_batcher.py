@@ -0,0 +1,47 @@
+import threading
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from query_batcher import BatcherClosedError, MicroBatcher
+
+
+def test_short_encode_result_fails_every_future():
+    batcher = MicroBatcher(lambda texts: [[0.0]] * (len(texts) - 1), max_wait_ms=50)
+    try:
+        futures = [batcher.submit(text) for text in ("a", "b", "c")]
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result(timeout=1)
+    finally:
+        batcher.close()
+
+
+def test_encode_times_out_and_cancels_query():
+    release = threading.Event()
+    encoded = []
+
+    def slow_encode(texts):
+        release.wait()
+        encoded.extend(texts)
+        return [[0.0]] * len(texts)
+
+    batcher = MicroBatcher(slow_encode, max_batch_size=1, max_wait_ms=0, timeout=0.05)
+    try:
+        first = batcher.submit("first")  # 占住后台线程
+        with pytest.raises(TimeoutError):
+            batcher.encode("late")
+        release.set()
+        assert first.result(timeout=1) == [0.0]
+    finally:
+        batcher.close()
+    assert encoded == ["first"]
+
+
+def test_submit_after_close_is_rejected():
+    batcher = MicroBatcher(lambda texts: [[0.0]] * len(texts))
+    future = batcher.submit("queued")
+    batcher.close()
+    assert future.result(timeout=1) == [0.0]
+    with pytest.raises(BatcherClosedError):
+        batcher.submit("late")
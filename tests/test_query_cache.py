@@ -0,0 +1,18 @@
+import numpy as np
+
+from query_cache import QueryEmbeddingCache
+
+
+def test_persisted_vectors_discarded_when_encoder_changes(tmp_path):
+    path = str(tmp_path / "query_cache.npz")
+    cache = QueryEmbeddingCache(persist_path=path, fingerprint="model-a")
+    cache.put("上海到鹿特丹？", np.ones(4, dtype=np.float32))
+    cache.save()
+
+    same = QueryEmbeddingCache(persist_path=path, fingerprint="model-a")
+    assert same.get("上海到鹿特丹") is not None
+
+    # 换模型或编码后端后不返回旧模型的向量
+    changed = QueryEmbeddingCache(persist_path=path, fingerprint="model-b")
+    assert len(changed) == 0
+    assert changed.get("上海到鹿特丹") is None
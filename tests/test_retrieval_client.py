@@ -0,0 +1,57 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from retrieval_client import RetrievalClient, RetrievalServiceError
+
+
+@pytest.fixture
+def sidecar():
+    """返回固定JSON响应的检索服务，响应内容由测试设置"""
+    state = {"body": {}}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            data = json.dumps(state["body"]).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", state
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("body", [
+    {"prompt": "缺少查询向量"},
+    {"query_vec": None, "prompt": "p"},
+    {"query_vec": [0.1, 0.2]},
+    ["不是JSON对象"],
+])
+def test_malformed_response_raises_service_error(sidecar, body):
+    url, state = sidecar
+    state["body"] = body
+    with pytest.raises(RetrievalServiceError):
+        RetrievalClient(url).generate_prompt_with_version("上海到鹿特丹")
+
+
+def test_prompt_response_parsed(sidecar):
+    url, state = sidecar
+    state["body"] = {"query_vec": [0.1, 0.2], "prompt": "p", "kb_version": 3.0}
+    query_vec, prompt, version = RetrievalClient(url).generate_prompt_with_version("上海到鹿特丹")
+    assert query_vec.tolist() == pytest.approx([0.1, 0.2]) and prompt == "p" and version == 3.0
+
+
+@pytest.mark.parametrize("url", ["tcp://127.0.0.1:8600", "http://127.0.0.1:notaport"])
+def test_invalid_url_raises_service_error(url):
+    with pytest.raises(RetrievalServiceError):
+        RetrievalClient(url)
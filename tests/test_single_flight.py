@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+
+from single_flight import AsyncSingleFlight, SingleFlight
+
+
+def test_async_waiters_share_result():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "晴"
+
+    async def main():
+        return await asyncio.gather(*(flight.do("shanghai", fetch) for _ in range(10)))
+
+    assert asyncio.run(main()) == ["晴"] * 10
+    assert len(calls) == 1
+    assert flight.stats()["shared"] == 9
+
+
+def test_async_leader_cancellation_does_not_cancel_waiters():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return len(calls)
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do("rotterdam", fetch))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.ensure_future(flight.do("rotterdam", fetch)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(*waiters)
+        assert leader.cancelled()
+        return results
+
+    # 一个等待者接手重新调用，其余等待者共享它的结果
+    assert asyncio.run(main()) == [2, 2, 2]
+    assert len(calls) == 2
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_thread_waiters_share_exception():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def fetch():
+        started.set()
+        release.wait()
+        raise ValueError("upstream down")
+
+    def call():
+        try:
+            flight.do("oslo", fetch)
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    started.wait()
+    threads += [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads[1:]:
+        thread.start()
+    while flight.stats()["shared"] < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert errors == ["upstream down"] * 4
+    assert flight.stats()["leaders"] == 1
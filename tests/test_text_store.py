@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+
+from text_store import build_text_store, open_text_store, text_store_paths_for
+
+TEXTS = ["上海港大雾", "", "Port of Rotterdam", "苏伊士运河🚢"]
+
+
+def _embeddings_file(tmp_path):
+    path = tmp_path / "embeddings.parquet"
+    path.write_bytes(b"")
+    return str(path)
+
+
+def _age(path, seconds):
+    mtime = os.path.getmtime(path) - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_built_store_is_reopened_memory_mapped(tmp_path):
+    embeddings_file = _embeddings_file(tmp_path)
+    _age(embeddings_file, 10)
+    built = build_text_store(embeddings_file, pa.chunked_array([TEXTS[:2], TEXTS[2:]]))
+    assert list(built) == TEXTS
+
+    store = open_text_store(embeddings_file, n_rows=len(TEXTS))
+    assert isinstance(store.data, np.memmap)
+    assert store.get_many([3, 0]) == [TEXTS[3], TEXTS[0]]
+
+
+def test_stale_or_mismatched_offsets_are_not_opened(tmp_path):
+    embeddings_file = _embeddings_file(tmp_path)
+    _age(embeddings_file, 10)
+    build_text_store(embeddings_file, TEXTS)
+    data_path, offsets_path = text_store_paths_for(embeddings_file)
+
+    # 行数与知识库不一致
+    assert open_text_store(embeddings_file, n_rows=len(TEXTS) + 1) is None
+
+    # 偏移量文件旧于嵌入文件（知识库已更新）
+    _age(offsets_path, 20)
+    assert open_text_store(embeddings_file) is None
+
+    # 偏移量与文本文件大小不一致
+    build_text_store(embeddings_file, TEXTS)
+    with open(data_path, "ab") as f:
+        f.write(b"x")
+    assert open_text_store(embeddings_file) is None
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from vector_index import (
+    IVFIndex,
+    QuantizedMatrix,
+    index_path_for,
+    load_or_build_index,
+    normalize_rows,
+    normalize_vector,
+)
+
+
+@pytest.mark.parametrize("quantization", QuantizedMatrix.QUANTIZATION_TYPES)
+def test_quantized_scan_matches_dequantized_matrix(quantization):
+    rng = np.random.default_rng(0)
+    matrix = normalize_rows(rng.standard_normal((1300, 32)))
+    query = normalize_vector(rng.standard_normal(32))
+    quantized = QuantizedMatrix.from_matrix(matrix, quantization)
+
+    # 块大小不整除行数，覆盖最后一个不满的块
+    scores = quantized @ query
+    np.testing.assert_allclose(scores, quantized[:] @ query, atol=1e-6)
+    np.testing.assert_allclose(scores, matrix @ query, atol=2e-2)
+
+
+def test_ivf_index_rebuilt_when_nlist_changes(tmp_path):
+    rng = np.random.default_rng(0)
+    matrix = normalize_rows(rng.standard_normal((400, 16)))
+    embeddings_file = str(tmp_path / "embeddings.parquet")
+
+    load_or_build_index(matrix, "ivf", embeddings_file, nlist=8)
+    path = index_path_for(embeddings_file, "ivf")
+    assert IVFIndex.saved_params(path) == {"nlist": 8}
+    assert IVFIndex.load(path, matrix, nlist=8).nlist == 8
+    assert IVFIndex.load(path, matrix, nlist=16) is None
+
+    index = load_or_build_index(matrix, "ivf", embeddings_file, nlist=16)
+    assert index.centroids.shape[0] == 16
+    assert IVFIndex.saved_params(path) == {"nlist": 16}
+
+
+def test_quantized_and_float32_ivf_indexes_use_separate_files(tmp_path):
+    rng = np.random.default_rng(1)
+    matrix = normalize_rows(rng.standard_normal((300, 16)))
+    quantized = QuantizedMatrix.from_matrix(matrix, "int8")
+    embeddings_file = str(tmp_path / "embeddings.parquet")
+
+    load_or_build_index(matrix, "ivf", embeddings_file, nlist=8)
+    load_or_build_index(quantized, "ivf", embeddings_file, nlist=8)
+    float32_path = index_path_for(embeddings_file, "ivf")
+    int8_path = index_path_for(embeddings_file, "ivf", "int8")
+    assert float32_path != int8_path
+
+    # 切换量化方式后两个索引都仍然有效，无需重建
+    assert IVFIndex.load(float32_path, matrix, nlist=8) is not None
+    assert IVFIndex.load(int8_path, quantized, nlist=8) is not None
+
+
+@pytest.mark.parametrize("params", [{"nlist": 1000}, {"nlist": 0}, {"nprobe": 0}, {"nlsit": 8}])
+def test_invalid_ivf_params_raise(tmp_path, params):
+    matrix = normalize_rows(np.random.default_rng(2).standard_normal((100, 8)))
+    with pytest.raises((ValueError, TypeError)):
+        load_or_build_index(matrix, "ivf", str(tmp_path / "embeddings.parquet"), **params)
+
+
+def test_corrupt_index_file_is_rebuilt(tmp_path):
+    matrix = normalize_rows(np.random.default_rng(3).standard_normal((100, 8)))
+    embeddings_file = str(tmp_path / "embeddings.parquet")
+    with open(index_path_for(embeddings_file, "ivf"), "wb") as f:
+        f.write(b"not an npz")
+    index = load_or_build_index(matrix, "ivf", embeddings_file, nlist=4)
+    assert isinstance(index, IVFIndex) and index.nlist == 4
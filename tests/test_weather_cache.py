@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+
+from weather_cache import WeatherCache
+
+
+def test_stale_value_served_while_single_refresh_runs():
+    cache = WeatherCache(ttl=0.05, stale_ttl=60)
+    cache.put("上海", "旧天气")
+    time.sleep(0.06)
+
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(1)
+        return "新天气"
+
+    # 过期后立即返回旧值，刷新在后台进行；刷新期间的读取不再启动新的刷新
+    assert cache.get_or_fetch("上海", fetch) == "旧天气"
+    assert started.wait(1)
+    assert [cache.get_or_fetch("上海", fetch) for _ in range(5)] == ["旧天气"] * 5
+    release.set()
+
+    deadline = time.monotonic() + 1
+    while cache.peek("上海") != ("新天气", True) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.peek("上海") == ("新天气", True)
+    assert len(calls) == 1
+    assert cache.stats()["stale_hits"] == 6
+
+
+def test_failed_refresh_keeps_stale_value():
+    cache = WeatherCache(ttl=0.05, stale_ttl=60)
+    cache.put("鹿特丹", "旧天气")
+    time.sleep(0.06)
+
+    def fetch():
+        raise RuntimeError("上游不可用")
+
+    assert cache.get_or_fetch("鹿特丹", fetch) == "旧天气"
+    deadline = time.monotonic() + 1
+    while cache.stats()["refresh_errors"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.stats()["refresh_errors"] == 1
+    assert cache.peek("鹿特丹") == ("旧天气", False)
+
+
+def test_concurrent_misses_fetch_once():
+    cache = WeatherCache()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.05)
+        return "晴"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_fetch("新加坡", fetch)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["晴"] * 8
+    assert len(calls) == 1
+
+
+def test_async_stale_value_served_while_refresh_task_runs():
+    cache = WeatherCache(ttl=0.05, stale_ttl=60)
+    cache.put("釜山", "旧天气")
+    time.sleep(0.06)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "新天气"
+
+    async def main():
+        first = await cache.aget_or_fetch("釜山", fetch)
+        second = await cache.aget_or_fetch("釜山", fetch)
+        await asyncio.gather(*cache._tasks)
+        return first, second
+
+    assert asyncio.run(main()) == ("旧天气", "旧天气")
+    assert cache.peek("釜山") == ("新天气", True)
+    assert len(calls) == 1
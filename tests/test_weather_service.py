@@ -0,0 +1,66 @@
+import threading
+
+import http_session
+import weather_service
+from weather_cache import WeatherCache
+from weather_service import OWM_GROUP_URL, WeatherService
+
+
+class _Response:
+    def __init__(self, data, status_code=200):
+        self._data = data
+        self.status_code = status_code
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        pass
+
+
+def _fake_owm(calls):
+    """按查询参数返回天气的假OpenWeatherMap接口，记录每次请求的URL"""
+    def get(url, params=None, timeout=None):
+        calls.append(url)
+        if url == OWM_GROUP_URL:
+            ids = [int(city_id) for city_id in params["id"].split(",")]
+            return _Response({"list": [
+                {"id": city_id, "name": f"city{city_id}", "main": {"temp": 10}, "weather": [{"description": "晴"}]}
+                for city_id in ids
+            ]})
+        return _Response({"cod": 200, "id": 101, "name": params.get("q", "city101"),
+                          "main": {"temp": 20}, "weather": [{"description": "多云"}]})
+    return get
+
+
+def test_locations_sharing_a_city_id_all_get_weather(monkeypatch):
+    calls = []
+    monkeypatch.setattr(http_session, "get", _fake_owm(calls))
+    service = WeatherService("user", "key", cache=WeatherCache())
+    service.get_weather(location="Shanghai")  # 记下 Shanghai 的城市id 101
+    service.cache.clear()
+    calls.clear()
+
+    weather = service.get_weather_many(["Shanghai", 101])
+    assert weather["Shanghai"] is not None and weather[101] is not None
+    assert calls == [OWM_GROUP_URL]
+
+
+def test_get_weather_many_uses_shared_pool_and_deadline(monkeypatch):
+    release = threading.Event()
+    fake = _fake_owm([])
+
+    def slow_get(url, params=None, timeout=None):
+        release.wait(1)
+        return fake(url, params, timeout)
+
+    monkeypatch.setattr(http_session, "get", slow_get)
+    service = WeatherService("user", "key", cache=WeatherCache())
+    executor = weather_service.get_weather_executor()
+    try:
+        # 超过时限仍未完成的地点不在结果中
+        assert service.get_weather_many(["Busan", "Kobe"], timeout=0.05) == {}
+    finally:
+        release.set()
+    assert weather_service.get_weather_executor() is executor
+    assert executor._max_workers == weather_service.WEATHER_WORKERS
@@ -0,0 +1,113 @@
+# text_store.py
+import os
+import numpy as np
+
+
+class TextStore:
+    """
+    按行号读取段落文本的字符串表
+
+    所有文本以UTF-8拼接存放在 .bin 文件中，另存一份偏移量数组（n+1个int64），
+    两者均以内存映射方式打开：常驻内存与段落数量无关，检索完成后只解码选中的几行。
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_texts(cls, texts):
+        """在内存中构建（不落盘）"""
+        encoded = [str(text).encode("utf-8") for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    @classmethod
+    def from_arrow(cls, array):
+        """直接复用Arrow字符串列的偏移量与数据缓冲区（不逐行创建Python字符串）"""
+        import pyarrow as pa
+
+        if isinstance(array, pa.ChunkedArray):
+            array = array.combine_chunks()
+        array = array.cast(pa.large_string())
+        _, offsets_buffer, data_buffer = array.buffers()
+        offsets = np.frombuffer(offsets_buffer, dtype=np.int64)[array.offset:array.offset + len(array) + 1]
+        data = np.frombuffer(data_buffer, dtype=np.uint8) if data_buffer is not None else np.empty(0, dtype=np.uint8)
+        data = data[offsets[0]:offsets[-1]] if len(offsets) else data[:0]
+        offsets = offsets - offsets[0] if len(offsets) else np.zeros(1, dtype=np.int64)
+        return cls(data, offsets)
+
+    def save(self, data_path, offsets_path):
+        """原子写入文本与偏移量文件（临时文件名带进程号，多个worker同时重建时互不影响）"""
+        suffix = f".{os.getpid()}.tmp"
+        with open(data_path + suffix, "wb") as f:
+            f.write(self.data.tobytes())
+        np.save(offsets_path + suffix + ".npy", self.offsets)
+        os.replace(data_path + suffix, data_path)
+        os.replace(offsets_path + suffix + ".npy", offsets_path)
+
+    @classmethod
+    def open(cls, data_path, offsets_path):
+        """以内存映射方式打开"""
+        offsets = np.load(offsets_path, mmap_mode="r")
+        size = int(offsets[-1])
+        if os.path.getsize(data_path) != size:
+            raise ValueError(f"文本表与偏移量不一致: {data_path}")
+        # 空文件无法映射
+        data = np.memmap(data_path, dtype=np.uint8, mode="r") if size else np.empty(0, dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __getitem__(self, row):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    def get_many(self, rows):
+        """按行号批量读取文本"""
+        return [self[int(row)] for row in rows]
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+
+def text_store_paths_for(embeddings_file):
+    """文本表与嵌入文件放在同一目录，例如 embeddings.text.bin / embeddings.text.idx.npy"""
+    base = os.path.splitext(embeddings_file)[0]
+    return f"{base}.text.bin", f"{base}.text.idx.npy"
+
+
+def open_text_store(embeddings_file, n_rows=None):
+    """打开已存在且不旧于嵌入文件、行数一致的文本表，否则返回None"""
+    data_path, offsets_path = text_store_paths_for(embeddings_file)
+    try:
+        source_mtime = os.path.getmtime(embeddings_file)
+        if (not os.path.exists(data_path) or not os.path.exists(offsets_path)
+                or os.path.getmtime(data_path) < source_mtime
+                or os.path.getmtime(offsets_path) < source_mtime):
+            return None
+        store = TextStore.open(data_path, offsets_path)
+    except (OSError, ValueError):
+        return None
+    if n_rows is not None and len(store) != n_rows:
+        return None
+    return store
+
+
+def build_text_store(embeddings_file, texts):
+    """构建文本表（texts为文本序列或Arrow字符串列）并写入磁盘后以内存映射方式打开；写入失败时保留在内存中"""
+    if hasattr(texts, "buffers") or hasattr(texts, "combine_chunks"):
+        store = TextStore.from_arrow(texts)
+    else:
+        store = TextStore.from_texts(texts)
+    data_path, offsets_path = text_store_paths_for(embeddings_file)
+    try:
+        store.save(data_path, offsets_path)
+        return TextStore.open(data_path, offsets_path)
+    except (OSError, ValueError) as e:
+        print(f"文本表保存失败，保留在内存中: {str(e)}")
+        return store
@@ -0,0 +1,378 @@
+# vector_index.py
+import os
+import zipfile
+import zlib
+import numpy as np
+
+
+def normalize_rows(matrix):
+    """将矩阵转换为连续、逐行L2归一化的float32矩阵"""
+    matrix = np.array(matrix, dtype=np.float32, order='C', copy=True)
+    if matrix.ndim != 2:
+        raise ValueError(f"嵌入矩阵必须是二维的，当前维度：{matrix.ndim}")
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def normalize_vector(vec):
+    """将查询向量转换为L2归一化的float32向量"""
+    vec = np.asarray(vec, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+def top_k(scores, k):
+    """argpartition选取前k个下标，并按得分降序排列"""
+    k = min(k, scores.size)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.size:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def matrix_fingerprint(matrix):
+    """计算嵌入矩阵指纹，用于判断磁盘索引是否与当前知识库一致"""
+    data = matrix.codes if isinstance(matrix, QuantizedMatrix) else matrix
+    return int(zlib.crc32(np.ascontiguousarray(data).view(np.uint8)))
+
+
+class QuantizedMatrix:
+    """
+    int8量化存储的嵌入矩阵（逐行缩放系数），内存约为float32的1/4
+
+    支持与numpy矩阵相同的 `matrix @ vec` 与 `matrix[rows]` 用法，可直接交给
+    ExactIndex / IVFIndex 扫描。点积按块转换到float32缓冲区后计算，临时内存与块大小成正比；
+    缩放系数在点积之后逐行相乘，整矩阵扫描与float32基本持平。
+    （float16在numpy中转换为float32没有向量化实现，扫描慢数倍，因此不提供。）
+    """
+
+    QUANTIZATION_TYPES = ("int8",)
+    quantization = "int8"
+
+    def __init__(self, codes, scales, block_size=512):
+        self.codes = codes
+        self.scales = scales
+        self.block_size = block_size
+
+    @classmethod
+    def from_matrix(cls, matrix, quantization="int8"):
+        """将float32矩阵量化为指定类型"""
+        if quantization not in cls.QUANTIZATION_TYPES:
+            raise ValueError(
+                f"不支持的量化类型: {quantization}，可选：{', '.join(cls.QUANTIZATION_TYPES)}"
+            )
+        scales = np.abs(matrix).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+        return cls(codes, scales.astype(np.float32))
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def __matmul__(self, vec):
+        n = self.codes.shape[0]
+        scores = np.empty(n, dtype=np.float32)
+        # 每次调用各自分配转换缓冲区，多线程并发检索互不干扰
+        buffer = np.empty((min(self.block_size, n), self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, n, self.block_size):
+            codes = self.codes[start:start + self.block_size]
+            block = buffer[:codes.shape[0]]
+            block[...] = codes
+            np.matmul(block, vec, out=scores[start:start + codes.shape[0]])
+        # (codes·s) @ vec == s·(codes @ vec)，省去对整块乘缩放系数
+        scores *= self.scales
+        return scores
+
+    def __getitem__(self, rows):
+        block = self.codes[rows].astype(np.float32)
+        block *= self.scales[rows][..., None]
+        return block
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+
+def full_precision_path_for(embeddings_file):
+    """全精度矩阵与嵌入文件放在同一目录，例如 embeddings.f32.npy"""
+    return f"{os.path.splitext(embeddings_file)[0]}.f32.npy"
+
+
+def open_mapped_matrix(embeddings_file, n_rows=None):
+    """
+    以内存映射方式打开已存在且不旧于嵌入文件的 .f32.npy 矩阵，否则返回None
+
+    多个进程映射同一文件时共享操作系统页缓存，矩阵只占一份物理内存。
+    """
+    path = full_precision_path_for(embeddings_file)
+    try:
+        if (not os.path.exists(path)
+                or os.path.getmtime(path) < os.path.getmtime(embeddings_file)):
+            return None
+        mapped = np.load(path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if mapped.dtype != np.float32 or mapped.ndim != 2:
+        return None
+    if n_rows is not None and mapped.shape[0] != n_rows:
+        return None
+    return mapped
+
+
+def load_full_precision_matrix(matrix, embeddings_file):
+    """
+    将全精度矩阵写入 .npy 并以内存映射方式打开
+
+    常驻内存中只保留量化矩阵，重排序时只会读入少量候选行。
+    文件已存在且不旧于嵌入文件、形状一致时直接复用。
+    """
+    path = full_precision_path_for(embeddings_file)
+    try:
+        if (os.path.exists(path)
+                and os.path.getmtime(path) >= os.path.getmtime(embeddings_file)):
+            mapped = np.load(path, mmap_mode='r')
+            if mapped.shape == matrix.shape and mapped.dtype == np.float32:
+                return mapped
+        tmp_path = f"{path}.{os.getpid()}.tmp.npy"  # 多个worker同时重建时互不覆盖
+        np.save(tmp_path, matrix)
+        os.replace(tmp_path, path)
+        return np.load(path, mmap_mode='r')
+    except OSError as e:
+        print(f"全精度矩阵映射失败，保留在内存中: {str(e)}")
+        return matrix
+
+
+def rescore(full_matrix, candidates, query_vec, k):
+    """用全精度向量对候选重新打分，返回前k个(下标, 相似度)"""
+    if candidates.size == 0:
+        return candidates, np.empty(0, dtype=np.float32)
+    candidates = np.sort(candidates)  # 按行号顺序读取，内存映射访问更连续
+    scores = np.asarray(full_matrix[candidates], dtype=np.float32) @ query_vec
+    best = top_k(scores, k)
+    return candidates[best], scores[best]
+
+
+class ExactIndex:
+    """精确检索（暴力扫描），同时作为所有近似索引的兜底实现"""
+
+    index_type = "exact"
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def search(self, query_vec, k):
+        """
+        返回与查询向量最相似的k个段落
+
+        参数：
+        query_vec: 已归一化的查询向量
+        k: 返回数量
+
+        返回：
+        (下标数组, 相似度数组)，按相似度降序
+        """
+        scores = self.matrix @ query_vec
+        indices = top_k(scores, k)
+        return indices, scores[indices]
+
+    def save(self, path):
+        """精确检索无需持久化"""
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+
+class IVFIndex(ExactIndex):
+    """
+    倒排文件（IVF）近似最近邻索引
+
+    使用球面k-means将向量划分为nlist个簇，查询时只扫描与查询最接近的
+    nprobe个簇。nprobe越大召回越高、延迟越大；nprobe>=nlist时等价于精确检索。
+    """
+
+    index_type = "ivf"
+
+    def __init__(self, matrix, nlist=None, nprobe=8, train_iters=10,
+                 max_train_points=None, seed=0):
+        super().__init__(matrix)
+        n = matrix.shape[0]
+        if nlist is None:
+            nlist = max(1, min(int(np.sqrt(n)), n))
+        elif not 1 <= nlist <= n:
+            raise ValueError(f"nlist 必须在 1 到段落数 {n} 之间，当前为 {nlist}")
+        if nprobe < 1:
+            raise ValueError(f"nprobe 必须为正整数，当前为 {nprobe}")
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iters = train_iters
+        self.max_train_points = max_train_points or self.nlist * 256
+        if self.max_train_points < self.nlist:
+            raise ValueError(f"max_train_points（{self.max_train_points}）不能小于 nlist（{self.nlist}）")
+        self.seed = seed
+        self.fingerprint = None
+        self.centroids = None
+        self.list_offsets = None
+        self.list_ids = None
+
+    def train(self):
+        """训练聚类中心并构建倒排表"""
+        rng = np.random.default_rng(self.seed)
+        n = self.matrix.shape[0]
+        if n > self.max_train_points:
+            sample = self.matrix[rng.choice(n, self.max_train_points, replace=False)]
+        else:
+            sample = self.matrix[:]  # 量化矩阵在此反量化为float32
+
+        centroids = sample[rng.choice(sample.shape[0], self.nlist, replace=False)].copy()
+        for _ in range(self.train_iters):
+            assign = self._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = np.bincount(assign, minlength=self.nlist) == 0
+            # 空簇重新随机初始化，避免倒排表退化
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()))]
+            centroids = normalize_rows(sums)
+
+        self._set_lists(centroids, self._assign(self.matrix, centroids))
+        return self
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk_size=65536):
+        """分块计算每个向量所属的最近簇，控制临时内存"""
+        assign = np.empty(vectors.shape[0], dtype=np.int32)
+        for start in range(0, vectors.shape[0], chunk_size):
+            block = vectors[start:start + chunk_size]
+            assign[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+        return assign
+
+    def _set_lists(self, centroids, assign):
+        """按簇号排序得到紧凑的倒排表（下标数组 + 偏移量）"""
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.list_ids = np.argsort(assign, kind='stable').astype(np.int64)
+        counts = np.bincount(assign, minlength=self.nlist)
+        self.list_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+    def search(self, query_vec, k):
+        nprobe = min(max(1, self.nprobe), self.nlist)
+        if nprobe >= self.nlist:
+            return super().search(query_vec, k)
+
+        probe = top_k(self.centroids @ query_vec, nprobe)
+        candidates = np.concatenate([
+            self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe
+        ])
+        # 候选不足k个时退回精确检索，保证返回数量与精确检索一致
+        if candidates.size < k:
+            return super().search(query_vec, k)
+
+        scores = self.matrix[candidates] @ query_vec
+        order = top_k(scores, k)
+        return candidates[order], scores[order]
+
+    def save(self, path):
+        """将聚类中心与倒排表保存为npz文件"""
+        if self.fingerprint is None:
+            self.fingerprint = matrix_fingerprint(self.matrix)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            centroids=self.centroids,
+            list_ids=self.list_ids,
+            list_offsets=self.list_offsets,
+            fingerprint=np.int64(self.fingerprint),
+            n_rows=np.int64(self.matrix.shape[0]),
+            nlist=np.int64(self.nlist),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, matrix, nlist=None, nprobe=8):
+        """从npz文件加载索引；与当前矩阵或nlist参数不一致时返回None"""
+        expected_nlist = cls(matrix, nlist=nlist).nlist
+        with np.load(path) as data:
+            fingerprint = int(data['fingerprint'])
+            if (int(data['n_rows']) != matrix.shape[0]
+                    or int(data['nlist']) != expected_nlist
+                    or fingerprint != matrix_fingerprint(matrix)):
+                return None
+            index = cls(matrix, nlist=expected_nlist, nprobe=nprobe)
+            index.fingerprint = fingerprint
+            index.centroids = data['centroids']
+            index.list_ids = data['list_ids']
+            index.list_offsets = data['list_offsets']
+        return index
+
+    @classmethod
+    def saved_params(cls, path):
+        """读取索引文件的构建参数，用于按原参数重建；文件无法读取时返回空字典"""
+        try:
+            with np.load(path) as data:
+                return {'nlist': int(data['nlist'])}
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return {}
+
+
+INDEX_TYPES = {
+    "exact": ExactIndex,
+    "ivf": IVFIndex,
+}
+
+
+def index_path_for(embeddings_file, index_type, quantization=None):
+    """
+    索引文件与嵌入文件放在同一目录，例如 embeddings.ivf.npz；
+    基于量化矩阵的索引单独存放（如 embeddings.ivf-int8.npz），切换量化方式时不会互相覆盖
+    """
+    suffix = f"-{quantization}" if quantization else ""
+    return f"{os.path.splitext(embeddings_file)[0]}.{index_type}{suffix}.npz"
+
+
+def load_or_build_index(matrix, index_type="exact", embeddings_file=None, **params):
+    """
+    加载磁盘上的索引，不存在或已过期时重新构建并保存
+
+    参数：
+    matrix: 归一化后的嵌入矩阵
+    index_type: 索引类型（exact / ivf）
+    embeddings_file: 嵌入文件路径，用于确定索引文件位置；为None时不持久化
+    params: 索引参数（如 nlist、nprobe），无效时抛出 ValueError / TypeError；
+            只有索引文件读写失败时才重新构建或不持久化
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支持的索引类型: {index_type}，可选：{', '.join(INDEX_TYPES)}")
+    # 空知识库没有可聚类的向量
+    if index_type == "exact" or matrix.shape[0] == 0:
+        return ExactIndex(matrix)
+
+    index_cls = INDEX_TYPES[index_type]
+    index = index_cls(matrix, **params)  # 先校验参数
+    quantization = getattr(matrix, "quantization", None)
+    path = index_path_for(embeddings_file, index_type, quantization) if embeddings_file else None
+
+    if path and os.path.exists(path):
+        try:
+            loaded = index_cls.load(path, matrix, nlist=index.nlist, nprobe=index.nprobe)
+            if loaded is not None:
+                return loaded
+            print(f"索引文件已过期，重新构建: {path}")
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            print(f"索引文件加载失败，重新构建: {str(e)}")
+
+    index.train()
+
+    if path:
+        try:
+            index.save(path)
+        except OSError as e:
+            print(f"索引文件保存失败: {str(e)}")
+    return index
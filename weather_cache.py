@@ -0,0 +1,224 @@
+# weather_cache.py
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from single_flight import AsyncSingleFlight, SingleFlight
+
+
+class WeatherCache:
+    """
+    天气与地理编码结果的进程内TTL缓存（过期后先返回旧值再后台刷新）
+
+    条目在 ttl 秒内直接返回；过期后 stale_ttl 秒内仍返回旧值，同时在后台线程（协程版本为事件循环任务）中刷新，
+    同一个键同时只有一次刷新；超过 ttl + stale_ttl 的条目视为不存在，由调用线程同步获取。
+    获取失败（抛出异常或返回None）不写入缓存，后台刷新失败时保留旧值。
+    缓存未命中时，同一个键的并发获取合并为一次（single-flight），其余调用等待并共享结果。
+    """
+
+    def __init__(self, ttl=600, stale_ttl=1800, max_entries=1024):
+        """
+        参数：
+        ttl: 天气数据的新鲜期（秒），OpenWeatherMap观测数据约10分钟更新一次
+        stale_ttl: 新鲜期之后仍可返回旧值（并后台刷新）的时长（秒）
+        max_entries: 最大条目数，超出后淘汰最久未使用的条目
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, fresh_until, stale_until)
+        self._refreshing = set()
+        self._tasks = set()
+        self._flight = SingleFlight()
+        self._async_flight = AsyncSingleFlight()
+
+    def _lookup(self, key):
+        """
+        查找条目并更新统计
+
+        返回：
+        (state, value)，state 为 "fresh"、"stale"（需由调用方启动后台刷新）、
+        "refreshing"（旧值，已有刷新在进行）或 "miss"
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now >= entry[2]:
+                self.misses += 1
+                return "miss", None
+            self._entries.move_to_end(key)
+            value, fresh_until, _ = entry
+            if now < fresh_until:
+                self.hits += 1
+                return "fresh", value
+            self.stale_hits += 1
+            if key in self._refreshing:
+                return "refreshing", value
+            self._refreshing.add(key)
+            return "stale", value
+
+    def get_or_fetch(self, key, fetch, ttl=None):
+        """
+        返回key对应的缓存值，缺失或完全过期时调用fetch()同步获取
+
+        参数：
+        key: 缓存键（见 weather_key / geodata_key）
+        fetch: 无参函数，返回要缓存的值；抛出的异常原样传给调用方
+        ttl: 该条目的新鲜期，默认使用 self.ttl（地理编码等几乎不变的数据可设得更长）
+        """
+        state, value = self._lookup(key)
+        if state == "miss":
+            value = self._flight.do(key, lambda: self._fetch_and_put(key, fetch, ttl))
+        elif state == "stale":
+            threading.Thread(
+                target=self._refresh, args=(key, fetch, ttl), name="weather-cache-refresh", daemon=True
+            ).start()
+        return value
+
+    async def aget_or_fetch(self, key, fetch, ttl=None):
+        """get_or_fetch 的协程版本：fetch为无参协程函数，后台刷新作为当前事件循环中的任务运行"""
+        state, value = self._lookup(key)
+        if state == "miss":
+            value = await self._async_flight.do(key, lambda: self._afetch_and_put(key, fetch, ttl))
+        elif state == "stale":
+            task = asyncio.ensure_future(self._arefresh(key, fetch, ttl))
+            # 事件循环只持有任务的弱引用，完成前由缓存保存
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return value
+
+    def _fetch_and_put(self, key, fetch, ttl):
+        value = fetch()
+        self.put(key, value, ttl)
+        return value
+
+    async def _afetch_and_put(self, key, fetch, ttl):
+        value = await fetch()
+        self.put(key, value, ttl)
+        return value
+
+    def _refresh(self, key, fetch, ttl):
+        try:
+            self.put(key, fetch(), ttl)
+        except Exception as e:
+            self._refresh_failed(e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    async def _arefresh(self, key, fetch, ttl):
+        try:
+            self.put(key, await fetch(), ttl)
+        except Exception as e:
+            self._refresh_failed(e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _refresh_failed(self, error):
+        with self._lock:
+            self.refresh_errors += 1
+        print(f"⚠️ 天气缓存后台刷新失败（继续使用旧值）: {str(error)}")
+
+    def peek(self, key):
+        """
+        只读查找（不触发刷新），用于批量查询时先筛出仍新鲜的条目
+
+        返回：
+        (value, fresh)，缺失或完全过期时为 (None, False)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now >= entry[2]:
+                return None, False
+            fresh = now < entry[1]
+            if fresh:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return entry[0], fresh
+
+    def put(self, key, value, ttl=None):
+        """写入缓存；value为None时不写入"""
+        if value is None or self.max_entries <= 0:
+            return
+        fresh_until = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, fresh_until, fresh_until + self.stale_ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """命中统计"""
+        with self._lock:
+            total = self.hits + self.stale_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "refresh_errors": self.refresh_errors,
+                # 未命中时与进行中的相同请求合并的次数
+                "coalesced": self._flight.shared + self._async_flight.shared,
+                "hit_rate": (self.hits + self.stale_hits) / total if total else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# 经纬度保留两位小数（约1公里），同一港口附近的查询共用一个条目
+COORD_PRECISION = 2
+
+
+def normalize_place(name):
+    """规范化地名（去除多余空白、忽略大小写）"""
+    return " ".join(str(name).split()).lower()
+
+
+def weather_key(location=None, lat=None, lon=None, city_id=None, **params):
+    """
+    天气缓存键：经纬度优先（四舍五入），其次为OpenWeatherMap城市id，否则使用规范化的地名；
+    params为影响返回内容的查询参数（如语言）
+    """
+    if lat is not None and lon is not None:
+        place = ("coord", round(float(lat), COORD_PRECISION), round(float(lon), COORD_PRECISION))
+    elif city_id is not None:
+        place = ("id", int(city_id))
+    elif location:
+        place = ("name", normalize_place(location))
+    else:
+        raise ValueError("必须提供位置参数")
+    return ("weather",) + place + tuple(sorted(params.items()))
+
+
+def geodata_key(place_name):
+    """地理编码缓存键"""
+    return ("geodata", normalize_place(place_name))
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_weather_cache():
+    """进程内共享的天气缓存（WeatherService 与 app.get_real_time_weather 共用）"""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                _shared_cache = WeatherCache(
+                    ttl=float(os.getenv("WEATHER_CACHE_TTL", "600")),
+                    stale_ttl=float(os.getenv("WEATHER_CACHE_STALE_TTL", "1800")),
+                    max_entries=int(os.getenv("WEATHER_CACHE_SIZE", "1024"))
+                )
+    return _shared_cache
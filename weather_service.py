@@ -1,42 +1,65 @@
 # weather_service.py
+import asyncio
+import os
 import requests
+import threading
 import time
+import http_session
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed, wait
 from datetime import datetime
 from pprint import pformat
+from circuit_breaker import default_retry_policy, get_breaker, is_retryable_status
+from weather_cache import geodata_key, get_weather_cache, normalize_place, weather_key
 
-class WeatherService:
-    def __init__(self, geonames_user, owm_api_key):
+GEONAMES_URL = "http://api.geonames.org/searchJSON"
+OWM_WEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+# 多城市批量查询接口，每次最多20个城市id
+OWM_GROUP_URL = "https://api.openweathermap.org/data/2.5/group"
+GROUP_MAX_IDS = 20
+# 进程内共享的天气查询线程数：所有批量查询共用，并发的航线分析请求不会成倍增加线程
+WEATHER_WORKERS = int(os.getenv("WEATHER_WORKERS", "8"))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_weather_executor():
+    """进程内共享、有界的天气查询线程池；fork后在子进程中重建（线程不会随fork复制）"""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(max_workers=WEATHER_WORKERS, thread_name_prefix="weather")
+                _executor_pid = pid
+    return _executor
+
+
+def _remaining(deadline):
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+class _WeatherServiceBase:
+    """同步与异步天气服务共用的配置、查询参数与结果解析"""
+
+    def __init__(self, geonames_user, owm_api_key, cache=None, units="metric", lang="zh_cn"):
         self.GEONAMES_USER = geonames_user
         self.OWM_API_KEY = owm_api_key
-        self.TIMEOUT = (10, 15)
-        self.MAX_RETRIES = 3
-        self.REQUEST_DELAY = 2
-
-    def safe_api_call(self, url, params, service_name):
-        """增强版安全API请求"""
-        for attempt in range(self.MAX_RETRIES + 1):
-            try:
-                print(f"\n🔧 [{service_name}] 请求尝试 {attempt+1}/{self.MAX_RETRIES+1}")
-                response = requests.get(url, params=params, timeout=self.TIMEOUT)
-                response.raise_for_status()
-                print(f"✅ [{service_name}] 请求成功 (状态码: {response.status_code})")
-                return response
-            except requests.exceptions.Timeout as e:
-                print(f"⌛ [{service_name}] 请求超时: {str(e)}")
-                if attempt == self.MAX_RETRIES:
-                    raise Exception(f"{service_name} 请求超过最大重试次数")
-                time.sleep(2 ** (attempt + 1))
-            except requests.exceptions.RequestException as e:
-                print(f"⚠️ [{service_name}] 请求失败: {str(e)}")
-                if attempt == self.MAX_RETRIES:
-                    raise
-                time.sleep(1)
-        return None
+        # 天气接口的单位与描述语言（lang为None时使用接口默认的英文），两者都是缓存键的一部分
+        self.units = units
+        self.lang = lang
+        self.TIMEOUT = http_session.DEFAULT_TIMEOUT  # (连接超时, 读取超时)
+        # 最多尝试次数、总时限与抖动退避（默认4次、8秒），上游异常时由熔断器快速失败
+        self.retry_policy = default_retry_policy()
+        self.GEODATA_TTL = 24 * 3600  # 地名对应的经纬度几乎不变
+        # 默认与 app.get_real_time_weather 共用进程内缓存
+        self.cache = cache if cache is not None else get_weather_cache()
+        # 按地名查询时从返回结果中记下的城市id，之后可合并到批量接口
+        self._city_ids = {}
 
-    def get_geodata(self, place_name):
-        """地理编码服务"""
-        base_url = "http://api.geonames.org/searchJSON"
-        params = {
+    def _geodata_params(self, place_name):
+        return {
             "q": place_name,
             "maxRows": 3,
             "username": self.GEONAMES_USER,
@@ -46,90 +69,454 @@ class WeatherService:
             "style": "FULL"
         }
 
-        try:
-            response = self.safe_api_call(base_url, params, "GeoNames")
-            if not response:
-                return None
-
-            data = response.json()
-            
-            # 结果筛选逻辑
-            best_result = None
-            for result in data.get('geonames', []):
-                # 优先选择首都或人口密集区
-                if result.get('fcode') == 'PPLC':  # 首都
-                    best_result = result
-                    break
-                if not best_result and result.get('population', 0) > 1000000:
-                    best_result = result
-            
-            if not best_result and data.get('geonames'):
-                best_result = data['geonames'][0]
-
-            if best_result:
-                return {
-                    "name": best_result.get('name'),
-                    "lat": float(best_result['lat']),
-                    "lon": float(best_result['lng']),
-                    "country_code": best_result.get('countryCode'),
-                    "region_code": best_result.get('adminCodes1', {}).get('ISO3166_2'),
-                    "population": best_result.get('population', 0)
-                }
-
-            raise ValueError(f"未找到有效地理信息: {place_name}")
+    def _parse_geodata(self, data, place_name):
+        # 结果筛选逻辑
+        best_result = None
+        for result in data.get('geonames', []):
+            # 优先选择首都或人口密集区
+            if result.get('fcode') == 'PPLC':  # 首都
+                best_result = result
+                break
+            if not best_result and result.get('population', 0) > 1000000:
+                best_result = result
+        
+        if not best_result and data.get('geonames'):
+            best_result = data['geonames'][0]
 
-        except Exception as e:
-            print(f"🗺️ 地理编码失败: {str(e)}")
-            return None
+        if best_result:
+            return {
+                "name": best_result.get('name'),
+                "lat": float(best_result['lat']),
+                "lon": float(best_result['lng']),
+                "country_code": best_result.get('countryCode'),
+                "region_code": best_result.get('adminCodes1', {}).get('ISO3166_2'),
+                "population": best_result.get('population', 0)
+            }
 
+        raise ValueError(f"未找到有效地理信息: {place_name}")
 
-    def get_weather(self, location=None, lat=None, lon=None):
-        """增强版天气查询"""
-        base_url = "https://api.openweathermap.org/data/2.5/weather"
-        params = {
-            "appid": self.OWM_API_KEY,
-            "units": "metric",
-            "lang": "zh_cn"
-        }
+    def _owm_params(self):
+        params = {"appid": self.OWM_API_KEY, "units": self.units}
+        if self.lang:
+            params["lang"] = self.lang
+        return params
+
+    def _weather_params(self, location=None, lat=None, lon=None, city_id=None):
+        params = self._owm_params()
 
         # 构建查询参数
         if lat is not None and lon is not None:
             print(f"🌐 使用经纬度查询: {lat},{lon}")
             params.update({"lat": lat, "lon": lon})
+        elif city_id is not None:
+            print(f"🆔 使用城市id查询: {city_id}")
+            params["id"] = city_id
         elif location:
             print(f"🌍 使用地名直接查询: {location}")
             params["q"] = location
         else:
             raise ValueError("必须提供位置参数")
+        return params
+
+    def _parse_weather(self, data):
+        if data.get('cod') != 200:
+            raise Exception(f"天气接口错误 {data.get('cod')}: {data.get('message')}")
+
+        main = data.get('main', {})
+        wind = data.get('wind', {})
+        weather = data.get('weather', [{}])[0]
+        sys = data.get('sys', {})
+
+        return {
+            "location_name": data.get('name', '未知'),
+            "country_code": sys.get('country'),
+            "temp": main.get('temp'),
+            "feels_like": main.get('feels_like'),
+            "humidity": main.get('humidity'),
+            "pressure": main.get('pressure'),
+            "weather_desc": weather.get('description'),
+            "wind_speed": wind.get('speed'),
+            "wind_deg": wind.get('deg'),
+            "coord": data.get('coord', {}),
+            "dt": datetime.fromtimestamp(data.get('dt', 0))
+        }
+
 
+    def _weather_key(self, location=None, lat=None, lon=None, city_id=None):
+        return weather_key(location, lat, lon, city_id=city_id, units=self.units, lang=self.lang)
+
+    def peek_weather(self, location):
+        """只读取缓存（不发请求），location 的形式同 get_weather_many；没有可用缓存时返回None"""
+        value, _ = self.cache.peek(self._weather_key(**self._location_args(location)))
+        return value
+
+    def _remember_city_id(self, params, data):
+        if params.get("q") and data.get('id'):
+            self._city_ids[normalize_place(params["q"])] = data['id']
+
+    @staticmethod
+    def _location_args(location):
+        """批量查询的地点：int为城市id，(lat, lon)元组为经纬度，其余按地名"""
+        if isinstance(location, int) and not isinstance(location, bool):
+            return {"city_id": location}
+        if isinstance(location, tuple):
+            lat, lon = location
+            return {"lat": lat, "lon": lon}
+        return {"location": location}
+
+    def _plan_weather_many(self, locations):
+        """
+        批量查询的准备：去重、取出仍新鲜的缓存、区分可走批量接口与只能单独查询的地点
+
+        返回：
+        keys: {地点: 缓存键}
+        values: {缓存键: 天气}（已新鲜命中的部分）
+        group: {城市id: ([缓存键], 查询参数)}（可用批量接口查询；多个地点可能对应同一城市id，如地名与其数字id，
+               查询参数用于批量接口未返回时单独查询）
+        singles: [(缓存键, 查询参数)]（逐个查询，过期条目在其中先返回旧值再后台刷新）
+        """
+        keys = {location: self._weather_key(**self._location_args(location))
+                for location in dict.fromkeys(locations)}
+        values, group, singles = {}, {}, []
+        for key, location in {key: location for location, key in reversed(list(keys.items()))}.items():
+            value, fresh = self.cache.peek(key)
+            if fresh:
+                values[key] = value
+                continue
+            args = self._location_args(location)
+            city_id = args.get("city_id")
+            if city_id is None and "location" in args:
+                city_id = self._city_ids.get(normalize_place(location))
+            # 过期但仍可用的条目单独查询：立即返回旧值并后台刷新
+            if city_id is not None and value is None:
+                group.setdefault(city_id, ([], args))[0].append(key)
+            else:
+                singles.append((key, args))
+        return keys, values, group, singles
+
+    def _group_params(self, city_ids):
+        return dict(self._owm_params(), id=",".join(str(city_id) for city_id in city_ids))
+
+    def _fill(self, keys, weather, values):
+        """同一城市的天气写入全部对应的缓存键"""
+        for key in keys:
+            self.cache.put(key, weather)
+            values[key] = weather
+
+    def _apply_group(self, data, group, values):
+        """解析批量接口结果并写入缓存，返回已获得结果的城市id集合"""
+        found = set()
+        for item in data.get('list', []):
+            if item.get('id') not in group:
+                continue
+            self._fill(group[item['id']][0], self._parse_weather(dict(item, cod=200)), values)
+            found.add(item['id'])
+        return found
+
+
+class WeatherService(_WeatherServiceBase):
+    def safe_api_call(self, url, params, service_name):
+        """
+        增强版安全API请求
+
+        重试次数与总耗时受 retry_policy 限制；超时、连接错误、429与5xx计入 service_name 对应的熔断器，
+        熔断期间直接抛出 CircuitOpenError，不占用请求线程等待。
+        """
+        policy = self.retry_policy
+        breaker = get_breaker(service_name)
+        deadline = policy.deadline()
+        for attempt in range(policy.max_attempts):
+            probe = breaker.check()
+            try:
+                try:
+                    print(f"\n🔧 [{service_name}] 请求尝试 {attempt+1}/{policy.max_attempts}")
+                    response = http_session.get(url, params=params, timeout=policy.timeout(self.TIMEOUT, deadline))
+                except requests.exceptions.Timeout as e:
+                    print(f"⌛ [{service_name}] 请求超时: {str(e)}")
+                    breaker.record_failure()
+                    error = e
+                except requests.exceptions.RequestException as e:
+                    print(f"⚠️ [{service_name}] 请求失败: {str(e)}")
+                    breaker.record_failure()
+                    error = e
+                else:
+                    if not is_retryable_status(response.status_code):
+                        # 上游可用：其余4xx（如参数或密钥错误）直接抛出，不重试
+                        breaker.record_success()
+                        response.raise_for_status()
+                        print(f"✅ [{service_name}] 请求成功 (状态码: {response.status_code})")
+                        return response
+                    print(f"⚠️ [{service_name}] 服务暂不可用 (状态码: {response.status_code})")
+                    breaker.record_failure()
+                    error = f"状态码 {response.status_code}"
+            finally:
+                # 探测请求以其他异常结束时归还，避免熔断器停留在half_open
+                breaker.release(probe)
+
+            delay = policy.next_delay(attempt, deadline)
+            if delay is None:
+                break
+            time.sleep(delay)
+        raise Exception(f"{service_name} 请求失败（尝试 {attempt+1} 次）: {error}")
+
+    def get_geodata(self, place_name):
+        """地理编码服务（结果缓存 GEODATA_TTL 秒）"""
         try:
-            response = self.safe_api_call(base_url, params, "OpenWeatherMap")
-            if not response:
-                return None
+            return self.cache.get_or_fetch(
+                geodata_key(place_name), lambda: self._fetch_geodata(place_name), ttl=self.GEODATA_TTL
+            )
+        except Exception as e:
+            print(f"🗺️ 地理编码失败: {str(e)}")
+            return None
 
-            data = response.json()
-            if data.get('cod') != 200:
-                raise Exception(f"天气接口错误 {data.get('cod')}: {data.get('message')}")
+    def _fetch_geodata(self, place_name):
+        response = self.safe_api_call(GEONAMES_URL, self._geodata_params(place_name), "GeoNames")
+        if not response:
+            return None
+        return self._parse_geodata(response.json(), place_name)
 
-            main = data.get('main', {})
-            wind = data.get('wind', {})
-            weather = data.get('weather', [{}])[0]
-            sys = data.get('sys', {})
+    def get_weather(self, location=None, lat=None, lon=None, city_id=None):
+        """增强版天气查询（按地名、经纬度或城市id缓存，过期后先返回旧值再后台刷新）"""
+        params = self._weather_params(location, lat, lon, city_id)
+        try:
+            return self.cache.get_or_fetch(
+                self._weather_key(location, lat, lon, city_id),
+                lambda: self._fetch_weather(params)
+            )
+        except Exception as e:
+            print(f"天气查询失败: {str(e)}")
+            return None
 
-            return {
-                "location_name": data.get('name', '未知'),
-                "country_code": sys.get('country'),
-                "temp": main.get('temp'),
-                "feels_like": main.get('feels_like'),
-                "humidity": main.get('humidity'),
-                "pressure": main.get('pressure'),
-                "weather_desc": weather.get('description'),
-                "wind_speed": wind.get('speed'),
-                "wind_deg": wind.get('deg'),
-                "coord": data.get('coord', {}),
-                "dt": datetime.fromtimestamp(data.get('dt', 0))
-            }
+    def _fetch_weather(self, params):
+        response = self.safe_api_call(OWM_WEATHER_URL, params, "OpenWeatherMap")
+        if not response:
+            return None
+        data = response.json()
+        self._remember_city_id(params, data)
+        return self._parse_weather(data)
+
+    def _fetch_group(self, city_ids, group, values):
+        try:
+            response = self.safe_api_call(OWM_GROUP_URL, self._group_params(city_ids), "OpenWeatherMap-group")
+            return self._apply_group(response.json(), group, values)
+        except Exception as e:
+            print(f"批量天气查询失败，改为逐个查询: {str(e)}")
+            return set()
+
+    def get_weather_many(self, locations, timeout=None):
+        """
+        批量天气查询
+
+        参数：
+        locations: 地点列表，元素为地名、OpenWeatherMap城市id（int）或 (lat, lon) 元组，重复地点只查询一次
+        timeout: 总时限（秒），None表示等待全部完成
+
+        返回：
+        {地点: 天气字典}，查询失败的地点为None，超过时限仍未完成的地点不在结果中
+
+        已知城市id的地点（直接传入id，或此前按地名查询过）通过批量接口每20个合并为一次请求，
+        其余地点单独查询；新鲜的缓存条目不发请求。请求都提交到共享线程池（见 get_weather_executor），
+        调用线程只负责等待，不另建线程池。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        keys, values, group, singles = self._plan_weather_many(locations)
+        city_ids = list(group)
+        batches = [city_ids[i:i + GROUP_MAX_IDS] for i in range(0, len(city_ids), GROUP_MAX_IDS)]
+        executor = get_weather_executor()
+        pending = {executor.submit(self.get_weather, **args): [key] for key, args in singles}
+        batch_futures = {executor.submit(self._fetch_group, batch, group, values): batch for batch in batches}
+        try:
+            for future in as_completed(batch_futures, timeout=_remaining(deadline)):
+                found = future.result()
+                # 批量接口未返回的城市改为单独查询
+                for city_id in batch_futures[future]:
+                    if city_id not in found:
+                        cache_keys, args = group[city_id]
+                        pending[executor.submit(self.get_weather, **args)] = cache_keys
+        except TimeoutError:
+            pass
+        if pending:
+            done, _ = wait(pending, timeout=_remaining(deadline))
+            for future in done:
+                self._fill(pending[future], future.result(), values)
+        return {location: values[key] for location, key in keys.items() if key in values}
+
+
+class AsyncWeatherService(_WeatherServiceBase):
+    """
+    WeatherService 的 asyncio 版本（基于 httpx.AsyncClient）
+
+    get_geodata / get_weather 为协程，返回结构与同步版本相同，与同步版本共用天气缓存。
+    等待网络时不占用线程，一个事件循环即可同时进行大量查询；
+    客户端在首次请求时于当前事件循环中创建，用完后调用 aclose() 或使用 async with。
+    """
+
+    def __init__(self, geonames_user, owm_api_key, cache=None, max_connections=50, units="metric", lang="zh_cn"):
+        """
+        参数：
+        max_connections: 连接池最大连接数（keep-alive连接数与之相同）
+        """
+        super().__init__(geonames_user, owm_api_key, cache, units, lang)
+        self.max_connections = max_connections
+        self._client = None
+
+    def _get_client(self):
+        import httpx
+
+        if self._client is None:
+            connect_timeout, read_timeout = self.TIMEOUT
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def safe_api_call(self, url, params, service_name):
+        """异步安全API请求（重试策略与熔断器与同步版本相同，等待期间不阻塞事件循环）"""
+        import httpx
+
+        client = self._get_client()
+        policy = self.retry_policy
+        breaker = get_breaker(service_name)
+        deadline = policy.deadline()
+        for attempt in range(policy.max_attempts):
+            probe = breaker.check()
+            connect_timeout, read_timeout = policy.timeout(self.TIMEOUT, deadline)
+            try:
+                try:
+                    print(f"\n🔧 [{service_name}] 请求尝试 {attempt+1}/{policy.max_attempts}")
+                    response = await client.get(
+                        url, params=params, timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+                    )
+                except httpx.TimeoutException as e:
+                    print(f"⌛ [{service_name}] 请求超时: {str(e)}")
+                    breaker.record_failure()
+                    error = e
+                except httpx.HTTPError as e:
+                    print(f"⚠️ [{service_name}] 请求失败: {str(e)}")
+                    breaker.record_failure()
+                    error = e
+                else:
+                    if not is_retryable_status(response.status_code):
+                        breaker.record_success()
+                        response.raise_for_status()
+                        print(f"✅ [{service_name}] 请求成功 (状态码: {response.status_code})")
+                        return response
+                    print(f"⚠️ [{service_name}] 服务暂不可用 (状态码: {response.status_code})")
+                    breaker.record_failure()
+                    error = f"状态码 {response.status_code}"
+            finally:
+                # 探测请求被取消（如 asyncio.wait_for 超时、客户端断开）时归还
+                breaker.release(probe)
+
+            delay = policy.next_delay(attempt, deadline)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+        raise Exception(f"{service_name} 请求失败（尝试 {attempt+1} 次）: {error}")
 
+    async def get_geodata(self, place_name):
+        """地理编码服务（结果缓存 GEODATA_TTL 秒）"""
+        try:
+            return await self.cache.aget_or_fetch(
+                geodata_key(place_name), lambda: self._fetch_geodata(place_name), ttl=self.GEODATA_TTL
+            )
+        except Exception as e:
+            print(f"🗺️ 地理编码失败: {str(e)}")
+            return None
+
+    async def _fetch_geodata(self, place_name):
+        response = await self.safe_api_call(GEONAMES_URL, self._geodata_params(place_name), "GeoNames")
+        if not response:
+            return None
+        return self._parse_geodata(response.json(), place_name)
+
+    async def get_weather(self, location=None, lat=None, lon=None, city_id=None):
+        """天气查询（与同步版本共用缓存）"""
+        params = self._weather_params(location, lat, lon, city_id)
+        try:
+            return await self.cache.aget_or_fetch(
+                self._weather_key(location, lat, lon, city_id),
+                lambda: self._fetch_weather(params)
+            )
         except Exception as e:
             print(f"天气查询失败: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+
+    async def _fetch_weather(self, params):
+        response = await self.safe_api_call(OWM_WEATHER_URL, params, "OpenWeatherMap")
+        if not response:
+            return None
+        data = response.json()
+        self._remember_city_id(params, data)
+        return self._parse_weather(data)
+
+    async def _fetch_group(self, city_ids, group, values):
+        try:
+            response = await self.safe_api_call(
+                OWM_GROUP_URL, self._group_params(city_ids), "OpenWeatherMap-group"
+            )
+            return self._apply_group(response.json(), group, values)
+        except Exception as e:
+            print(f"批量天气查询失败，改为逐个查询: {str(e)}")
+            return set()
+
+    async def get_weather_many(self, locations, concurrency=20):
+        """批量天气查询（locations与返回值同 WeatherService.get_weather_many，concurrency为同时进行的请求数上限）"""
+        keys, values, group, singles = self._plan_weather_many(locations)
+        city_ids = list(group)
+        batches = [city_ids[i:i + GROUP_MAX_IDS] for i in range(0, len(city_ids), GROUP_MAX_IDS)]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def single(cache_keys, args):
+            async with semaphore:
+                self._fill(cache_keys, await self.get_weather(**args), values)
+
+        async def batch(city_ids):
+            async with semaphore:
+                found = await self._fetch_group(city_ids, group, values)
+            # 批量接口未返回的城市改为单独查询
+            await asyncio.gather(*(single(*group[city_id]) for city_id in city_ids if city_id not in found))
+
+        await asyncio.gather(*(single([key], args) for key, args in singles), *(batch(ids) for ids in batches))
+        return {location: values.get(key) for location, key in keys.items()}
+
+    async def get_location_weather(self, place_name):
+        """先地理编码再按经纬度查询天气（与天气工具调用的流程相同），地理编码失败时按地名查询"""
+        geo_data = await self.get_geodata(place_name)
+        if geo_data is None:
+            return await self.get_weather(location=place_name)
+        return await self.get_weather(lat=geo_data["lat"], lon=geo_data["lon"])
+
+    async def gather_weather(self, place_names, concurrency=20):
+        """
+        并发查询多个地点的天气
+
+        参数：
+        place_names: 地名列表
+        concurrency: 同时进行的查询数上限
+
+        返回：
+        与输入顺序一致的天气字典列表，查询失败的地点为None
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(place_name):
+            async with semaphore:
+                return await self.get_location_weather(place_name)
+
+        return await asyncio.gather(*(fetch(place_name) for place_name in place_names))